@@ -0,0 +1,61 @@
+"""
+Measures deriving and checking 1M invoice item amounts with the Decimal path and the NumPy path, and the rounding
+drift of summing the item amounts as floats.
+
+Run with: python -m benchmarks.bench_amounts
+"""
+import random
+
+from benchmarks.utils import setup_django, timer, print_table
+
+setup_django()
+
+from django.test.utils import override_settings  # noqa: E402
+
+from invoice.amounts import compute_item_amounts, numpy, sum_amounts  # noqa: E402
+
+ITEM_COUNT = 1000000
+
+rng = random.Random(0)
+
+
+def make_items():
+    items = []
+    for index in range(ITEM_COUNT):
+        quantity = rng.randint(1, 50)
+        price = round(rng.uniform(0.01, 500), 2)
+        item = {'quantity': quantity, 'price': price}
+        if index % 2:
+            item['amount'] = round(quantity * price, 2)
+        items.append(item)
+    return items
+
+
+def main():
+    items = make_items()
+    paths = [('Decimal', ITEM_COUNT + 1)]
+    if numpy is None:
+        print('NumPy is not installed, only the Decimal path is measured')
+    else:
+        paths.append(('NumPy', 1))
+    rows = []
+    computed = {}
+    for name, numpy_min_items in paths:
+        batch = [dict(item) for item in items]
+        result = {}
+        with override_settings(INVOICE_AMOUNTS={'NUMPY_MIN_ITEMS': numpy_min_items}), timer(result, name):
+            errors = compute_item_amounts(batch)
+        computed[name] = batch
+        rows.append([name, len(errors), '%.0f' % result[name], '%.2f' % (result[name] * 1000 / ITEM_COUNT)])
+    print('%s items' % ITEM_COUNT)
+    print_table(['path', 'rejected', 'ms', 'us/item'], rows)
+    if len(computed) == 2:
+        print('NumPy amounts equal Decimal amounts: %s' % (computed['NumPy'] == computed['Decimal']))
+
+    amounts = [item['amount'] for item in computed['Decimal']]
+    exact_total = sum_amounts(amounts)
+    print('float sum %r, exact sum %r, drift %.2e' % (sum(amounts), exact_total, sum(amounts) - exact_total))
+
+
+if __name__ == '__main__':
+    main()
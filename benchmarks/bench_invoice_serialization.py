@@ -0,0 +1,53 @@
+"""
+Compares rendering invoices to JSON with InvoiceSerializer and with the values() based read path used by the
+invoice APIs, both including the queries and the JSON encoding.
+
+Run with: python -m benchmarks.bench_invoice_serialization
+"""
+from benchmarks.utils import setup_django, create_invoice, make_items, timer, print_table
+
+setup_django()
+
+from django.http import JsonResponse  # noqa: E402
+
+from invoice.models import Invoice, InvoiceItem  # noqa: E402
+from invoice.representations import serialize_invoice  # noqa: E402
+from invoice.serializers import InvoiceSerializer  # noqa: E402
+
+ITEM_COUNTS = (100, 1000, 5000)
+REPEAT = 5
+
+
+def render_with_serializer(invoice_id):
+    return JsonResponse(InvoiceSerializer(Invoice.objects.with_related().get(pk=invoice_id)).data).content
+
+
+def render_with_payload(invoice_id):
+    return JsonResponse(serialize_invoice(invoice_id)).content
+
+
+def best_time(render, invoice_id):
+    timings = []
+    for _ in range(REPEAT):
+        result = {}
+        with timer(result, 'render'):
+            render(invoice_id)
+        timings.append(result['render'])
+    return min(timings)
+
+
+def main():
+    rows = []
+    for count in ITEM_COUNTS:
+        invoice = create_invoice('BENCH-SERIALIZE-%s' % count)
+        InvoiceItem.objects.bulk_create_items(invoice, make_items(count))
+        assert render_with_serializer(invoice.pk) == render_with_payload(invoice.pk)
+        serializer = best_time(render_with_serializer, invoice.pk)
+        payload = best_time(render_with_payload, invoice.pk)
+        rows.append([count, '%.1f' % serializer, '%.1f' % payload, '%.1f' % (serializer * 1000 / count),
+                     '%.1f' % (payload * 1000 / count), '%.1fx' % (serializer / payload)])
+    print_table(['items', 'serializer ms', 'payload ms', 'serializer ms/1k', 'payload ms/1k', 'speedup'], rows)
+
+
+if __name__ == '__main__':
+    main()
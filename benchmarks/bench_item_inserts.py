@@ -0,0 +1,43 @@
+"""
+Compares inserting invoice items one row at a time with the batched inserts used by InvoiceItemManager.
+
+Run with: python -m benchmarks.bench_item_inserts
+"""
+from benchmarks.utils import setup_django, create_invoice, make_items, timer, print_table
+
+setup_django()
+
+from django.db import connection, transaction  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+
+from invoice.models import InvoiceItem  # noqa: E402
+
+ITEM_COUNTS = (10, 100, 300, 1000, 3000)
+
+
+def insert_one_by_one(invoice, invoice_items):
+    for item in invoice_items:
+        InvoiceItem.objects.create(invoice=invoice, **item)
+
+
+def count_inserts(context):
+    return sum(1 for query in context.captured_queries if query['sql'].startswith('INSERT'))
+
+
+def main():
+    rows = []
+    for count in ITEM_COUNTS:
+        invoice_items = make_items(count)
+        result = {}
+        for name, insert in (('row', insert_one_by_one), ('bulk', InvoiceItem.objects.bulk_create_items)):
+            invoice = create_invoice('BENCH-%s-%s' % (name, count))
+            with CaptureQueriesContext(connection) as context, timer(result, name), transaction.atomic():
+                insert(invoice, invoice_items)
+            result[name + '_inserts'] = count_inserts(context)
+        rows.append([count, result['row_inserts'], '%.1f' % result['row'], result['bulk_inserts'],
+                     '%.1f' % result['bulk'], '%.1fx' % (result['row'] / result['bulk'])])
+    print_table(['items', 'row INSERTs', 'row ms', 'bulk INSERTs', 'bulk ms', 'speedup'], rows)
+
+
+if __name__ == '__main__':
+    main()
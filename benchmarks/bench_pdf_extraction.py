@@ -0,0 +1,63 @@
+"""
+Measures PDF text extraction throughput of the digitization process pool for an increasing number of processes,
+over a corpus of generated invoices.
+
+Run with: python -m benchmarks.bench_pdf_extraction
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.utils import print_table
+from invoice.extraction import ExtractionPool, extract_invoice
+from invoice.pdf import build_pdf
+
+DOCUMENT_COUNT = 64
+PAGES_PER_DOCUMENT = 4
+ITEMS_PER_PAGE = 50
+
+
+def make_corpus():
+    corpus = []
+    for number in range(DOCUMENT_COUNT):
+        pages = []
+        for page in range(PAGES_PER_DOCUMENT):
+            lines = ['Invoice Number: BENCH-%05d' % number, 'Purchaser: Benchmark Purchaser',
+                     'Vendor: Benchmark Vendor', 'Terms: Net 30', 'Due Date: 2099-10-01', 'Page %s' % (page + 1)]
+            lines += ['item %s | benchmark item (%s) | %s | 10.50 | %.2f' % (index, page, index % 7 + 1,
+                                                                           (index % 7 + 1) * 10.5)
+                      for index in range(ITEMS_PER_PAGE)]
+            pages.append(lines)
+        corpus.append(build_pdf(pages))
+    return corpus
+
+
+def run_serial(corpus):
+    return sum(extract_invoice(data)['page_count'] for data in corpus)
+
+
+def run_pool(corpus, processes):
+    with ExtractionPool(processes=processes, timeout=60, start_method='spawn') as pool, \
+            ThreadPoolExecutor(max_workers=processes) as threads:
+        # Start the processes before timing
+        list(threads.map(lambda _: pool.run(len, ()), range(processes)))
+        start = time.perf_counter()
+        pages = sum(draft['page_count'] for draft in threads.map(lambda data: pool.run(extract_invoice, data), corpus))
+        return pages, time.perf_counter() - start
+
+
+def main():
+    corpus = make_corpus()
+    start = time.perf_counter()
+    pages = run_serial(corpus)
+    serial_rate = pages / (time.perf_counter() - start)
+    rows = [['in process', pages, '%.0f' % serial_rate, '1.0x']]
+    cpu_count = os.cpu_count() or 1
+    for processes in sorted({2 ** power for power in range(cpu_count.bit_length())} | {cpu_count}):
+        pages, elapsed = run_pool(corpus, processes)
+        rows.append([processes, pages, '%.0f' % (pages / elapsed), '%.1fx' % (pages / elapsed / serial_rate)])
+    print_table(['processes', 'pages', 'pages/sec', 'speedup'], rows)
+
+
+if __name__ == '__main__':
+    main()
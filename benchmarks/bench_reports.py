@@ -0,0 +1,109 @@
+"""
+Compares building a year of monthly vendor spend from the invoices, by summing the items of every invoice in Python
+through Invoice.total or by aggregating the invoices in SQL, with reading the daily summaries kept by triggers.
+
+Run with: python -m benchmarks.bench_reports
+"""
+import random
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from benchmarks.utils import setup_django, timer, print_table
+
+setup_django()
+
+import pytz  # noqa: E402
+from django.db import connection, transaction  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+
+from invoice import reports  # noqa: E402
+from invoice.models import Company, Invoice, InvoiceItem, InvoiceSummary  # noqa: E402
+
+DAYS = 365
+INVOICES_PER_DAY = 100
+ITEMS_PER_INVOICE = 5
+COMPANY_COUNT = 50
+START = datetime(2020, 1, 1, 12, tzinfo=pytz.UTC)
+
+rng = random.Random(0)
+
+
+def populate():
+    companies = Company.objects.bulk_create([
+        Company(name='Company %s' % index, address='Street', email='company%s@plate.com' % index)
+        for index in range(COMPANY_COUNT)])
+    for day in range(DAYS):
+        created_at = START + timedelta(days=day)
+        with transaction.atomic():
+            invoices, items = [], []
+            for index in range(INVOICES_PER_DAY):
+                invoice = Invoice(invoice_number='BENCH-REPORT-%s-%s' % (day, index), deu_date=created_at,
+                                  purchaser=rng.choice(companies), vendor=rng.choice(companies),
+                                  digitized=rng.random() < 0.5, item_count=ITEMS_PER_INVOICE)
+                amounts = [rng.randint(1, 100) for _ in range(ITEMS_PER_INVOICE)]
+                invoice.total_amount = sum(amounts)
+                invoices.append(invoice)
+                items += [InvoiceItem(invoice=invoice, name='item', description='benchmark item', price=amount,
+                                      amount=amount) for amount in amounts]
+            Invoice.objects.bulk_create(invoices)
+            InvoiceItem.objects.bulk_insert(items)
+            # created_at is set on insert, the update moves the invoices and their summaries to the day
+            Invoice.objects.filter(pk__in=[invoice.pk for invoice in invoices]).update(created_at=created_at)
+
+
+def python_report():
+    """
+    Monthly vendor spend computed with the total property of every invoice
+    :return: Number of rows and rows read
+    """
+    spend = defaultdict(float)
+    invoices = Invoice.objects.filter(created_at__gte=START, created_at__lt=START + timedelta(days=DAYS)) \
+        .prefetch_related('invoice_items')
+    rows_read = 0
+    for invoice in invoices:
+        spend[invoice.vendor_id, invoice.created_at.month] += invoice.total
+        rows_read += 1 + len(invoice.invoice_items.all())
+    return len(spend), rows_read
+
+
+def invoices_report():
+    """
+    Monthly vendor spend aggregated from the invoices in SQL
+    :return: Number of rows and rows read
+    """
+    reports._summaries_available[connection.settings_dict['NAME']] = False
+    try:
+        rows = reports.spend_report(created_after=START.date(), created_before=(START + timedelta(days=DAYS)).date())
+    finally:
+        reports._summaries_available.clear()
+    return len(rows), Invoice.objects.count()
+
+
+def summaries_report():
+    """
+    Monthly vendor spend read from the summaries
+    :return: Number of rows and rows read
+    """
+    rows = reports.spend_report(created_after=START.date(), created_before=(START + timedelta(days=DAYS)).date())
+    rows_read = InvoiceSummary.objects.filter(role=InvoiceSummary.VENDOR, date_field=InvoiceSummary.CREATED).count()
+    return len(rows), rows_read
+
+
+def main():
+    result = {}
+    with timer(result, 'populate'):
+        populate()
+    print('%s invoices, %s items, %s summaries, populated in %.0f ms' % (
+        Invoice.objects.count(), InvoiceItem.objects.count(), InvoiceSummary.objects.count(), result['populate']))
+
+    rows = []
+    for name, report in [('Invoice.total in Python', python_report), ('SQL over invoices', invoices_report),
+                         ('summaries', summaries_report)]:
+        with CaptureQueriesContext(connection) as queries, timer(result, name):
+            report_rows, rows_read = report()
+        rows.append([name, report_rows, rows_read, len(queries), '%.1f' % result[name]])
+    print_table(['report', 'rows', 'rows read', 'queries', 'ms'], rows)
+
+
+if __name__ == '__main__':
+    main()
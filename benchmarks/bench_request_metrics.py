@@ -0,0 +1,89 @@
+"""
+Measures the latency of the invoice list and detail APIs without the request metrics middleware, with it disabled
+and with it enabled, and prints the metrics it recorded.
+
+Run with: python -m benchmarks.bench_request_metrics
+"""
+import json
+
+from benchmarks.utils import setup_django, create_invoice, make_items, timer, print_table
+
+setup_django()
+
+from django.conf import settings  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+from rest_framework.reverse import reverse  # noqa: E402
+from rest_framework.test import APIClient  # noqa: E402
+
+from invoice.caches import get_response_cache  # noqa: E402
+from invoice.models import InvoiceItem, User  # noqa: E402
+from invoice.serializers import issue_token  # noqa: E402
+from plate_iq.metrics import registry  # noqa: E402
+
+INVOICE_COUNT = 200
+ITEMS_PER_INVOICE = 10
+REQUESTS = 300
+ROUNDS = 3
+
+
+def percentile(timings, fraction):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+
+def measure(token, urls):
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=token)
+    timings = []
+    for index in range(REQUESTS):
+        get_response_cache().clear()
+        result = {}
+        with timer(result, 'request'):
+            response = client.get(urls[index % len(urls)], {'page_size': 50})
+        assert response.status_code == 200
+        timings.append(result['request'])
+    return timings
+
+
+def main():
+    invoices = []
+    for index in range(INVOICE_COUNT):
+        invoice = create_invoice('BENCH-METRICS-%s' % index)
+        InvoiceItem.objects.create_items(invoice, make_items(ITEMS_PER_INVOICE))
+        invoices.append(invoice)
+    token = issue_token(User.objects.create(email='bench@plate.com', name='Bench', is_superuser=True))
+    urls = [reverse('invoices-list')] + [reverse('invoices-detail', args=(invoice.pk,)) for invoice in invoices[:9]]
+
+    without_middleware = [path for path in settings.MIDDLEWARE if path != 'plate_iq.metrics.RequestMetricsMiddleware']
+    configurations = [
+        ('not installed', {'MIDDLEWARE': without_middleware}),
+        ('disabled', {'REQUEST_METRICS': {'ENABLED': False}}),
+        ('enabled', {'REQUEST_METRICS': {'ENABLED': True, 'SERVER_TIMING': True}}),
+    ]
+    measure(token, urls)
+    timings = {name: [] for name, _ in configurations}
+    # Rounds alternate between the configurations so drifts of the machine affect them alike
+    for _ in range(ROUNDS):
+        registry.reset()
+        for name, overrides in configurations:
+            with override_settings(**overrides):
+                timings[name] += measure(token, urls)
+    rows = [[name, '%.2f' % percentile(timings[name], 0.5), '%.2f' % percentile(timings[name], 0.95),
+             '%.2f' % (sum(timings[name]) / len(timings[name]))] for name, _ in configurations]
+    print('%s requests per configuration, list and detail of invoices with %s items' % (REQUESTS * ROUNDS,
+                                                                                       ITEMS_PER_INVOICE))
+    print_table(['middleware', 'p50 ms', 'p95 ms', 'mean ms'], rows)
+
+    snapshot = registry.snapshot()
+    print(json.dumps({view: {'requests': metrics['duration_ms']['count'],
+                             'mean_ms': metrics['duration_ms']['mean'],
+                             'mean_db_ms': metrics['db_ms']['mean'],
+                             'mean_serialize_ms': metrics['serialize_ms']['mean'],
+                             'mean_queries': metrics['queries']['mean'],
+                             'max_duplicate_queries': metrics['duplicate_queries']['max'],
+                             'mean_response_bytes': metrics['response_bytes']['mean']}
+                      for view, metrics in snapshot.items()}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
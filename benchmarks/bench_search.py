@@ -0,0 +1,102 @@
+"""
+Measures the latency of the invoice search API over 1M invoice items indexed with FTS5, for single and multiple
+word queries, prefixes, company names and a word found in every tenth item.
+
+Run with: python -m benchmarks.bench_search
+"""
+import random
+import string
+
+from benchmarks.utils import setup_django, timer, print_table
+
+setup_django()
+
+from django.db import transaction  # noqa: E402
+from rest_framework.reverse import reverse  # noqa: E402
+from rest_framework.test import APIClient  # noqa: E402
+
+from invoice.models import Company, Invoice, InvoiceItem, User  # noqa: E402
+from invoice.serializers import issue_token  # noqa: E402
+
+INVOICE_COUNT = 10000
+ITEMS_PER_INVOICE = 100
+COMPANY_COUNT = 200
+VOCABULARY_SIZE = 5000
+COMMON_WORD = 'bulk'
+QUERIES_PER_KIND = 200
+
+rng = random.Random(0)
+
+
+def make_word():
+    return ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 9)))
+
+
+def make_words(count):
+    words = set()
+    while len(words) < count:
+        words.add(make_word())
+    return sorted(words)
+
+
+def populate(vocabulary):
+    companies = Company.objects.bulk_create([
+        Company(name='%s %s %s' % (rng.choice(vocabulary), rng.choice(vocabulary), index), address='Street',
+                email='company%s@plate.com' % index) for index in range(COMPANY_COUNT)])
+    for start in range(0, INVOICE_COUNT, 1000):
+        with transaction.atomic():
+            invoices = Invoice.objects.bulk_create([
+                Invoice(invoice_number='BENCH-SEARCH-%s' % index, terms=' '.join(rng.sample(vocabulary, 8)),
+                        purchaser=rng.choice(companies), vendor=rng.choice(companies))
+                for index in range(start, start + 1000)])
+            items = []
+            for invoice in invoices:
+                for index in range(ITEMS_PER_INVOICE):
+                    description = rng.sample(vocabulary, 5)
+                    if index % 10 == 0:
+                        description.append(COMMON_WORD)
+                    items.append(InvoiceItem(invoice=invoice, name=' '.join(rng.sample(vocabulary, 2)),
+                                             description=' '.join(description), price=1, amount=1))
+            InvoiceItem.objects.bulk_insert(items)
+    return companies
+
+
+def percentile(timings, fraction):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+
+def main():
+    vocabulary = make_words(VOCABULARY_SIZE)
+    companies = populate(vocabulary)
+    user = User.objects.create(email='bench@plate.com', name='Bench', is_superuser=True)
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=issue_token(user))
+    url = reverse('invoices-search')
+
+    query_kinds = [
+        ('one word', lambda: rng.choice(vocabulary)),
+        ('two words', lambda: ' '.join(rng.sample(vocabulary, 2))),
+        ('prefix', lambda: rng.choice(vocabulary)[:3]),
+        ('company', lambda: rng.choice(companies).name.rsplit(' ', 1)[0]),
+        ('common word', lambda: COMMON_WORD),
+    ]
+    rows = []
+    for kind, make_query in query_kinds:
+        timings = []
+        results = 0
+        for _ in range(QUERIES_PER_KIND):
+            result = {}
+            with timer(result, 'search'):
+                response = client.get(url, {'q': make_query()})
+            assert response.status_code == 200
+            results += len(response.json()['results'])
+            timings.append(result['search'])
+        rows.append([kind, '%.1f' % (results / QUERIES_PER_KIND), '%.1f' % percentile(timings, 0.5),
+                     '%.1f' % percentile(timings, 0.95), '%.1f' % max(timings)])
+    print('%s invoice items' % InvoiceItem.objects.count())
+    print_table(['query', 'results/page', 'p50 ms', 'p95 ms', 'max ms'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Compares the latency of the user list API when every listed user gets a freshly signed token, as UserSerializer
+did, with the token free UserListSerializer it uses now.
+
+Run with: python -m benchmarks.bench_user_list
+"""
+from unittest import mock
+
+from benchmarks.utils import setup_django, timer, print_table
+
+setup_django()
+
+from rest_framework.reverse import reverse  # noqa: E402
+from rest_framework.test import APIClient  # noqa: E402
+
+from invoice.models import User  # noqa: E402
+from invoice.serializers import UserSerializer  # noqa: E402
+from invoice.views import UserViewSet  # noqa: E402
+
+PAGE_SIZES = (50, 200, 500)
+REPEAT = 5
+
+
+def list_users(client, page_size):
+    response = client.get(reverse('users-list'), {'page_size': page_size})
+    assert response.status_code == 200 and len(response.json()['results']) == page_size
+
+
+def best_time(client, page_size):
+    timings = []
+    for _ in range(REPEAT):
+        result = {}
+        with timer(result, 'list'):
+            list_users(client, page_size)
+        timings.append(result['list'])
+    return min(timings)
+
+
+def main():
+    User.objects.bulk_create([User(email='bench%s@plate.com' % index, name='Bench %s' % index, password='')
+                              for index in range(max(PAGE_SIZES))])
+    client = APIClient()
+    rows = []
+    for page_size in PAGE_SIZES:
+        with mock.patch.object(UserViewSet, 'get_serializer_class', lambda _: UserSerializer):
+            before = best_time(client, page_size)
+        after = best_time(client, page_size)
+        rows.append([page_size, '%.1f' % before, '%.1f' % after, '%.1fx' % (before / after)])
+    print_table(['users', 'with tokens ms', 'without tokens ms', 'speedup'], rows)
+
+
+if __name__ == '__main__':
+    main()
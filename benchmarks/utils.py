@@ -0,0 +1,64 @@
+import os
+import time
+from contextlib import contextmanager
+
+
+def setup_django():
+    """
+    Configures Django and creates a throwaway test database so benchmarks never touch the development database
+    :return:
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'plate_iq.settings')
+    import django
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+
+
+def create_invoice(invoice_number, **kwargs):
+    """
+    Creates an invoice with a fresh purchaser and vendor
+    :param invoice_number: Invoice number
+    :return: Invoice object
+    """
+    from django.utils import timezone
+    from invoice.models import Company, Invoice
+
+    purchaser, _ = Company.objects.get_or_create(name='Benchmark Purchaser', defaults={
+        'address': 'Purchaser Street', 'email': 'purchaser@plate.com'})
+    vendor, _ = Company.objects.get_or_create(name='Benchmark Vendor', defaults={
+        'address': 'Vendor Street', 'email': 'vendor@plate.com'})
+    kwargs.setdefault('deu_date', timezone.now())
+    return Invoice.objects.create(invoice_number=invoice_number, purchaser=purchaser, vendor=vendor, **kwargs)
+
+
+def make_items(count):
+    """
+    Builds invoice item data
+    :param count: Number of items
+    :return: List of invoice item dicts
+    """
+    return [{'name': 'item %s' % index, 'description': 'benchmark item', 'quantity': index % 7 + 1,
+             'price': 10.5, 'amount': (index % 7 + 1) * 10.5} for index in range(count)]
+
+
+@contextmanager
+def timer(results, key):
+    """
+    Records the wall clock time spent in the block, in milliseconds
+    :param results: Dict the timing is stored in
+    :param key: Key of the timing
+    :return:
+    """
+    start = time.perf_counter()
+    yield
+    results[key] = (time.perf_counter() - start) * 1000
+
+
+def print_table(headers, rows):
+    widths = [max(len(str(value)) for value in column) for column in zip(headers, *rows)]
+    for row in [headers] + rows:
+        print('  '.join(str(value).rjust(width) for value, width in zip(row, widths)))
@@ -0,0 +1,125 @@
+import threading
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction, IntegrityError
+from django.db.models import F
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from invoice.models import Invoice, InvoiceNumberSequence
+from invoice.utils import generate_invoice_number
+
+_allocator = None
+_allocator_lock = threading.Lock()
+
+
+class BaseInvoiceNumberAllocator:
+    """
+    Hands out invoice numbers for new invoices
+    """
+
+    def allocate(self):
+        return self.allocate_many(1)[0]
+
+    def allocate_many(self, count):
+        raise NotImplementedError('`allocate_many()` must be implemented.')
+
+
+class RandomInvoiceNumberAllocator(BaseInvoiceNumberAllocator):
+    """
+    Draws random invoice numbers and checks them against the invoices table. The number space is small, so this
+    gets slower as the table fills up
+    """
+
+    def __init__(self, length=5):
+        self.length = length
+
+    def allocate_many(self, count):
+        invoice_numbers = set()
+        while len(invoice_numbers) < count:
+            candidates = {generate_invoice_number(self.length) for _ in range(count - len(invoice_numbers))}
+            candidates -= invoice_numbers
+            invoice_numbers |= candidates - set(Invoice.objects.filter(invoice_number__in=candidates)
+                                                .values_list('invoice_number', flat=True))
+        return list(invoice_numbers)
+
+
+class BlockInvoiceNumberAllocator(BaseInvoiceNumberAllocator):
+    """
+    Formats values of a database backed sequence. Each process reserves a block of values with a single UPDATE and
+    hands them out from memory until the block is used up, so most allocations do not touch the database. Blocks
+    are never shared, which makes the numbers unique across processes and threads; values of a block left unused
+    when a process exits are skipped.
+
+    Inside a transaction the reservation is undone if the transaction rolls back, so there only the values needed
+    are reserved and none are kept for later allocations. Those reservations hold the lock of the sequence row until
+    the transaction ends, allocate before opening transactions to keep it short
+    """
+
+    def __init__(self, sequence='invoice_number', block_size=100, number_format='INV{:010d}', start=1):
+        self.sequence = sequence
+        self.block_size = block_size
+        self.number_format = number_format
+        self.start = start
+        self.lock = threading.Lock()
+        self.next_value = self.block_end = 0
+
+    def reserve_block(self, size):
+        """
+        Moves the sequence forward by size
+        :param size: Number of values to reserve
+        :return: Tuple of the first value of the block and the value after its last one
+        """
+        with transaction.atomic():
+            sequences = InvoiceNumberSequence.objects.filter(name=self.sequence)
+            if not sequences.update(next_value=F('next_value') + size):
+                try:
+                    with transaction.atomic():
+                        InvoiceNumberSequence.objects.create(name=self.sequence, next_value=self.start + size)
+                    return self.start, self.start + size
+                except IntegrityError:
+                    # Another process created the sequence first
+                    sequences.update(next_value=F('next_value') + size)
+            block_end = sequences.values_list('next_value', flat=True).get()
+        return block_end - size, block_end
+
+    def allocate_many(self, count):
+        values = []
+        with self.lock:
+            while len(values) < count:
+                if self.next_value >= self.block_end:
+                    if transaction.get_connection().in_atomic_block:
+                        values.extend(range(*self.reserve_block(count - len(values))))
+                        break
+                    self.next_value, self.block_end = self.reserve_block(max(self.block_size, count - len(values)))
+                taken = min(count - len(values), self.block_end - self.next_value)
+                values.extend(range(self.next_value, self.next_value + taken))
+                self.next_value += taken
+        return [self.number_format.format(value) for value in values]
+
+
+def get_invoice_number_allocator():
+    """
+    Returns the process wide allocator configured by the INVOICE_NUMBER_ALLOCATOR setting
+    :return: Invoice number allocator
+    """
+    global _allocator
+    with _allocator_lock:
+        if _allocator is None:
+            config = getattr(settings, 'INVOICE_NUMBER_ALLOCATOR', {})
+            allocator_class = import_string(config.get('BACKEND', 'invoice.allocators.BlockInvoiceNumberAllocator'))
+            _allocator = allocator_class(**config.get('OPTIONS', {}))
+        return _allocator
+
+
+def allocate_invoice_number():
+    return get_invoice_number_allocator().allocate()
+
+
+@receiver(setting_changed)
+def reset_allocator(setting, **_):
+    global _allocator
+    if setting == 'INVOICE_NUMBER_ALLOCATOR':
+        with _allocator_lock:
+            _allocator = None
@@ -0,0 +1,143 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from django.conf import settings
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+CENT = Decimal('0.01')
+CENTS_PER_UNIT = 100
+
+# The NumPy path computes in integers scaled by 10 ** PRICE_DECIMAL_PLACES. Prices and amounts with more decimal
+# places, or too large for the scaled float to be unambiguous, are left to the Decimal path
+PRICE_DECIMAL_PLACES = 6
+PRICE_SCALE = 10 ** PRICE_DECIMAL_PLACES
+MAX_EXACT_VALUE = 10 ** 9
+MAX_SCALED_PRODUCT = 2 ** 62
+
+AMOUNT_MISMATCH = 'Amount must be quantity times price, %s.'
+AMOUNT_INVALID = 'Amount cannot be computed from this quantity and price.'
+
+
+def get_amounts_config():
+    config = {'NUMPY_MIN_ITEMS': 1000}
+    config.update(getattr(settings, 'INVOICE_AMOUNTS', {}))
+    return config
+
+
+def to_decimal(value):
+    """
+    Converts an item number to the Decimal it was written as, floats are read through their shortest repr
+    :param value: Integer, float or Decimal
+    :return: Decimal
+    """
+    return Decimal(repr(value)) if isinstance(value, float) else Decimal(value)
+
+
+def to_cents(amount):
+    """
+    :param amount: Amount with at most two decimal places
+    :return: Integer number of cents
+    """
+    return round(amount * CENTS_PER_UNIT)
+
+
+def sum_amounts(amounts):
+    """
+    Sums item amounts in integer cents, so the total does not depend on the order or number of items the way a sum
+    of floats does
+    :param amounts: Iterable of amounts
+    :return: Float total, the nearest float to the exact sum
+    """
+    return sum(to_cents(amount) for amount in amounts) / CENTS_PER_UNIT
+
+
+def compute_item_amounts(invoice_items):
+    """
+    Derives the amount of every item as its quantity times its price, rounded half up to cents with exact decimal
+    arithmetic, and checks the amounts provided against it. Amounts are stored on the items in place. Batches of at
+    least NUMPY_MIN_ITEMS items are computed in integers with NumPy when it is installed
+    :param invoice_items: List of item dicts with quantity and price, and optionally amount
+    :return: Dict of item index and error message for the items whose amount does not match
+    """
+    cents, inexact = [None] * len(invoice_items), range(len(invoice_items))
+    if numpy is not None and len(invoice_items) >= get_amounts_config()['NUMPY_MIN_ITEMS']:
+        try:
+            cents, inexact = compute_cents_numpy(invoice_items)
+        except OverflowError:
+            # Quantities beyond int64, left to the Decimal path
+            pass
+    for index in inexact:
+        cents[index] = compute_cents_decimal(invoice_items[index])
+
+    errors = {}
+    for index, (item, (expected, provided)) in enumerate(zip(invoice_items, cents)):
+        if expected is None:
+            errors[index] = AMOUNT_INVALID
+        elif provided is not None and provided != expected:
+            errors[index] = AMOUNT_MISMATCH % (Decimal(expected) * CENT)
+        else:
+            item['amount'] = expected / CENTS_PER_UNIT
+    return errors
+
+
+def compute_cents_decimal(item):
+    """
+    :param item: Item dict
+    :return: Tuple of the expected and the provided amount in cents, None when they cannot be computed
+    """
+    try:
+        expected = (item.get('quantity', 1) * to_decimal(item['price'])).quantize(CENT, rounding=ROUND_HALF_UP)
+        provided = item.get('amount')
+        if provided is not None:
+            provided = int(to_decimal(provided).quantize(CENT, rounding=ROUND_HALF_UP) * CENTS_PER_UNIT)
+        return int(expected * CENTS_PER_UNIT), provided
+    except (InvalidOperation, ValueError, OverflowError):
+        return None, None
+
+
+def round_half_up(units, divisor):
+    return numpy.sign(units) * ((numpy.abs(units) + divisor // 2) // divisor)
+
+
+def to_scaled_units(values):
+    """
+    Scales floats by PRICE_SCALE to integers, exact when the float is the nearest one to a decimal with at most
+    PRICE_DECIMAL_PLACES places. Below MAX_EXACT_VALUE such decimals are further apart than floats, so that decimal
+    is the one the float was written as
+    :param values: Float array
+    :return: Tuple of the int64 array and the mask of exactly scaled values
+    """
+    with numpy.errstate(invalid='ignore', over='ignore'):
+        units = numpy.rint(values * PRICE_SCALE)
+        exact = (numpy.abs(values) < MAX_EXACT_VALUE) & (units / PRICE_SCALE == values)
+    return numpy.where(exact, units, 0).astype(numpy.int64), exact
+
+
+def compute_cents_numpy(invoice_items):
+    """
+    Vectorized compute_cents_decimal over integers scaled by PRICE_SCALE
+    :param invoice_items: List of item dicts
+    :return: List of expected and provided amount in cents tuples, and the indexes left to the Decimal path
+    """
+    count = len(invoice_items)
+    quantities = numpy.fromiter((item.get('quantity', 1) for item in invoice_items), dtype=numpy.int64, count=count)
+    prices = numpy.fromiter((item['price'] for item in invoice_items), dtype=numpy.float64, count=count)
+    amounts = numpy.fromiter((item.get('amount', numpy.nan) for item in invoice_items), dtype=numpy.float64,
+                             count=count)
+
+    price_units, exact = to_scaled_units(prices)
+    exact &= numpy.abs(quantities).astype(numpy.float64) * numpy.abs(price_units) < MAX_SCALED_PRODUCT
+    provided = ~numpy.isnan(amounts)
+    amount_units, amount_exact = to_scaled_units(amounts)
+    exact &= amount_exact | ~provided
+
+    divisor = PRICE_SCALE // CENTS_PER_UNIT
+    expected_cents = round_half_up(quantities * price_units, divisor).tolist()
+    provided_cents = numpy.where(provided, round_half_up(amount_units, divisor), -1).tolist()
+    has_amount = provided.tolist()
+    cents = [(expected, amount if present else None)
+             for expected, amount, present in zip(expected_cents, provided_cents, has_amount)]
+    return cents, numpy.flatnonzero(~exact).tolist()
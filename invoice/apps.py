@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class InvoiceConfig(AppConfig):
     name = 'invoice'
+
+    def ready(self):
+        # Connects the invoices_changed receivers
+        from invoice import caches, notifications  # noqa: F401
@@ -0,0 +1,30 @@
+from django.contrib.auth import get_user_model
+from django.utils.translation import ugettext as _
+from rest_framework import exceptions
+from rest_framework_jwt.authentication import JSONWebTokenAuthentication, jwt_get_username_from_payload
+
+from invoice.caches import get_user_cache
+
+
+class CachedJSONWebTokenAuthentication(JSONWebTokenAuthentication):
+    """
+    JWT authentication loading the user of the token from the user cache, the database is only queried on a miss
+    """
+
+    def authenticate_credentials(self, payload):
+        username = jwt_get_username_from_payload(payload)
+        if not username:
+            raise exceptions.AuthenticationFailed(_('Invalid payload.'))
+
+        user_cache = get_user_cache()
+        user = user_cache.get(username)
+        if user is None:
+            try:
+                user = get_user_model().objects.get_by_natural_key(username)
+            except get_user_model().DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid signature.'))
+            user_cache.set(user)
+
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User account is disabled.'))
+        return user
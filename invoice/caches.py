@@ -0,0 +1,287 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import connections, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from invoice.signals import invoices_changed
+
+_cache = None
+_cache_lock = threading.Lock()
+_user_cache = None
+
+
+class BaseResponseCache:
+    """
+    Caches rendered invoice responses by invoice id. Every entry records the version of the invoice it was rendered
+    from and is only served for that version, so a change that was not invalidated explicitly never serves a stale
+    response. Hit and miss counters are kept per process
+    """
+
+    def __init__(self):
+        self.hits = self.misses = 0
+        self.stats_lock = threading.Lock()
+
+    def get(self, key, version):
+        """
+        Returns the cached response of an invoice
+        :param key: Invoice id
+        :param version: Current version of the invoice
+        :return: Response content, or None on a miss
+        """
+        entry = self.load(key)
+        hit = entry is not None and entry[0] == version
+        with self.stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return entry[1] if hit else None
+
+    def set(self, key, version, content):
+        self.store(key, (version, content))
+
+    def invalidate(self, keys):
+        for key in keys:
+            self.remove(key)
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': '%s.%s' % (type(self).__module__, type(self).__name__),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            'entries': self.count(),
+        }
+
+    def load(self, key):
+        raise NotImplementedError('`load()` must be implemented.')
+
+    def store(self, key, entry):
+        raise NotImplementedError('`store()` must be implemented.')
+
+    def remove(self, key):
+        raise NotImplementedError('`remove()` must be implemented.')
+
+    def count(self):
+        return None
+
+    def clear(self):
+        raise NotImplementedError('`clear()` must be implemented.')
+
+
+class LRUResponseCache(BaseResponseCache):
+    """
+    In-process cache bounded by a number of entries and optionally by the total size of the cached responses, the
+    least recently used entries are evicted first
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=None):
+        super().__init__()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def load(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def store(self, key, entry):
+        with self.lock:
+            self.pop(key)
+            self.entries[key] = entry
+            self.size += len(entry[1])
+            while self.entries and (len(self.entries) > self.max_entries or
+                                    self.max_bytes is not None and self.size > self.max_bytes):
+                self.pop(next(iter(self.entries)))
+
+    def remove(self, key):
+        with self.lock:
+            self.pop(key)
+
+    def pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+    def count(self):
+        return len(self.entries)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+class DjangoResponseCache(BaseResponseCache):
+    """
+    Stores the responses in one of the caches configured in CACHES, e.g. a local memory or file based cache
+    """
+
+    def __init__(self, cache_alias='default', timeout=300, key_prefix='invoice-response'):
+        super().__init__()
+        self.cache = caches[cache_alias]
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+
+    def make_key(self, key):
+        return '%s:%s' % (self.key_prefix, key)
+
+    def load(self, key):
+        return self.cache.get(self.make_key(key))
+
+    def store(self, key, entry):
+        self.cache.set(self.make_key(key), entry, self.timeout)
+
+    def remove(self, key):
+        self.cache.delete(self.make_key(key))
+
+    def clear(self):
+        self.cache.clear()
+
+
+def get_response_cache():
+    """
+    Returns the process wide response cache configured by the INVOICE_RESPONSE_CACHE setting
+    :return: Response cache
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            config = getattr(settings, 'INVOICE_RESPONSE_CACHE', {})
+            cache_class = import_string(config.get('BACKEND', 'invoice.caches.LRUResponseCache'))
+            _cache = cache_class(**config.get('OPTIONS', {}))
+        return _cache
+
+
+class UserCache:
+    """
+    Bounded in-process cache of the users authenticated by their JWT, keyed by username. Entries expire after
+    `ttl` seconds and are dropped as soon as the user is saved or deleted in this process; changes made in other
+    processes or with queryset updates are picked up once the entry expired. Every hit is a query saved
+    """
+
+    def __init__(self, max_entries=10000, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # Username and the expiry time, id, database alias and field values of the user, least recently used first
+        self.entries = OrderedDict()
+        self.usernames = {}
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, username):
+        """
+        Returns a cached user, a new instance every time so requests never share one
+        :param username: Username of the user
+        :return: User object, or None on a miss
+        """
+        with self.lock:
+            entry = self.entries.get(username)
+            if entry is not None and entry[0] <= time.monotonic():
+                self.pop(username)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(username)
+            self.hits += 1
+        _, _, db, field_names, values = entry
+        return get_user_model().from_db(db, field_names, values)
+
+    def set(self, user):
+        """
+        Caches a user loaded from the database. Users read inside a transaction are not cached, the transaction may
+        still be rolled back
+        :param user: User object
+        :return:
+        """
+        if self.ttl <= 0 or connections[user._state.db].in_atomic_block:
+            return
+        fields = user._meta.concrete_fields
+        entry = (time.monotonic() + self.ttl, user.pk, user._state.db, [field.attname for field in fields],
+                 [getattr(user, field.attname) for field in fields])
+        username = user.get_username()
+        with self.lock:
+            self.pop(username)
+            self.entries[username] = entry
+            self.usernames[user.pk] = username
+            while len(self.entries) > self.max_entries:
+                self.pop(next(iter(self.entries)))
+
+    def invalidate(self, user_id):
+        with self.lock:
+            username = self.usernames.get(user_id)
+            if username is not None:
+                self.pop(username)
+
+    def pop(self, username):
+        entry = self.entries.pop(username, None)
+        if entry is not None and self.usernames.get(entry[1]) == username:
+            del self.usernames[entry[1]]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.usernames.clear()
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            'saved_queries': self.hits,
+            'entries': len(self.entries),
+        }
+
+
+def get_user_cache():
+    """
+    Returns the process wide user cache configured by the INVOICE_USER_CACHE setting
+    :return: UserCache object
+    """
+    global _user_cache
+    with _cache_lock:
+        if _user_cache is None:
+            config = getattr(settings, 'INVOICE_USER_CACHE', {})
+            _user_cache = UserCache(max_entries=config.get('MAX_ENTRIES', 10000), ttl=config.get('TTL', 60))
+        return _user_cache
+
+
+@receiver(invoices_changed)
+def invalidate_responses(invoice_ids, **_):
+    get_response_cache().invalidate(invoice_ids)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_user(instance, **_):
+    user_id = instance.pk
+    get_user_cache().invalidate(user_id)
+    # Requests running until the commit may still cache the old row
+    transaction.on_commit(lambda: get_user_cache().invalidate(user_id))
+
+
+@receiver(setting_changed)
+def reset_caches(setting, **_):
+    global _cache, _user_cache
+    if setting == 'INVOICE_RESPONSE_CACHE':
+        with _cache_lock:
+            _cache = None
+    elif setting == 'INVOICE_USER_CACHE':
+        with _cache_lock:
+            _user_cache = None
@@ -0,0 +1,141 @@
+import hashlib
+
+from django.db import transaction
+from django.http import HttpResponseNotModified, JsonResponse
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.generics import get_object_or_404
+
+
+def get_etag(version):
+    return quote_etag(version)
+
+
+def get_digest(values):
+    return hashlib.md5(repr(values).encode('utf-8')).hexdigest()
+
+
+def if_none_match(request, etag):
+    """
+    Checks the If-None-Match header of a request with the weak comparison, as RFC 7232 requires for it
+    :param request: API request
+    :param etag: Current ETag of the resource
+    :return: Whether the client already has the current representation
+    """
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    etags = parse_etags(header)
+    return '*' in etags or etag in [tag[2:] if tag.startswith('W/') else tag for tag in etags]
+
+
+def if_match(request, etag):
+    """
+    Checks the If-Match header of a request with the strong comparison, a request without the header matches
+    :param request: API request
+    :param etag: Current ETag of the resource
+    :return: Whether the request may modify the resource
+    """
+    header = request.META.get('HTTP_IF_MATCH')
+    if not header:
+        return True
+    etags = parse_etags(header)
+    return '*' in etags or etag in etags
+
+
+def not_modified(etag):
+    response = HttpResponseNotModified()
+    response['ETag'] = etag
+    return response
+
+
+class ConditionalMixin:
+    """
+    Answers conditional requests of a viewset with ETags computed from a cheap version query instead of the
+    serialized data: If-None-Match on retrieve and list pages gets a 304 without serializing anything, and If-Match
+    on updates gets a 412 when the object changed since the client read it
+    """
+    # Key of the error message of a failed precondition, also the name of the object in the message
+    precondition_failed_key = 'object'
+
+    def get_version_queryset(self):
+        """
+        Queryset of dicts with the pk and what the version of the objects is computed from
+        :return: Queryset
+        """
+        raise NotImplementedError('`get_version_queryset()` must be implemented.')
+
+    def get_row_version(self, row):
+        return get_digest(row['updated_at'])
+
+    def get_lookup_filter(self):
+        return {self.lookup_field: self.kwargs[self.lookup_url_kwarg or self.lookup_field]}
+
+    def get_version_row(self):
+        return get_object_or_404(self.get_version_queryset(), **self.get_lookup_filter())
+
+    def get_object_etag(self):
+        return get_etag(self.get_row_version(self.get_version_row()))
+
+    def get_list_etag(self):
+        """
+        Computes the ETag of the requested list page from the versions of its objects, read with the same filters
+        and pagination as the page itself, and from the query parameters the page was requested with
+        :return: ETag
+        """
+        versions = self.filter_queryset(self.get_version_queryset())
+        page_versions = None
+        if self.paginator is not None:
+            page_versions = self.paginator.get_page_queryset(versions, self.request, self)
+        if page_versions is not None:
+            versions = page_versions
+        rows = [(row['pk'], self.get_row_version(row)) for row in versions]
+        return get_etag(get_digest((self.request.get_full_path(), rows)))
+
+    def check_if_match(self, request):
+        """
+        Compares the If-Match header with the current ETag of the object, the object is locked until the end of the
+        transaction so no other update slips in between the check and the write. Must be called in a transaction
+        :param request: API request
+        :return: 412 response when the object changed, otherwise None
+        """
+        if not request.META.get('HTTP_IF_MATCH'):
+            return None
+        queryset = self.get_version_queryset().model.objects.select_for_update()
+        get_object_or_404(queryset.values_list('pk'), **self.get_lookup_filter())
+        etag = self.get_object_etag()
+        if if_match(request, etag):
+            return None
+        message = 'The %s was modified since it was fetched.' % self.precondition_failed_key
+        response = JsonResponse({self.precondition_failed_key: message}, status=status.HTTP_412_PRECONDITION_FAILED)
+        response['ETag'] = etag
+        return response
+
+    def list(self, request, *args, **kwargs):
+        etag = self.get_list_etag()
+        if if_none_match(request, etag):
+            return not_modified(etag)
+        response = super().list(request, *args, **kwargs)
+        response['ETag'] = etag
+        return response
+
+    def conditional_update(self, request, serializer, save):
+        """
+        Saves an update only when the If-Match precondition holds and sets the new ETag on its response. The
+        serializer is validated before, outside of any transaction, and the transaction locking the object is only
+        opened for requests with an If-Match header
+        :param request: API request
+        :param serializer: Validated serializer of the update
+        :param save: Function saving the serializer and returning the response
+        :return: API response
+        """
+        if not request.META.get('HTTP_IF_MATCH'):
+            response = save(serializer)
+        else:
+            with transaction.atomic():
+                response = self.check_if_match(request)
+                if response is None:
+                    response = save(serializer)
+        if status.is_success(response.status_code):
+            response['ETag'] = self.get_object_etag()
+        return response
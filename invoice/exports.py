@@ -0,0 +1,62 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+CSV_INVOICE_FIELDS = ('id', 'invoice_number', 'terms', 'deu_date', 'digitized', 'total', 'created_at', 'updated_at')
+CSV_COMPANY_FIELDS = ('purchaser', 'vendor')
+CSV_USER_FIELDS = ('created_by', 'digitized_by')
+CSV_ITEM_FIELDS = ('id', 'name', 'description', 'quantity', 'price', 'amount')
+CSV_HEADER = CSV_INVOICE_FIELDS + \
+    tuple('%s_%s' % (field, key) for field in CSV_COMPANY_FIELDS for key in ('id', 'name')) + \
+    tuple('%s_email' % field for field in CSV_USER_FIELDS) + \
+    tuple('item_%s' % field for field in CSV_ITEM_FIELDS)
+
+
+class Echo:
+    """
+    File like object handing back what is written to it, lets csv.writer produce lines for a streaming response
+    """
+
+    @staticmethod
+    def write(value):
+        return value
+
+
+def iter_ndjson(invoice_chunks):
+    """
+    Renders invoices as newline delimited JSON, one serialized invoice per line
+    :param invoice_chunks: Iterable of serialized invoice lists
+    :return: Generator of lines
+    """
+    for invoices in invoice_chunks:
+        yield ''.join(json.dumps(invoice, cls=DjangoJSONEncoder) + '\n' for invoice in invoices)
+
+
+def get_csv_rows(invoice):
+    """
+    Flattens a serialized invoice into one CSV row per invoice item, or a single row without item columns
+    :param invoice: Serialized invoice
+    :return: List of rows
+    """
+    row = [invoice[field] for field in CSV_INVOICE_FIELDS]
+    for field in CSV_COMPANY_FIELDS:
+        company = invoice[field] or {}
+        row += [company.get('id'), company.get('name')]
+    for field in CSV_USER_FIELDS:
+        row.append((invoice[field] or {}).get('email'))
+    if not invoice['invoice_items']:
+        return [row + [None] * len(CSV_ITEM_FIELDS)]
+    return [row + [item[field] for field in CSV_ITEM_FIELDS] for item in invoice['invoice_items']]
+
+
+def iter_csv(invoice_chunks):
+    """
+    Renders invoices as CSV with a header line
+    :param invoice_chunks: Iterable of serialized invoice lists
+    :return: Generator of CSV lines
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for invoices in invoice_chunks:
+        yield ''.join(writer.writerow(row) for invoice in invoices for row in get_csv_rows(invoice))
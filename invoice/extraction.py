@@ -0,0 +1,255 @@
+import multiprocessing
+import os
+import re
+import threading
+from datetime import datetime
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from invoice.pdf import extract_pages
+
+FIELD_RE = re.compile(r'^\s*(?P<label>[A-Za-z][A-Za-z .#]*?)\s*:\s*(?P<value>\S.*?)\s*$')
+FIELD_LABELS = {
+    'invoice number': 'invoice_number',
+    'invoice no': 'invoice_number',
+    'invoice': 'invoice_number',
+    'purchaser': 'purchaser',
+    'bill to': 'purchaser',
+    'vendor': 'vendor',
+    'sold by': 'vendor',
+    'terms': 'terms',
+    'payment terms': 'terms',
+    'due date': 'deu_date',
+}
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y', '%d %b %Y', '%d %B %Y', '%b %d, %Y', '%B %d, %Y')
+ITEM_COLUMNS = ('name', 'description', 'quantity', 'price', 'amount')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class ExtractionError(Exception):
+    pass
+
+
+class ExtractionTimeout(ExtractionError):
+    pass
+
+
+def parse_number(value):
+    return float(re.sub(r'[^0-9.\-]', '', value))
+
+
+def parse_due_date(value):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_item(line):
+    """
+    Reads an invoice item from a table row in the `name | description | quantity | price | amount` layout
+    :param line: Line of text
+    :return: Invoice item dict, or None when the line is not an item row
+    """
+    cells = [cell.strip() for cell in line.split('|')]
+    if len(cells) != len(ITEM_COLUMNS) or not cells[0]:
+        return None
+    item = dict(zip(ITEM_COLUMNS, cells))
+    try:
+        quantity = parse_number(item['quantity'])
+        item['price'], item['amount'] = parse_number(item['price']), parse_number(item['amount'])
+    except ValueError:
+        return None
+    if quantity != int(quantity):
+        return None
+    item['quantity'] = int(quantity)
+    return item
+
+
+def parse_invoice_text(text):
+    """
+    Finds invoice details in the text of an invoice. Fields are read from `Label: value` lines and items from
+    table rows separated by `|`
+    :param text: Text of the invoice
+    :return: Dict with the draft invoice fields and the list of invoice items
+    """
+    fields, invoice_items = {}, []
+    for line in text.splitlines():
+        item = parse_item(line)
+        if item is not None:
+            invoice_items.append(item)
+            continue
+        match = FIELD_RE.match(line)
+        if not match:
+            continue
+        field = FIELD_LABELS.get(' '.join(re.sub(r'[^a-z ]', '', match.group('label').lower()).split()))
+        if field is None or field in fields:
+            continue
+        value = match.group('value')
+        if field == 'deu_date':
+            value = parse_due_date(value)
+        if value:
+            fields[field] = value
+    return {'fields': fields, 'invoice_items': invoice_items}
+
+
+def extract_invoice(data):
+    """
+    Extracts a draft invoice from a PDF, runs in the extraction processes
+    :param data: PDF file contents
+    :return: Dict with the page count, the draft invoice fields and the invoice items
+    """
+    pages = extract_pages(data)
+    return dict(parse_invoice_text('\n'.join(pages)), page_count=len(pages))
+
+
+def serve(connection):
+    """
+    Main loop of an extraction process, runs the tasks received on the connection until it is closed
+    :param connection: Pipe connection to the pool
+    :return:
+    """
+    while True:
+        try:
+            function, args = connection.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            result = (True, function(*args))
+        except Exception as error:
+            result = (False, str(error) or error.__class__.__name__)
+        try:
+            connection.send(result)
+        except Exception as error:
+            connection.send((False, 'Result could not be sent: %s' % error))
+
+
+class ExtractionProcess:
+    def __init__(self, context):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=serve, args=(child_connection,), daemon=True)
+        self.process.start()
+        child_connection.close()
+        self.tasks = 0
+
+    def stop(self, kill=False):
+        self.connection.close()
+        if kill:
+            self.process.kill()
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+
+
+class ExtractionPool:
+    """
+    Runs CPU bound extraction tasks in a pool of worker processes, so parsing scales with the number of cores and
+    never blocks the threads of the calling process on the GIL. Callers block while every process is busy, so at
+    most one task per process is in flight.
+
+    Every task runs in a known process: a task exceeding its timeout gets its process killed and replaced, and a
+    process that crashes only fails the task it was running
+    """
+
+    def __init__(self, processes=None, timeout=None, max_tasks_per_process=None, start_method=None):
+        self.processes = processes or os.cpu_count() or 1
+        self.timeout = timeout
+        self.max_tasks_per_process = max_tasks_per_process
+        self.context = multiprocessing.get_context(start_method)
+        self.slots = threading.BoundedSemaphore(self.processes)
+        self.lock = threading.Lock()
+        self.idle = []
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def run(self, function, *args, timeout=None):
+        """
+        Runs a function in one of the processes
+        :param function: Picklable function
+        :param args: Picklable arguments
+        :param timeout: Seconds after which the task is abandoned, defaults to the pool timeout
+        :return: Return value of the function
+        """
+        timeout = self.timeout if timeout is None else timeout
+        with self.slots:
+            process = self.checkout()
+            try:
+                process.connection.send((function, args))
+                if not process.connection.poll(timeout):
+                    raise ExtractionTimeout('Extraction timed out after %s seconds.' % timeout)
+                success, result = process.connection.recv()
+            except BaseException as error:
+                # The process may be halfway through a task, it is only checked in after a complete exchange
+                process.stop(kill=True)
+                if isinstance(error, (EOFError, OSError)):
+                    raise ExtractionError('Extraction process exited unexpectedly.')
+                raise
+            self.checkin(process)
+        if not success:
+            raise ExtractionError(result)
+        return result
+
+    def checkout(self):
+        with self.lock:
+            if self.closed:
+                raise ExtractionError('Extraction pool is closed.')
+            if self.idle:
+                return self.idle.pop()
+        return ExtractionProcess(self.context)
+
+    def checkin(self, process):
+        process.tasks += 1
+        with self.lock:
+            # Processes are recycled after a number of tasks to release memory held by the parser
+            if not self.closed and process.tasks != self.max_tasks_per_process:
+                self.idle.append(process)
+                return
+        process.stop()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            processes, self.idle = self.idle, []
+        for process in processes:
+            process.stop()
+
+
+def get_extraction_pool():
+    """
+    Returns the process wide extraction pool configured by the INVOICE_DIGITIZATION setting
+    :return: ExtractionPool object
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            config = getattr(settings, 'INVOICE_DIGITIZATION', {})
+            _pool = ExtractionPool(processes=config.get('PROCESSES'), timeout=config.get('EXTRACTION_TIMEOUT', 60),
+                                   max_tasks_per_process=config.get('MAX_TASKS_PER_PROCESS', 100),
+                                   start_method=config.get('START_METHOD', 'spawn'))
+        return _pool
+
+
+def close_extraction_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
+
+
+@receiver(setting_changed)
+def reset_extraction_pool(setting, **_):
+    if setting == 'INVOICE_DIGITIZATION':
+        close_extraction_pool()
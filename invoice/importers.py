@@ -0,0 +1,204 @@
+import csv
+import json
+from collections import Counter
+from itertools import groupby, islice
+
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from rest_framework import serializers
+
+from invoice.allocators import get_invoice_number_allocator
+from invoice.amounts import compute_item_amounts
+from invoice.models import Invoice, InvoiceItem, Company
+from invoice.serializers import InvoiceImportSerializer
+
+CSV_ITEM_COLUMNS = ('name', 'description', 'quantity', 'price', 'amount')
+
+
+def read_ndjson(lines):
+    """
+    Reads invoices from newline delimited JSON, one invoice per line in the format of the create invoice API
+    :param lines: Iterable of text lines
+    :return: Generator of invoice dicts, or ValueError for lines that could not be parsed
+    """
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield ValueError('Invalid JSON.')
+
+
+def read_csv(lines):
+    """
+    Reads invoices from CSV with one row per invoice item, as written by the export API. Consecutive rows with the
+    same invoice number form one invoice
+    :param lines: Iterable of text lines
+    :return: Generator of invoice dicts, or ValueError for rows without invoice number
+    """
+    for invoice_number, rows in groupby(csv.DictReader(lines), key=lambda row: row.get('invoice_number')):
+        rows = list(rows)
+        if not invoice_number:
+            for _ in rows:
+                yield ValueError('Invoice number is required in CSV imports.')
+            continue
+        first_row = rows[0]
+        invoice = {'invoice_number': invoice_number,
+                   'purchaser': first_row.get('purchaser_id') or first_row.get('purchaser'),
+                   'vendor': first_row.get('vendor_id') or first_row.get('vendor'),
+                   'invoice_items': [{column: row.get('item_%s' % column) for column in CSV_ITEM_COLUMNS}
+                                     for row in rows if row.get('item_name')]}
+        for column in ('terms', 'deu_date', 'digitized'):
+            if first_row.get(column):
+                invoice[column] = first_row[column]
+        yield invoice
+
+
+class InvoiceImporter:
+    """
+    Imports invoices in chunks. Every chunk is validated with one company lookup and one invoice number lookup,
+    gets its missing invoice numbers from the allocator in one call and is written with batched inserts in its own
+    transaction. Invalid rows are reported without aborting the import
+    """
+
+    def __init__(self, created_by=None, chunk_size=None):
+        self.created_by = created_by
+        self.chunk_size = chunk_size or getattr(settings, 'INVOICE_IMPORT_CHUNK_SIZE', 1000)
+        self.created = 0
+        self.errors = []
+        # A single serializer instance validates every row so its fields are only built once
+        self.import_serializer = InvoiceImportSerializer()
+
+    def import_rows(self, rows):
+        """
+        Imports invoices
+        :param rows: Iterable of invoice dicts in the format of the create invoice API
+        :return: Dict with the number of created invoices and the errors of the rejected rows
+        """
+        rows = iter(rows)
+        row_number = 0
+        chunk = list(islice(rows, self.chunk_size))
+        while chunk:
+            self.import_chunk(list(enumerate(chunk, start=row_number + 1)))
+            row_number += len(chunk)
+            chunk = list(islice(rows, self.chunk_size))
+        self.errors.sort(key=lambda error: error['row'])
+        return {'created': self.created, 'failed': len(self.errors), 'errors': self.errors}
+
+    def add_error(self, row_number, errors):
+        self.errors.append({'row': row_number, 'errors': errors})
+
+    def import_chunk(self, numbered_rows):
+        valid_rows = []
+        for row_number, row in numbered_rows:
+            if isinstance(row, Exception):
+                self.add_error(row_number, {'non_field_errors': [str(row)]})
+                continue
+            try:
+                valid_rows.append((row_number, dict(self.import_serializer.run_validation(row))))
+            except serializers.ValidationError as error:
+                self.add_error(row_number, error.detail)
+        valid_rows = self.check_invoice_numbers(self.check_companies(self.check_amounts(valid_rows)))
+        if valid_rows:
+            self.save(valid_rows)
+
+    def check_amounts(self, rows):
+        """
+        Derives and checks the item amounts of every row in one batch, which NumPy vectorizes when installed
+        :param rows: List of row number and invoice data tuples
+        :return: List of the rows whose item amounts are valid
+        """
+        items = [item for _, data in rows for item in data['invoice_items']]
+        item_errors = compute_item_amounts(items)
+        if not item_errors:
+            return rows
+        valid_rows = []
+        start = 0
+        for row_number, data in rows:
+            end = start + len(data['invoice_items'])
+            errors = {index - start: {'amount': [item_errors[index]]} for index in range(start, end)
+                      if index in item_errors}
+            if errors:
+                self.add_error(row_number, {'invoice_items': errors})
+            else:
+                valid_rows.append((row_number, data))
+            start = end
+        return valid_rows
+
+    def check_companies(self, rows):
+        company_ids = {data[field] for _, data in rows for field in ('purchaser', 'vendor')}
+        companies = Company.objects.in_bulk(company_ids)
+        valid_rows = []
+        for row_number, data in rows:
+            errors = {}
+            for field in ('purchaser', 'vendor'):
+                if data[field] not in companies:
+                    errors[field] = ['Invalid %s provided.' % field.capitalize()]
+                data[field] = companies.get(data[field])
+            if errors:
+                self.add_error(row_number, errors)
+            else:
+                valid_rows.append((row_number, data))
+        return valid_rows
+
+    def check_invoice_numbers(self, rows):
+        counts = Counter(data['invoice_number'] for _, data in rows if 'invoice_number' in data)
+        existing_numbers = set(Invoice.objects.filter(invoice_number__in=list(counts))
+                               .values_list('invoice_number', flat=True))
+        valid_rows = []
+        for row_number, data in rows:
+            invoice_number = data.get('invoice_number')
+            if invoice_number in existing_numbers:
+                self.add_error(row_number, {'invoice_number': ['Invoice number already exists.']})
+            elif invoice_number is not None and counts[invoice_number] > 1:
+                self.add_error(row_number, {'invoice_number': ['Invoice number is repeated in the import.']})
+            else:
+                valid_rows.append((row_number, data))
+        return valid_rows
+
+    def save(self, rows):
+        """
+        Writes the rows of a chunk with batched inserts. When the inserts fail, e.g. because an invoice number was
+        taken since it was checked, the rows are written one at a time in their own savepoint so only the rows
+        that conflict are rejected
+        :param rows: List of row number and invoice data tuples
+        :return:
+        """
+        missing_numbers = sum(1 for _, data in rows if 'invoice_number' not in data)
+        invoice_numbers = iter(get_invoice_number_allocator().allocate_many(missing_numbers))
+        numbered_invoices = []
+        for row_number, data in rows:
+            invoice_items = data.pop('invoice_items')
+            if 'invoice_number' not in data:
+                data['invoice_number'] = next(invoice_numbers)
+            data['total_amount'], data['item_count'] = InvoiceItem.objects.get_totals(invoice_items)
+            invoice = Invoice(created_by=self.created_by, **data)
+            items = [InvoiceItem(**dict(item, invoice=invoice)) for item in invoice_items]
+            numbered_invoices.append((row_number, invoice, items))
+        try:
+            with transaction.atomic():
+                self.insert(numbered_invoices)
+        except IntegrityError:
+            with transaction.atomic():
+                for numbered_invoice in numbered_invoices:
+                    self.save_row(*numbered_invoice)
+            return
+        self.created += len(numbered_invoices)
+
+    def save_row(self, row_number, invoice, items):
+        try:
+            with transaction.atomic():
+                self.insert([(row_number, invoice, items)])
+        except IntegrityError:
+            if Invoice.objects.filter(invoice_number=invoice.invoice_number).exists():
+                self.add_error(row_number, {'invoice_number': ['Invoice number already exists.']})
+            else:
+                self.add_error(row_number, {'non_field_errors': ['Invoice could not be saved.']})
+            return
+        self.created += 1
+
+    @staticmethod
+    def insert(numbered_invoices):
+        Invoice.objects.bulk_create([invoice for _, invoice, _ in numbered_invoices])
+        InvoiceItem.objects.bulk_insert([item for _, _, items in numbered_invoices for item in items])
@@ -0,0 +1,36 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from invoice.importers import InvoiceImporter, read_csv, read_ndjson
+from invoice.models import User
+
+
+class Command(BaseCommand):
+    help = 'Imports invoices from an NDJSON or CSV file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import')
+        parser.add_argument('--format', choices=['ndjson', 'csv'], help='File format, guessed from the extension '
+                                                                         'when omitted')
+        parser.add_argument('--chunk-size', type=int, help='Number of invoices written per transaction')
+        parser.add_argument('--created-by', help='Email of the user the invoices are created by')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or ('csv' if options['path'].endswith('.csv') else 'ndjson')
+        created_by = None
+        if options['created_by']:
+            try:
+                created_by = User.objects.get_by_natural_key(options['created_by'])
+            except User.DoesNotExist:
+                raise CommandError('User %s does not exist.' % options['created_by'])
+        if options['chunk_size'] is not None and options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be a positive number.')
+
+        importer = InvoiceImporter(created_by=created_by, chunk_size=options['chunk_size'])
+        with open(options['path'], encoding='utf-8', errors='replace', newline='') as lines:
+            result = importer.import_rows(read_csv(lines) if file_format == 'csv' else read_ndjson(lines))
+
+        for error in result['errors']:
+            self.stderr.write('Row %s: %s' % (error['row'], json.dumps(error['errors'])))
+        self.stdout.write('Created %s invoices, rejected %s.' % (result['created'], result['failed']))
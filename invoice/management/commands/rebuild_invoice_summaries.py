@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from invoice.reports import check_summaries, rebuild_summaries, summaries_available
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the daily invoice summaries the reports are read from, in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of summaries inserted at once')
+        parser.add_argument('--check', action='store_true',
+                            help='Only verify the summary triggers and compare the summaries with the invoices')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be a positive number.')
+        if not summaries_available():
+            raise CommandError('The database does not maintain invoice summaries, reports read the invoices.')
+        if options['check']:
+            problems = check_summaries()
+            if problems:
+                raise CommandError('The invoice summaries are out of date. %s' % ' '.join(problems))
+            self.stdout.write('The invoice summaries are up to date.')
+            return
+
+        count = rebuild_summaries(options['batch_size'])
+        self.stdout.write('Rebuilt %s invoice summaries.' % count)
+        # Summaries are only rebuilt, triggers dropped by a table rebuild have to be recreated by a migration
+        for problem in check_summaries():
+            self.stderr.write(problem)
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from invoice.search import check_search_index, rebuild_search_index, search_index_available
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full text search index of the invoices, run it after a VACUUM of the SQLite database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only verify the index triggers and documents and fail if they are out of date')
+
+    def handle(self, *args, **options):
+        if not search_index_available():
+            raise CommandError('The database has no full text search index, searches use LIKE queries.')
+        if options['check']:
+            problems = check_search_index()
+            if problems:
+                raise CommandError('The invoice search index is out of date. %s' % ' '.join(problems))
+            self.stdout.write('The invoice search index is up to date.')
+            return
+
+        rebuild_search_index()
+        self.stdout.write('Rebuilt the invoice search index.')
+        # Documents are only rebuilt, triggers dropped by a table rebuild have to be recreated by a migration
+        for problem in check_search_index():
+            self.stderr.write(problem)
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from invoice.models import Invoice
+from invoice.signals import invoices_changed
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the denormalized invoice totals and item counts from the invoice items, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of invoices handled per batch')
+        parser.add_argument('--check', action='store_true',
+                            help='Only verify the stored values and fail if any of them are stale')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be a positive number.')
+
+        checked = stale = 0
+        last_pk = None
+        while True:
+            invoices = Invoice.objects.with_totals().order_by('pk') \
+                .only('pk', 'total_amount', 'item_count')
+            if last_pk is not None:
+                invoices = invoices.filter(pk__gt=last_pk)
+            invoices = list(invoices[:batch_size])
+            if not invoices:
+                break
+            last_pk = invoices[-1].pk
+            checked += len(invoices)
+
+            stale_invoices = []
+            now = timezone.now()
+            for invoice in invoices:
+                if invoice.item_count != invoice.items_count or \
+                        abs(invoice.total_amount - invoice.items_total) > 1e-6:
+                    invoice.total_amount, invoice.item_count = invoice.items_total, invoice.items_count
+                    invoice.updated_at = now
+                    stale_invoices.append(invoice)
+            stale += len(stale_invoices)
+            if stale_invoices and not options['check']:
+                with transaction.atomic():
+                    Invoice.objects.bulk_update(stale_invoices, ['total_amount', 'item_count', 'updated_at'])
+                    invoices_changed.send(sender=Invoice, invoice_ids=[invoice.pk for invoice in stale_invoices])
+
+        if options['check']:
+            if stale:
+                raise CommandError('%s of %s invoices have stale totals.' % (stale, checked))
+            self.stdout.write('All %s invoice totals are up to date.' % checked)
+        else:
+            self.stdout.write('Checked %s invoices, fixed %s stale totals.' % (checked, stale))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from invoice.workers import DigitizationWorker
+
+
+class Command(BaseCommand):
+    help = 'Processes queued invoice digitization jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, help='Number of jobs processed in parallel')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        processed = DigitizationWorker(concurrency=options['concurrency']).run(once=options['once'])
+        self.stdout.write('Processed %s digitization jobs.' % processed)
@@ -1,4 +1,14 @@
-from django.db import models
+import hashlib
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, models, transaction
+from django.db.models import Count, DateTimeField, F, FloatField, IntegerField, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Round
+from django.utils import timezone
+
+from invoice.amounts import CENTS_PER_UNIT, sum_amounts, to_cents
 
 
 class DefaultManager(models.Manager):
@@ -10,11 +20,287 @@ class UserManager(DefaultManager):
         return super(UserManager, self).get(email=email_id)
 
 
+VERSION_FIELDS = ('updated_at', 'total_amount', 'item_count', 'items_updated_at', 'purchaser__updated_at',
+                  'vendor__updated_at', 'created_by__updated_at', 'digitized_by__updated_at')
+
+
+class InvoiceQuerySet(models.QuerySet):
+    def with_related(self):
+        """
+        Loads every relation rendered by the invoice serializer up front so serializing N invoices costs a
+        constant number of queries
+        :return: Invoice queryset
+        """
+        return self.select_related('purchaser', 'vendor', 'created_by', 'digitized_by') \
+            .prefetch_related('invoice_items')
+
+    def with_totals(self):
+        """
+        Annotates every invoice with `items_total` and `items_count` computed by the database from its items.
+        Used to verify the stored `total_amount` and `item_count` columns
+        :return: Invoice queryset
+        """
+        invoice_items = self.model._meta.get_field('invoice_items').related_model.objects \
+            .filter(invoice=OuterRef('pk')).order_by().values('invoice')
+        items_total = invoice_items.annotate(total=Sum('amount')).values('total')
+        items_count = invoice_items.annotate(count=Count('pk')).values('count')
+        return self.annotate(items_total=Coalesce(Subquery(items_total, output_field=FloatField()), Value(0.0)),
+                             items_count=Coalesce(Subquery(items_count, output_field=IntegerField()), Value(0)))
+
+    def with_version(self):
+        """
+        Annotates every invoice with `items_updated_at`, the time its items were last updated. With the update times
+        of the invoice and its related rows it makes up the version of the serialized invoice
+        :return: Invoice queryset
+        """
+        invoice_items = self.model._meta.get_field('invoice_items').related_model.objects \
+            .filter(invoice=OuterRef('pk')).order_by().values('invoice')
+        items_updated_at = invoice_items.annotate(updated_at=Max('updated_at')).values('updated_at')
+        return self.annotate(items_updated_at=Subquery(items_updated_at, output_field=DateTimeField()))
+
+    def versions(self):
+        """
+        Reads what the version of the invoices is computed from, without loading the invoices
+        :return: Queryset of dicts with the id, digitized flag and version fields of the invoices
+        """
+        return self.with_version().values('pk', 'digitized', *VERSION_FIELDS)
+
+    @staticmethod
+    def get_version(row):
+        """
+        Computes the version of an invoice, which changes whenever the invoice, its items, its companies or its users
+        are updated
+        :param row: Dict returned by versions()
+        :return: Version string
+        """
+        return hashlib.md5(repr(tuple(row[field] for field in VERSION_FIELDS)).encode('utf-8')).hexdigest()
+
+    def with_digitizer(self):
+        """
+        Loads the user who digitized the invoice, which is all the digitization status serializer needs
+        :return: Invoice queryset
+        """
+        return self.select_related('digitized_by')
+
+    def digitize(self, user, digitized_at=None):
+        """
+        Marks the invoices that are not digitized yet as digitized by the user with a single conditional UPDATE, so
+        concurrent requests never digitize the same invoice twice
+        :param user: User digitizing the invoices
+        :param digitized_at: Time stored as the update time of the digitized invoices
+        :return: Number of digitized invoices
+        """
+        return self.filter(digitized=False).update(digitized=True, digitized_by=user,
+                                                   updated_at=digitized_at or timezone.now())
+
+    def digitize_many(self, invoice_ids, user):
+        """
+        Digitizes a batch of invoices with one UPDATE. The invoices updated by it are told apart from the ones
+        digitized before by their update time, read in the same transaction so no other update can come in between
+        :param invoice_ids: List of invoice ids
+        :param user: User digitizing the invoices
+        :return: List of invoice id and result pairs, the result being digitized, already_digitized or not_found
+        """
+        digitized_at = timezone.now()
+        invoices = self.filter(pk__in=invoice_ids)
+        with transaction.atomic(using=self.db):
+            invoices.digitize(user, digitized_at)
+            rows = list(invoices.values_list('pk', 'digitized_by', 'updated_at'))
+        results = {pk: 'digitized' if digitized_by == user.pk and updated_at == digitized_at else 'already_digitized'
+                   for pk, digitized_by, updated_at in rows}
+        return [(pk, results.get(pk, 'not_found')) for pk in invoice_ids]
+
+    def apply_filters(self, created_after=None, created_before=None, vendor=None, purchaser=None, digitized=None,
+                      due_after=None, due_before=None, total_min=None, total_max=None):
+        """
+        Applies the invoice filters supported by the invoice APIs, skipping the ones not provided. Every filter and
+        the common combinations of them are backed by the indexes of the invoices table
+        :param created_after: Only invoices created at or after this time
+        :param created_before: Only invoices created before this time
+        :param vendor: Only invoices of this vendor
+        :param purchaser: Only invoices of this purchaser
+        :param digitized: Only digitized or non digitized invoices
+        :param due_after: Only invoices due at or after this time
+        :param due_before: Only invoices due before this time
+        :param total_min: Only invoices with at least this total
+        :param total_max: Only invoices with at most this total
+        :return: Invoice queryset
+        """
+        filters = {
+            'created_at__gte': created_after,
+            'created_at__lt': created_before,
+            'vendor': vendor,
+            'purchaser': purchaser,
+            'digitized': digitized,
+            'deu_date__gte': due_after,
+            'deu_date__lt': due_before,
+            'total_amount__gte': total_min,
+            'total_amount__lte': total_max,
+        }
+        return self.filter(**{lookup: value for lookup, value in filters.items() if value is not None})
+
+
+class InvoiceManager(DefaultManager.from_queryset(InvoiceQuerySet)):
+    pass
+
+
 class InvoiceItemManager(DefaultManager):
+    UPDATABLE_FIELDS = ['name', 'description', 'quantity', 'price', 'amount']
+
     def create_items(self, invoice, invoice_items):
-        self.clean_items(invoice)
-        for item in invoice_items:
-            self.create(invoice=invoice, **item)
+        self.filter(invoice=invoice).delete()
+        self.bulk_create_items(invoice, invoice_items)
+        self.update_totals(invoice, invoice_items)
+
+    def bulk_create_items(self, invoice, invoice_items):
+        """
+        Inserts the items of an invoice with batched INSERTs
+        :param invoice: Invoice object
+        :param invoice_items: List of invoice item dicts
+        :return: List of created InvoiceItem objects
+        """
+        return self.bulk_insert([self.model(**dict(item, invoice=invoice)) for item in invoice_items])
+
+    def bulk_insert(self, items):
+        """
+        Inserts unsaved items with batched INSERTs. Primary keys are generated client side by the UUID field
+        default so no rows have to be read back. The batch size is capped to what the database accepts in a single
+        statement
+        :param items: List of unsaved InvoiceItem objects
+        :return: List of created InvoiceItem objects
+        """
+        max_batch_size = connections[self.db].ops.bulk_batch_size(self.model._meta.concrete_fields, items)
+        batch_size = min(getattr(settings, 'INVOICE_ITEM_BATCH_SIZE', 500), max(max_batch_size, 1))
+        return self.bulk_create(items, batch_size=batch_size)
+
+    def sync_items(self, invoice, invoice_items):
+        """
+        Makes the items of an invoice match the given list with the fewest writes: items carrying the id of an
+        existing item are updated in place when they changed, items without an id are inserted and existing items
+        missing from the list are deleted
+        :param invoice: Invoice object
+        :param invoice_items: List of invoice item dicts, optionally with the `id` of an existing item
+        :return:
+        """
+        existing_items = {item.pk: item for item in self.filter(invoice=invoice)}
+        new_items, changed_items, kept_items = [], [], []
+        for data in invoice_items:
+            item = existing_items.pop(data.get('id'), None)
+            if item is None:
+                new_items.append({key: value for (key, value) in data.items() if key != 'id'})
+                continue
+            kept_items.append(item)
+            changed = False
+            for (key, value) in data.items():
+                if key not in ('id', 'invoice') and getattr(item, key) != value:
+                    setattr(item, key, value)
+                    changed = True
+            if changed:
+                changed_items.append(item)
+
+        if existing_items:
+            self.filter(pk__in=list(existing_items)).delete()
+        if changed_items:
+            now = timezone.now()
+            for item in changed_items:
+                item.updated_at = now
+            self.bulk_update(changed_items, self.UPDATABLE_FIELDS + ['updated_at'],
+                             batch_size=getattr(settings, 'INVOICE_ITEM_BATCH_SIZE', 500))
+        if new_items:
+            self.bulk_create_items(invoice, new_items)
+        self.update_totals(invoice, [{'amount': item.amount} for item in kept_items] + new_items)
+
+    def update_item(self, item, data):
+        """
+        Updates a single item and shifts the stored invoice total by the change in its amount
+        :param item: InvoiceItem object
+        :param data: Dict of item fields to change
+        :return: Updated InvoiceItem object
+        """
+        previous_cents = to_cents(item.amount)
+        for (key, value) in data.items():
+            setattr(item, key, value)
+        item.save()
+        # Shifted in whole cents so repeated updates do not accumulate float rounding errors
+        invoice_model = self.model._meta.get_field('invoice').related_model
+        invoice_model.objects.filter(pk=item.invoice_id).update(
+            total_amount=(Round(F('total_amount') * CENTS_PER_UNIT) + (to_cents(item.amount) - previous_cents)) /
+            float(CENTS_PER_UNIT), updated_at=timezone.now())
+        return item
 
     def clean_items(self, invoice):
         self.filter(invoice=invoice).delete()
+        self.update_totals(invoice, [])
+
+    @staticmethod
+    def get_totals(invoice_items):
+        """
+        Computes the denormalized invoice totals for a list of item data
+        :param invoice_items: List of invoice item dicts
+        :return: Tuple of total amount and item count
+        """
+        return sum_amounts(item['amount'] for item in invoice_items), len(invoice_items)
+
+    def update_totals(self, invoice, invoice_items):
+        """
+        Stores the total amount and item count of the items on the invoice
+        :param invoice: Invoice object
+        :param invoice_items: List of invoice item dicts the invoice now holds
+        :return:
+        """
+        invoice.total_amount, invoice.item_count = self.get_totals(invoice_items)
+        type(invoice).objects.filter(pk=invoice.pk).update(total_amount=invoice.total_amount,
+                                                            item_count=invoice.item_count, updated_at=timezone.now())
+
+
+class DigitizationJobManager(DefaultManager):
+    def enqueue(self, invoice):
+        return self.create(invoice=invoice)
+
+    def claim(self, limit):
+        """
+        Claims up to limit pending jobs, oldest first. The claim is a conditional UPDATE tagged with a random token,
+        so concurrent workers never claim the same job
+        :param limit: Maximum number of jobs to claim
+        :return: List of claimed jobs
+        """
+        pending_ids = list(self.filter(status=self.model.PENDING).order_by('created_at')
+                           .values_list('pk', flat=True)[:limit])
+        if not pending_ids:
+            return []
+        token = uuid.uuid4()
+        self.filter(pk__in=pending_ids, status=self.model.PENDING).update(
+            status=self.model.RUNNING, claimed_by=token, started_at=timezone.now(), attempts=F('attempts') + 1)
+        return list(self.filter(claimed_by=token).select_related('invoice').order_by('created_at'))
+
+    def requeue_stale(self, timeout, max_attempts):
+        """
+        Puts jobs whose worker stopped responding back in the queue, or fails them once they ran out of attempts
+        :param timeout: Seconds after which a running job is considered stale
+        :param max_attempts: Number of attempts before a job is failed
+        :return: Number of requeued jobs
+        """
+        stale_jobs = self.filter(status=self.model.RUNNING,
+                                 started_at__lt=timezone.now() - timedelta(seconds=timeout))
+        stale_jobs.filter(attempts__gte=max_attempts).update(status=self.model.FAILED, error='Worker timed out.',
+                                                             updated_at=timezone.now())
+        return stale_jobs.update(status=self.model.PENDING, claimed_by=None, updated_at=timezone.now())
+
+
+class UploadSessionManager(DefaultManager):
+    def record_chunk(self, session, offset, end):
+        """
+        Moves the received offset of an upload forward after a chunk was written. Chunks written concurrently or
+        sent again never move it back
+        :param session: UploadSession object
+        :param offset: Offset the chunk was written at
+        :param end: Offset after the last byte of the chunk
+        :return: Received offset
+        """
+        self.filter(pk=session.pk, received__gte=offset, received__lt=end).update(received=end,
+                                                                                 updated_at=timezone.now())
+        session.received = self.filter(pk=session.pk).values_list('received', flat=True).get()
+        return session.received
+
+    def expired(self, max_age):
+        return self.filter(created_at__lt=timezone.now() - timedelta(seconds=max_age))
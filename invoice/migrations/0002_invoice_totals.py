@@ -0,0 +1,33 @@
+# Generated by Django 2.2.15 on 2026-10-16 23:13
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def compute_invoice_totals(apps, schema_editor):
+    Invoice = apps.get_model('invoice', 'Invoice')
+    InvoiceItem = apps.get_model('invoice', 'InvoiceItem')
+    totals = InvoiceItem.objects.order_by().values('invoice').annotate(total=Sum('amount'), count=Count('pk'))
+    for row in totals.iterator():
+        Invoice.objects.filter(pk=row['invoice']).update(total_amount=row['total'], item_count=row['count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoice', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='item_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='total_amount',
+            field=models.FloatField(db_index=True, default=0),
+        ),
+        migrations.RunPython(compute_invoice_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 2.2.15 on 2026-10-16 23:20
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoice', '0003_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceNumberSequence',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('next_value', models.BigIntegerField()),
+            ],
+            options={
+                'db_table': 'invoice_number_sequences',
+            },
+        ),
+    ]
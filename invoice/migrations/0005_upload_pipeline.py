@@ -0,0 +1,47 @@
+# Generated by Django 2.2.15 on 2026-10-16 23:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+import invoice.models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoice', '0004_invoice_number_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='document',
+            field=models.FileField(blank=True, null=True, upload_to=invoice.models.invoice_document_path),
+        ),
+        migrations.AlterField(
+            model_name='invoice',
+            name='deu_date',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.CreateModel(
+            name='DigitizationJob',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('attempts', models.IntegerField(default=0)),
+                ('claimed_by', models.UUIDField(blank=True, null=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('invoice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='digitization_jobs', to='invoice.Invoice')),
+            ],
+            options={
+                'db_table': 'digitization_jobs',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='digitizationjob',
+            index=models.Index(fields=['status', 'created_at'], name='digitization_jobs_status_idx'),
+        ),
+    ]
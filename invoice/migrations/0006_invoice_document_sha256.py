@@ -0,0 +1,18 @@
+# Generated by Django 2.2.15 on 2026-10-16 23:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoice', '0005_upload_pipeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='document_sha256',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
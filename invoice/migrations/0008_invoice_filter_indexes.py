@@ -0,0 +1,38 @@
+# Generated by Django 2.2.15 on 2026-10-16 23:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoice', '0007_upload_session'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='invoice',
+            name='total_amount',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['total_amount', 'id'], name='invoices_total_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['deu_date'], name='invoices_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['digitized', 'created_at', 'id'], name='invoices_dig_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['vendor', 'digitized', 'created_at', 'id'], name='invoices_vendor_dig_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['purchaser', 'deu_date'], name='invoices_purchaser_due_idx'),
+        ),
+    ]
@@ -0,0 +1,146 @@
+from django.db import migrations
+
+# Full-text index of the invoices on SQLite, one FTS5 document per invoice with its number, terms and company names
+# and one per invoice item with its name and description. The documents share the rowid of the row they index and
+# are kept up to date by triggers, so every write path including bulk inserts and queryset updates maintains them
+#
+# SQLite drops the triggers of a table when it rebuilds the table, which migrations do for most field changes. A later
+# migration rebuilding the invoices, invoice_items or companies table must create the triggers below again, and the
+# index must then be rebuilt with the rebuild_search_index command, as the rebuild may change rowids. Run
+# rebuild_search_index --check after migrating to find missing triggers and documents
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE invoice_search USING fts5(
+        invoice_id UNINDEXED, invoice_number, terms, companies,
+        prefix='2 3', tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE VIRTUAL TABLE invoice_item_search USING fts5(
+        invoice_id UNINDEXED, name, description,
+        prefix='2 3', tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    # Matches on the invoice number weigh the most, then company names, then terms
+    "INSERT INTO invoice_search(invoice_search, rank) VALUES ('rank', 'bm25(0.0, 10.0, 1.0, 5.0)')",
+    "INSERT INTO invoice_item_search(invoice_item_search, rank) VALUES ('rank', 'bm25(0.0, 3.0, 1.0)')",
+    """
+    CREATE TRIGGER invoice_search_insert AFTER INSERT ON invoices BEGIN
+        INSERT INTO invoice_search(rowid, invoice_id, invoice_number, terms, companies)
+        VALUES (NEW.rowid, NEW.id, NEW.invoice_number, COALESCE(NEW.terms, ''),
+                COALESCE((SELECT name FROM companies WHERE id = NEW.purchaser_id), '') || ' ' ||
+                COALESCE((SELECT name FROM companies WHERE id = NEW.vendor_id), ''));
+    END
+    """,
+    """
+    CREATE TRIGGER invoice_search_update AFTER UPDATE OF invoice_number, terms, purchaser_id, vendor_id ON invoices
+    BEGIN
+        DELETE FROM invoice_search WHERE rowid = OLD.rowid;
+        INSERT INTO invoice_search(rowid, invoice_id, invoice_number, terms, companies)
+        VALUES (NEW.rowid, NEW.id, NEW.invoice_number, COALESCE(NEW.terms, ''),
+                COALESCE((SELECT name FROM companies WHERE id = NEW.purchaser_id), '') || ' ' ||
+                COALESCE((SELECT name FROM companies WHERE id = NEW.vendor_id), ''));
+    END
+    """,
+    """
+    CREATE TRIGGER invoice_search_delete AFTER DELETE ON invoices BEGIN
+        DELETE FROM invoice_search WHERE rowid = OLD.rowid;
+    END
+    """,
+    """
+    CREATE TRIGGER invoice_item_search_insert AFTER INSERT ON invoice_items WHEN NEW.invoice_id IS NOT NULL BEGIN
+        INSERT INTO invoice_item_search(rowid, invoice_id, name, description)
+        VALUES (NEW.rowid, NEW.invoice_id, NEW.name, NEW.description);
+    END
+    """,
+    """
+    CREATE TRIGGER invoice_item_search_update AFTER UPDATE OF name, description, invoice_id ON invoice_items BEGIN
+        DELETE FROM invoice_item_search WHERE rowid = OLD.rowid;
+        INSERT INTO invoice_item_search(rowid, invoice_id, name, description)
+        SELECT NEW.rowid, NEW.invoice_id, NEW.name, NEW.description WHERE NEW.invoice_id IS NOT NULL;
+    END
+    """,
+    """
+    CREATE TRIGGER invoice_item_search_delete AFTER DELETE ON invoice_items BEGIN
+        DELETE FROM invoice_item_search WHERE rowid = OLD.rowid;
+    END
+    """,
+    """
+    CREATE TRIGGER company_search_update AFTER UPDATE OF name ON companies BEGIN
+        DELETE FROM invoice_search
+        WHERE rowid IN (SELECT rowid FROM invoices WHERE purchaser_id = NEW.id OR vendor_id = NEW.id);
+        INSERT INTO invoice_search(rowid, invoice_id, invoice_number, terms, companies)
+        SELECT invoices.rowid, invoices.id, invoices.invoice_number, COALESCE(invoices.terms, ''),
+               COALESCE(purchaser.name, '') || ' ' || COALESCE(vendor.name, '')
+        FROM invoices
+        LEFT JOIN companies purchaser ON purchaser.id = invoices.purchaser_id
+        LEFT JOIN companies vendor ON vendor.id = invoices.vendor_id
+        WHERE invoices.purchaser_id = NEW.id OR invoices.vendor_id = NEW.id;
+    END
+    """,
+    # Indexes the invoices and items stored before the migration
+    """
+    INSERT INTO invoice_search(rowid, invoice_id, invoice_number, terms, companies)
+    SELECT invoices.rowid, invoices.id, invoices.invoice_number, COALESCE(invoices.terms, ''),
+           COALESCE(purchaser.name, '') || ' ' || COALESCE(vendor.name, '')
+    FROM invoices
+    LEFT JOIN companies purchaser ON purchaser.id = invoices.purchaser_id
+    LEFT JOIN companies vendor ON vendor.id = invoices.vendor_id
+    """,
+    """
+    INSERT INTO invoice_item_search(rowid, invoice_id, name, description)
+    SELECT rowid, invoice_id, name, description FROM invoice_items WHERE invoice_id IS NOT NULL
+    """,
+]
+
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS company_search_update',
+    'DROP TRIGGER IF EXISTS invoice_item_search_delete',
+    'DROP TRIGGER IF EXISTS invoice_item_search_update',
+    'DROP TRIGGER IF EXISTS invoice_item_search_insert',
+    'DROP TRIGGER IF EXISTS invoice_search_delete',
+    'DROP TRIGGER IF EXISTS invoice_search_update',
+    'DROP TRIGGER IF EXISTS invoice_search_insert',
+    'DROP TABLE IF EXISTS invoice_item_search',
+    'DROP TABLE IF EXISTS invoice_search',
+]
+
+
+def fts5_available(schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return False
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if cursor.fetchone()[0]:
+            return True
+        # FTS5 may be loaded without being a compile option
+        try:
+            cursor.execute('CREATE VIRTUAL TABLE temp.fts5_check USING fts5(content)')
+        except Exception:
+            return False
+        cursor.execute('DROP TABLE temp.fts5_check')
+        return True
+
+
+def create_search_index(apps, schema_editor):
+    # Other databases search with LIKE queries, see invoice.search
+    if fts5_available(schema_editor):
+        for sql in CREATE_SQL:
+            schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in DROP_SQL:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoice', '0008_invoice_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
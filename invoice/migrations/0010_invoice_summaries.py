@@ -0,0 +1,143 @@
+# Generated by Django 2.2.15 on 2026-10-17 00:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+# SQLite drops the triggers of a table when it rebuilds the table, which migrations do for most field changes. A later
+# migration rebuilding the invoices table must create the summary triggers again, and the summaries must then be
+# rebuilt with the rebuild_invoice_summaries command. Run rebuild_invoice_summaries --check after migrating to find
+# missing triggers and summaries differing from the invoices
+
+# Summary buckets of an invoice: the company column, its role and the date column the bucket day is read from
+BUCKETS = [
+    ('vendor_id', 'vendor', 'created_at'),
+    ('purchaser_id', 'purchaser', 'created_at'),
+    ('vendor_id', 'vendor', 'deu_date'),
+    ('purchaser_id', 'purchaser', 'deu_date'),
+]
+
+NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+BUCKET_FILTER = """
+    company_id = {row}.{column} AND role = '{role}' AND date_field = '{date_field}'
+    AND day = date({row}.{date_field}) AND digitized = {row}.digitized
+"""
+
+# Adds an invoice to the buckets it belongs to, creating the missing ones
+ADD_SQL = """
+    INSERT OR IGNORE INTO invoice_summaries
+        (id, created_at, updated_at, company_id, role, date_field, day, digitized, invoice_count, total_amount)
+    SELECT lower(hex(randomblob(16))), {now}, {now}, NEW.{column}, '{role}', '{date_field}', date(NEW.{date_field}),
+           NEW.digitized, 0, 0
+    WHERE NEW.{column} IS NOT NULL AND NEW.{date_field} IS NOT NULL;
+    UPDATE invoice_summaries SET
+        invoice_count = invoice_count + 1,
+        total_amount = total_amount + NEW.total_amount,
+        min_amount = MIN(COALESCE(min_amount, NEW.total_amount), NEW.total_amount),
+        max_amount = MAX(COALESCE(max_amount, NEW.total_amount), NEW.total_amount),
+        updated_at = {now}
+    WHERE {new_filter};
+"""
+
+# Removes an invoice from its buckets, dropping the empty ones. The smallest and largest totals of a bucket are read
+# from the invoices again when the removed invoice held one of them
+REMOVE_SQL = """
+    UPDATE invoice_summaries SET
+        invoice_count = invoice_count - 1,
+        total_amount = total_amount - OLD.total_amount,
+        updated_at = {now}
+    WHERE {old_filter};
+    DELETE FROM invoice_summaries WHERE {old_filter} AND invoice_count <= 0;
+    UPDATE invoice_summaries SET
+        min_amount = (SELECT MIN(total_amount) FROM invoices WHERE {invoice_filter}),
+        max_amount = (SELECT MAX(total_amount) FROM invoices WHERE {invoice_filter})
+    WHERE {old_filter} AND OLD.total_amount IN (min_amount, max_amount);
+"""
+
+INVOICE_FILTER = """
+    {column} = OLD.{column} AND digitized = OLD.digitized
+    AND {date_field} >= date(OLD.{date_field}) AND {date_field} < date(OLD.{date_field}, '+1 day')
+"""
+
+POPULATE_SQL = """
+    INSERT INTO invoice_summaries (id, created_at, updated_at, company_id, role, date_field, day, digitized,
+                                   invoice_count, total_amount, min_amount, max_amount)
+    SELECT lower(hex(randomblob(16))), {now}, {now}, {column}, '{role}', '{date_field}', date({date_field}), digitized,
+           COUNT(*), SUM(total_amount), MIN(total_amount), MAX(total_amount)
+    FROM invoices WHERE {column} IS NOT NULL AND {date_field} IS NOT NULL
+    GROUP BY {column}, date({date_field}), digitized
+"""
+
+SUMMARY_COLUMNS = ('total_amount', 'digitized', 'vendor_id', 'purchaser_id', 'created_at', 'deu_date')
+
+
+def get_statements(template):
+    statements = []
+    for column, role, date_field in BUCKETS:
+        names = {'now': NOW, 'column': column, 'role': role, 'date_field': date_field}
+        statements.append(template.format(
+            new_filter=BUCKET_FILTER.format(row='NEW', **names), old_filter=BUCKET_FILTER.format(row='OLD', **names),
+            invoice_filter=INVOICE_FILTER.format(**names), **names))
+    return ''.join(statements)
+
+
+def create_summary_triggers(apps, schema_editor):
+    # Other databases compute the reports from the invoices, see invoice.reports
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    changed = ' OR '.join('OLD.{0} IS NOT NEW.{0}'.format(column) for column in SUMMARY_COLUMNS)
+    schema_editor.execute('CREATE TRIGGER invoice_summaries_insert AFTER INSERT ON invoices BEGIN {} END'.format(
+        get_statements(ADD_SQL)))
+    schema_editor.execute('CREATE TRIGGER invoice_summaries_update AFTER UPDATE OF {} ON invoices WHEN {} '
+                          'BEGIN {}{} END'.format(', '.join(SUMMARY_COLUMNS), changed, get_statements(REMOVE_SQL),
+                                                  get_statements(ADD_SQL)))
+    schema_editor.execute('CREATE TRIGGER invoice_summaries_delete AFTER DELETE ON invoices BEGIN {} END'.format(
+        get_statements(REMOVE_SQL)))
+    for column, role, date_field in BUCKETS:
+        schema_editor.execute(POPULATE_SQL.format(now=NOW, column=column, role=role, date_field=date_field))
+
+
+def drop_summary_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for trigger in ('invoice_summaries_insert', 'invoice_summaries_update', 'invoice_summaries_delete'):
+            schema_editor.execute('DROP TRIGGER IF EXISTS {}'.format(trigger))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoice', '0009_invoice_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceSummary',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('role', models.CharField(choices=[('vendor', 'Vendor'), ('purchaser', 'Purchaser')], max_length=16)),
+                ('date_field', models.CharField(choices=[('created_at', 'Creation date'), ('deu_date', 'Due date')], max_length=16)),
+                ('day', models.DateField()),
+                ('digitized', models.BooleanField()),
+                ('invoice_count', models.IntegerField(default=0)),
+                ('total_amount', models.FloatField(default=0)),
+                ('min_amount', models.FloatField(null=True)),
+                ('max_amount', models.FloatField(null=True)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='invoice_summaries', to='invoice.Company')),
+            ],
+            options={
+                'db_table': 'invoice_summaries',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='invoicesummary',
+            index=models.Index(fields=['role', 'date_field', 'day'], name='invoice_summaries_day_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='invoicesummary',
+            constraint=models.UniqueConstraint(fields=('company', 'role', 'date_field', 'day', 'digitized'), name='invoice_summaries_bucket_uniq'),
+        ),
+        migrations.RunPython(create_summary_triggers, drop_summary_triggers),
+    ]
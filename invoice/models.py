@@ -3,9 +3,15 @@ import uuid
 from django.contrib.auth.base_user import AbstractBaseUser
 from django.contrib.auth.models import PermissionsMixin
 from django.db import models
+from django.utils import timezone
 
-from invoice.managers import DefaultManager, UserManager, InvoiceItemManager
-from invoice.utils import generate_invoice_number
+from invoice.amounts import sum_amounts
+from invoice.managers import DefaultManager, UserManager, InvoiceItemManager, InvoiceManager, DigitizationJobManager, \
+    UploadSessionManager
+
+
+def invoice_document_path(instance, filename):
+    return 'invoices/{:%Y/%m}/{}.pdf'.format(instance.created_at or timezone.now(), instance.id)
 
 
 class CommonField(models.Model):
@@ -49,6 +55,9 @@ class User(AbstractBaseUser, PermissionsMixin, CommonField):
     # Meta
     class Meta:
         db_table = 'users'
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='users_created_id_idx'),
+        ]
 
 
 class Company(CommonField):
@@ -59,6 +68,9 @@ class Company(CommonField):
 
     class Meta:
         db_table = 'companies'
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='companies_created_id_idx'),
+        ]
 
 
 class Invoice(CommonField):
@@ -66,7 +78,7 @@ class Invoice(CommonField):
     invoice_number = models.CharField(max_length=255, unique=True)
     terms = models.TextField(null=True, blank=True)
 
-    deu_date = models.DateTimeField()
+    deu_date = models.DateTimeField(null=True)
 
     digitized = models.BooleanField(default=False)
     digitized_by = models.ForeignKey('User', on_delete=models.CASCADE, null=True, related_name='digitized_invoice')
@@ -74,15 +86,31 @@ class Invoice(CommonField):
     vendor = models.ForeignKey('Company', on_delete=models.CASCADE, null=True, related_name='vendor')
     created_by = models.ForeignKey('User', on_delete=models.CASCADE, null=True, related_name='created_invoice')
 
+    document = models.FileField(upload_to=invoice_document_path, null=True, blank=True)
+    # SHA-256 of the uploaded document, a document uploaded again resolves to the invoice created for it
+    document_sha256 = models.CharField(max_length=64, unique=True, null=True, blank=True)
+
+    # Denormalized from the invoice items, kept in sync by InvoiceItemManager and InvoiceCreateSerializer
+    total_amount = models.FloatField(default=0)
+    item_count = models.IntegerField(default=0)
+
+    objects = InvoiceManager()
+
     @property
     def total(self):
-        total = 0
-        for item in self.invoice_items.all():
-            total += item.amount
-        return total
+        return sum_amounts(item.amount for item in self.invoice_items.all())
 
     class Meta:
         db_table = 'invoices'
+        # Indexes backing the filters and orderings of the invoice list API, see InvoiceQuerySet.apply_filters
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='invoices_created_id_idx'),
+            models.Index(fields=['total_amount', 'id'], name='invoices_total_id_idx'),
+            models.Index(fields=['deu_date'], name='invoices_due_idx'),
+            models.Index(fields=['digitized', 'created_at', 'id'], name='invoices_dig_created_idx'),
+            models.Index(fields=['vendor', 'digitized', 'created_at', 'id'], name='invoices_vendor_dig_idx'),
+            models.Index(fields=['purchaser', 'deu_date'], name='invoices_purchaser_due_idx'),
+        ]
 
 
 class InvoiceItem(CommonField):
@@ -99,3 +127,96 @@ class InvoiceItem(CommonField):
 
     class Meta:
         db_table = 'invoice_items'
+
+
+class InvoiceNumberSequence(CommonField):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    name = models.CharField(max_length=255, unique=True)
+    next_value = models.BigIntegerField()
+
+    class Meta:
+        db_table = 'invoice_number_sequences'
+
+
+class DigitizationJob(CommonField):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    invoice = models.ForeignKey('Invoice', on_delete=models.CASCADE, related_name='digitization_jobs')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    claimed_by = models.UUIDField(null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    objects = DigitizationJobManager()
+
+    class Meta:
+        db_table = 'digitization_jobs'
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='digitization_jobs_status_idx'),
+        ]
+
+
+class UploadSession(CommonField):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    created_by = models.ForeignKey('User', on_delete=models.CASCADE, related_name='upload_sessions')
+    file_name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    # Number of bytes received without gaps from the start of the file, the offset the upload resumes from
+    received = models.BigIntegerField(default=0)
+    invoice = models.ForeignKey('Invoice', on_delete=models.CASCADE, null=True, related_name='upload_sessions')
+
+    objects = UploadSessionManager()
+
+    class Meta:
+        db_table = 'upload_sessions'
+
+
+class InvoiceSummary(CommonField):
+    """
+    Count, sum, smallest and largest total of the invoices of a company in one role, bucketed by UTC day of their
+    creation or due date and by digitization status. Kept up to date by database triggers, see migration 0010
+    """
+    VENDOR = 'vendor'
+    PURCHASER = 'purchaser'
+    ROLE_CHOICES = (
+        (VENDOR, 'Vendor'),
+        (PURCHASER, 'Purchaser'),
+    )
+    CREATED = 'created_at'
+    DUE = 'deu_date'
+    DATE_FIELD_CHOICES = (
+        (CREATED, 'Creation date'),
+        (DUE, 'Due date'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    company = models.ForeignKey('Company', on_delete=models.CASCADE, related_name='invoice_summaries')
+    role = models.CharField(max_length=16, choices=ROLE_CHOICES)
+    date_field = models.CharField(max_length=16, choices=DATE_FIELD_CHOICES)
+    day = models.DateField()
+    digitized = models.BooleanField()
+    invoice_count = models.IntegerField(default=0)
+    total_amount = models.FloatField(default=0)
+    min_amount = models.FloatField(null=True)
+    max_amount = models.FloatField(null=True)
+
+    class Meta:
+        db_table = 'invoice_summaries'
+        constraints = [
+            models.UniqueConstraint(fields=['company', 'role', 'date_field', 'day', 'digitized'],
+                                    name='invoice_summaries_bucket_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['role', 'date_field', 'day'], name='invoice_summaries_day_idx'),
+        ]
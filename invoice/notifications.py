@@ -0,0 +1,128 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.dispatch import receiver
+
+from invoice.models import Invoice
+from invoice.serializers import InvoiceDigitizedSerializer
+from invoice.signals import invoices_changed
+
+
+class ChangeNotifier:
+    """
+    Wakes up the threads waiting for changes of invoices. Waiters only see changes notified in their own process,
+    so they wait at most POLL_INTERVAL seconds at a time and read the invoices again to find the changes made by
+    other processes
+    """
+
+    def __init__(self, max_entries=10000):
+        self.condition = threading.Condition()
+        self.sequence = 0
+        # Invoice id and the sequence of its latest change, least recently changed first
+        self.changes = OrderedDict()
+        self.max_entries = max_entries
+        self.forgotten = 0
+
+    def notify(self, invoice_ids):
+        """
+        Records a change of the invoices and wakes up the threads waiting for them
+        :param invoice_ids: Ids of the changed invoices
+        :return:
+        """
+        with self.condition:
+            self.sequence += 1
+            for invoice_id in invoice_ids:
+                self.changes.pop(invoice_id, None)
+                self.changes[invoice_id] = self.sequence
+            while len(self.changes) > self.max_entries:
+                _, self.forgotten = self.changes.popitem(last=False)
+            self.condition.notify_all()
+
+    def changed_since(self, invoice_ids, sequence):
+        if self.forgotten > sequence:
+            # Changes after the sequence were dropped, any of the invoices may have changed
+            return set(invoice_ids)
+        return {invoice_id for invoice_id in invoice_ids if self.changes.get(invoice_id, 0) > sequence}
+
+    def wait(self, invoice_ids, sequence, timeout):
+        """
+        Waits until one of the invoices changed after the sequence
+        :param invoice_ids: Ids of the invoices to wait for
+        :param sequence: Sequence the waiter is up to date with
+        :param timeout: Seconds to wait at most
+        :return: Tuple of the current sequence and the ids of the changed invoices, empty when the wait timed out
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.changed_since(invoice_ids, sequence), timeout)
+            return self.sequence, self.changed_since(invoice_ids, sequence)
+
+
+status_notifier = ChangeNotifier()
+
+
+@receiver(invoices_changed)
+def notify_status_changes(invoice_ids, **_):
+    """
+    Notifies the waiters of the invoices once the current transaction is committed
+    :param invoice_ids: Ids of the changed invoices
+    :return:
+    """
+    invoice_ids = list(invoice_ids)
+    transaction.on_commit(lambda: status_notifier.notify(invoice_ids))
+
+
+def get_status_events_config():
+    config = dict(getattr(settings, 'INVOICE_STATUS_EVENTS', {}))
+    config.setdefault('MAX_WAIT', 30)
+    config.setdefault('HEARTBEAT', 15)
+    config.setdefault('POLL_INTERVAL', 5)
+    config.setdefault('STREAM_TIMEOUT', 300)
+    config.setdefault('MAX_IDS', 100)
+    return config
+
+
+def format_event(event, data):
+    return 'event: %s\ndata: %s\n\n' % (event, json.dumps(data, cls=DjangoJSONEncoder))
+
+
+def iter_status_events(invoice_ids):
+    """
+    Renders digitization status changes of invoices as server-sent events. The status of every invoice is sent
+    first, then each time it changes. Invoices are read again when a change of theirs was notified, and all of them
+    every POLL_INTERVAL seconds for changes made by other processes. The stream ends once all of them are digitized
+    or after STREAM_TIMEOUT seconds, clients reconnect to keep listening
+    :param invoice_ids: Ids of the invoices
+    :return: Generator of events
+    """
+    config = get_status_events_config()
+    deadline = time.monotonic() + config['STREAM_TIMEOUT']
+    sequence = status_notifier.sequence
+    statuses = {}
+    changed_ids = invoice_ids
+    last_event = time.monotonic()
+    while True:
+        for invoice in Invoice.objects.with_digitizer().filter(pk__in=changed_ids):
+            data = dict(InvoiceDigitizedSerializer(invoice).data, id=invoice.pk)
+            if statuses.get(invoice.pk) != data:
+                statuses[invoice.pk] = data
+                last_event = time.monotonic()
+                yield format_event('status', data)
+        if all(data['digitized'] for data in statuses.values()):
+            yield format_event('end', {})
+            return
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        sequence, changed_ids = status_notifier.wait(
+            list(statuses), sequence, min(config['POLL_INTERVAL'], config['HEARTBEAT'], remaining))
+        if not changed_ids:
+            # Changes made by other processes are not notified here
+            changed_ids = list(statuses)
+            if time.monotonic() - last_event >= config['HEARTBEAT']:
+                last_event = time.monotonic()
+                yield ': keep-alive\n\n'
@@ -0,0 +1,141 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import date
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination over a unique composite key, `(created_at, id)` by default. Each page is fetched with a
+    `WHERE key > cursor ORDER BY key LIMIT n` query, so no COUNT(*) is issued and deep pages cost the same as the
+    first one. The cursor is an opaque url safe token holding the key of the last row of the page
+    """
+    ordering = ('created_at', 'id')
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        self.max_page_size = getattr(settings, 'MAX_PAGE_SIZE', 500)
+        return super().get_page_size(request)
+
+    def get_ordering(self, request, queryset, view):
+        # Views paginating by another unique key, chosen by the request, set it as `keyset_ordering`
+        return tuple(getattr(view, 'keyset_ordering', None) or type(self).ordering)
+
+    def get_page_queryset(self, queryset, request, view=None):
+        """
+        Builds the query of the page requested, with one row more than the page size to tell whether more follow
+        :param queryset: Queryset to paginate
+        :param request: API request
+        :param view: API view
+        :return: Sliced queryset, or None when pagination is disabled
+        """
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor['reverse']
+
+        if self.cursor is not None:
+            queryset = queryset.filter(self.get_keyset_filter(self.cursor['position'], reverse))
+        order_by = [self.invert_order(field) if reverse else field for field in self.ordering]
+        return queryset.order_by(*order_by)[:self.page_size + 1]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_queryset = self.get_page_queryset(queryset, request, view)
+        if page_queryset is None:
+            return None
+
+        reverse = self.cursor is not None and self.cursor['reverse']
+        results = list(page_queryset)
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+
+        self.has_next = has_more if not reverse else True
+        self.has_previous = has_more if reverse else self.cursor is not None
+        return self.page
+
+    @staticmethod
+    def invert_order(field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+    def get_keyset_filter(self, position, reverse):
+        """
+        Builds the filter matching the rows after the position in the ordering, e.g. for `(a, b)`:
+        `a > x OR (a = x AND b > y)`
+        :param position: List of key values of the row the page starts after
+        :param reverse: Whether to match the rows before the position instead
+        :return: Q object
+        """
+        keyset_filter = None
+        for field, value in reversed(list(zip(self.ordering, position))):
+            descending = field.startswith('-')
+            field = field.lstrip('-')
+            lookup = 'lt' if descending != reverse else 'gt'
+            field_filter = Q(**{'%s__%s' % (field, lookup): value})
+            if keyset_filter is not None:
+                field_filter |= Q(**{field: value}) & keyset_filter
+            keyset_filter = field_filter
+        return keyset_filter
+
+    def get_position(self, instance):
+        position = []
+        for field in self.ordering:
+            value = getattr(instance, field.lstrip('-'))
+            if isinstance(value, date):
+                value = value.isoformat()
+            elif value is not None and not isinstance(value, (int, float, str)):
+                value = str(value)
+            position.append(value)
+        return position
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            position, reverse, ordering = cursor['p'], bool(cursor['r']), tuple(cursor['o'])
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if ordering != self.ordering or not isinstance(position, list) or len(position) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return {'position': position, 'reverse': reverse}
+
+    def encode_cursor(self, position, reverse):
+        cursor = json.dumps({'p': position, 'r': int(reverse), 'o': self.ordering}, separators=(',', ':'))
+        encoded = urlsafe_b64encode(cursor.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.get_position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.get_position(self.page[0]), reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
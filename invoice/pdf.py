@@ -0,0 +1,572 @@
+import base64
+import re
+import zlib
+
+WHITESPACE_RE = re.compile(rb'(?:[\x00\t\n\x0c\r ]+|%[^\r\n]*)+')
+REGULAR_RE = re.compile(rb'[^\x00\t\n\x0c\r ()<>\[\]{}/%]+')
+HEX_STRING_RE = re.compile(rb'<([0-9A-Fa-f\x00\t\n\x0c\r ]*)>')
+STRING_SPECIAL_RE = re.compile(rb'[()\\]')
+NAME_ESCAPE_RE = re.compile(rb'#([0-9A-Fa-f]{2})')
+OBJECT_RE = re.compile(rb'(\d+)\s+(\d+)\s+obj\b')
+STREAM_RE = re.compile(rb'stream\r?\n')
+INLINE_IMAGE_END_RE = re.compile(rb'\sEI(?=[\x00\t\n\x0c\r ]|$)')
+STRING_ESCAPES = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f',
+                  b'(': b'(', b')': b')', b'\\': b'\\'}
+
+# Streams are never decoded beyond this size, protects against compression bombs
+MAX_STREAM_SIZE = 64 * 1024 * 1024
+# Kerning adjustments of TJ arrays larger than this, in thousandths of an em, are read as spaces between words
+TJ_SPACE_THRESHOLD = 250
+
+
+class PDFError(ValueError):
+    pass
+
+
+class Name(str):
+    pass
+
+
+class Keyword(str):
+    pass
+
+
+class Ref(tuple):
+    def __new__(cls, number, generation):
+        return super().__new__(cls, (number, generation))
+
+
+class Stream:
+    def __init__(self, attributes, raw):
+        self.attributes = attributes
+        self.raw = raw
+
+    def decode(self):
+        """
+        Applies the filters of the stream
+        :return: Decoded stream data
+        """
+        filters = self.attributes.get('Filter') or []
+        if not isinstance(filters, list):
+            filters = [filters]
+        data = self.raw
+        for stream_filter in filters:
+            if stream_filter in ('FlateDecode', 'Fl'):
+                decompressor = zlib.decompressobj()
+                try:
+                    data = decompressor.decompress(data, MAX_STREAM_SIZE)
+                except zlib.error as error:
+                    raise PDFError('Corrupt compressed stream: %s' % error)
+                if decompressor.unconsumed_tail:
+                    raise PDFError('Stream is too large.')
+            elif stream_filter in ('ASCIIHexDecode', 'AHx'):
+                digits = re.sub(rb'[^0-9A-Fa-f]', b'', data.split(b'>')[0])
+                data = bytes.fromhex((digits + b'0' * (len(digits) % 2)).decode('ascii'))
+            elif stream_filter in ('ASCII85Decode', 'A85'):
+                try:
+                    data = base64.a85decode(re.sub(rb'\s', b'', data).split(b'~>')[0])
+                except ValueError as error:
+                    raise PDFError('Corrupt ASCII85 stream: %s' % error)
+            else:
+                raise PDFError('Unsupported stream filter %s.' % stream_filter)
+        return data
+
+
+def is_keyword(token, value):
+    return isinstance(token, Keyword) and token == value
+
+
+class Lexer:
+    """
+    Reads PDF objects, and content stream operators, from bytes
+    """
+
+    def __init__(self, data, position=0):
+        self.data = data
+        self.position = position
+
+    def next_token(self):
+        """
+        Reads the next token
+        :return: Number, bytes for strings, Name, Keyword for operators and delimiters, or None at the end
+        """
+        data = self.data
+        match = WHITESPACE_RE.match(data, self.position)
+        if match:
+            self.position = match.end()
+        position = self.position
+        if position >= len(data):
+            return None
+        char = data[position]
+        if char == 0x28:  # (
+            return self.read_string()
+        if char == 0x3c:  # <
+            if data.startswith(b'<<', position):
+                self.position += 2
+                return Keyword('<<')
+            match = HEX_STRING_RE.match(data, position)
+            if not match:
+                raise PDFError('Invalid hex string at offset %s.' % position)
+            self.position = match.end()
+            digits = re.sub(rb'[^0-9A-Fa-f]', b'', match.group(1))
+            return bytes.fromhex((digits + b'0' * (len(digits) % 2)).decode('ascii'))
+        if char == 0x3e:  # >
+            if not data.startswith(b'>>', position):
+                raise PDFError('Unexpected > at offset %s.' % position)
+            self.position += 2
+            return Keyword('>>')
+        if char in b'[]{}':
+            self.position += 1
+            return Keyword(chr(char))
+        if char == 0x2f:  # /
+            match = REGULAR_RE.match(data, position + 1)
+            self.position = match.end() if match else position + 1
+            name = NAME_ESCAPE_RE.sub(lambda escape: bytes([int(escape.group(1), 16)]),
+                                      match.group(0) if match else b'')
+            return Name(name.decode('latin-1'))
+        match = REGULAR_RE.match(data, position)
+        if not match:
+            raise PDFError('Unexpected character at offset %s.' % position)
+        self.position = match.end()
+        token = match.group(0)
+        try:
+            return int(token)
+        except ValueError:
+            pass
+        try:
+            return float(token)
+        except ValueError:
+            return Keyword(token.decode('latin-1'))
+
+    def read_string(self):
+        data = self.data
+        position = self.position + 1
+        depth = 1
+        parts = []
+        while True:
+            match = STRING_SPECIAL_RE.search(data, position)
+            if not match:
+                raise PDFError('Unterminated string.')
+            parts.append(data[position:match.start()])
+            char = match.group(0)
+            position = match.end()
+            if char == b'(':
+                depth += 1
+                parts.append(char)
+            elif char == b')':
+                depth -= 1
+                if not depth:
+                    break
+                parts.append(char)
+            else:
+                escaped = data[position:position + 1]
+                octal = re.match(rb'[0-7]{1,3}', data[position:position + 3])
+                if octal:
+                    parts.append(bytes([int(octal.group(0), 8) & 0xff]))
+                    position += len(octal.group(0))
+                elif escaped in (b'\r', b'\n'):
+                    position += 2 if data[position:position + 2] == b'\r\n' else 1
+                else:
+                    parts.append(STRING_ESCAPES.get(escaped, escaped))
+                    position += 1
+        self.position = position
+        return b''.join(parts)
+
+    def read_object(self, token=None):
+        """
+        Reads a complete object, arrays and dictionaries included
+        :param token: First token of the object when it was already read
+        :return: Object
+        """
+        if token is None:
+            token = self.next_token()
+        if is_keyword(token, '['):
+            items = []
+            while True:
+                token = self.next_token()
+                if token is None:
+                    raise PDFError('Unterminated array.')
+                if is_keyword(token, ']'):
+                    return items
+                items.append(self.read_object(token))
+        if is_keyword(token, '<<'):
+            attributes = {}
+            while True:
+                key = self.next_token()
+                if is_keyword(key, '>>'):
+                    return attributes
+                if not isinstance(key, Name):
+                    raise PDFError('Invalid dictionary key at offset %s.' % self.position)
+                attributes[key] = self.read_object()
+        if isinstance(token, int):
+            position = self.position
+            generation = self.next_token()
+            if isinstance(generation, int) and is_keyword(self.next_token(), 'R'):
+                return Ref(token, generation)
+            self.position = position
+        if is_keyword(token, 'true') or is_keyword(token, 'false'):
+            return token == 'true'
+        if is_keyword(token, 'null'):
+            return None
+        return token
+
+
+class CMap:
+    """
+    ToUnicode character map of a font, maps character codes to text
+    """
+
+    def __init__(self, data):
+        self.code_length = 1
+        self.mapping = {}
+        lexer = Lexer(data)
+        while True:
+            try:
+                token = lexer.next_token()
+            except PDFError:
+                break
+            if token is None:
+                break
+            if is_keyword(token, 'begincodespacerange'):
+                low = lexer.next_token()
+                if isinstance(low, bytes) and low:
+                    self.code_length = len(low)
+            elif is_keyword(token, 'beginbfchar'):
+                self.read_bfchar(lexer)
+            elif is_keyword(token, 'beginbfrange'):
+                self.read_bfrange(lexer)
+
+    @staticmethod
+    def to_text(value):
+        return value.decode('utf-16-be', errors='replace')
+
+    def read_bfchar(self, lexer):
+        while True:
+            source = lexer.read_object()
+            if not isinstance(source, bytes):
+                return
+            target = lexer.read_object()
+            if isinstance(target, bytes):
+                self.mapping[source] = self.to_text(target)
+
+    def read_bfrange(self, lexer):
+        while True:
+            low = lexer.read_object()
+            if not isinstance(low, bytes):
+                return
+            high, target = lexer.read_object(), lexer.read_object()
+            if not isinstance(high, bytes):
+                return
+            start, end = int.from_bytes(low, 'big'), int.from_bytes(high, 'big')
+            for offset, code in enumerate(range(start, min(end, start + 0xffff) + 1)):
+                source = code.to_bytes(len(low), 'big')
+                if isinstance(target, list):
+                    if offset < len(target) and isinstance(target[offset], bytes):
+                        self.mapping[source] = self.to_text(target[offset])
+                elif isinstance(target, bytes) and target:
+                    value = int.from_bytes(target, 'big') + offset
+                    self.mapping[source] = self.to_text(value.to_bytes(len(target), 'big'))
+
+    def decode(self, value):
+        length = self.code_length
+        return ''.join(self.mapping.get(value[index:index + length], '')
+                       for index in range(0, len(value), length))
+
+
+class PDFDocument:
+    """
+    Minimal PDF reader extracting the text of each page. Objects are located by scanning the file instead of
+    reading the cross reference table, so files with broken offsets still open. Supports object streams, Flate,
+    ASCIIHex and ASCII85 compressed content and fonts with ToUnicode maps. Encrypted files are not supported
+    """
+
+    def __init__(self, data):
+        if not data.startswith(b'%PDF-'):
+            raise PDFError('Document is not a PDF file.')
+        self.data = data
+        self.offsets = {}
+        for match in OBJECT_RE.finditer(data):
+            # Objects defined again by incremental updates replace the earlier definition
+            self.offsets[int(match.group(1))] = match.end()
+        self.objects = {}
+        self.compressed_offsets = None
+        self.fonts = {}
+
+    def resolve(self, value, depth=0):
+        """
+        Follows references
+        :param value: Object or reference
+        :return: Referenced object
+        """
+        while isinstance(value, Ref):
+            if depth > 32:
+                raise PDFError('Reference chain is too long.')
+            value = self.get_object(value[0])
+            depth += 1
+        return value
+
+    def get_object(self, number):
+        if number in self.objects:
+            return self.objects[number]
+        # Guards against objects referencing themselves while being parsed
+        self.objects[number] = None
+        if number in self.offsets:
+            value = self.parse_object(self.offsets[number])
+        else:
+            value = self.parse_compressed_object(number)
+        self.objects[number] = value
+        return value
+
+    def parse_object(self, position):
+        lexer = Lexer(self.data, position)
+        value = lexer.read_object()
+        if not isinstance(value, dict):
+            return value
+        match = WHITESPACE_RE.match(self.data, lexer.position)
+        position = match.end() if match else lexer.position
+        match = STREAM_RE.match(self.data, position)
+        if not match:
+            return value
+        start = match.end()
+        length = self.resolve(value.get('Length'))
+        end = start + length if isinstance(length, int) and length >= 0 else -1
+        if end < 0 or self.data[end:end + 20].strip()[:9] != b'endstream':
+            end = self.data.find(b'endstream', start)
+            if end < 0:
+                raise PDFError('Unterminated stream.')
+            end = start + len(self.data[start:end].rstrip(b'\r\n'))
+        return Stream(value, self.data[start:end])
+
+    def parse_compressed_object(self, number):
+        if self.compressed_offsets is None:
+            self.compressed_offsets = {}
+            for stream_number in list(self.offsets):
+                stream = self.get_object(stream_number)
+                if isinstance(stream, Stream) and stream.attributes.get('Type') == 'ObjStm':
+                    self.index_object_stream(stream)
+        if number not in self.compressed_offsets:
+            return None
+        data, position = self.compressed_offsets[number]
+        return Lexer(data, position).read_object()
+
+    def index_object_stream(self, stream):
+        data = stream.decode()
+        count, first = stream.attributes.get('N'), stream.attributes.get('First')
+        if not isinstance(count, int) or not isinstance(first, int):
+            return
+        lexer = Lexer(data)
+        for _ in range(count):
+            number, offset = lexer.next_token(), lexer.next_token()
+            if not isinstance(number, int) or not isinstance(offset, int):
+                return
+            self.compressed_offsets.setdefault(number, (data, first + offset))
+
+    def get_trailer(self):
+        position = self.data.rfind(b'trailer')
+        if position >= 0:
+            trailer = Lexer(self.data, position + len(b'trailer')).read_object()
+            if isinstance(trailer, dict) and 'Root' in trailer:
+                return trailer
+        # Files with cross reference streams keep the trailer in the stream dictionary
+        for number in sorted(self.offsets, reverse=True):
+            value = self.get_object(number)
+            if isinstance(value, Stream) and value.attributes.get('Type') == 'XRef':
+                return value.attributes
+        return {}
+
+    def get_catalog(self):
+        trailer = self.get_trailer()
+        if trailer.get('Encrypt'):
+            raise PDFError('Encrypted PDF files are not supported.')
+        catalog = self.resolve(trailer.get('Root'))
+        if isinstance(catalog, dict):
+            return catalog
+        for number in sorted(self.offsets):
+            value = self.get_object(number)
+            if isinstance(value, dict) and value.get('Type') == 'Catalog':
+                return value
+        raise PDFError('Document catalog not found.')
+
+    def get_pages(self):
+        """
+        Walks the page tree
+        :return: List of page dicts, each with its inherited resources
+        """
+        pages = []
+        visited = set()
+        stack = [(self.resolve(self.get_catalog().get('Pages')), None)]
+        while stack:
+            node, resources = stack.pop()
+            if not isinstance(node, dict) or id(node) in visited:
+                continue
+            visited.add(id(node))
+            resources = self.resolve(node.get('Resources', resources))
+            if node.get('Type') == 'Page' or 'Kids' not in node:
+                pages.append(dict(node, Resources=resources))
+                continue
+            kids = self.resolve(node.get('Kids'))
+            if isinstance(kids, list):
+                stack.extend((self.resolve(kid), resources) for kid in reversed(kids))
+        if not pages:
+            raise PDFError('Document has no pages.')
+        return pages
+
+    def get_content(self, page):
+        contents = self.resolve(page.get('Contents'))
+        if not isinstance(contents, list):
+            contents = [contents]
+        return b'\n'.join(stream.decode() for stream in map(self.resolve, contents) if isinstance(stream, Stream))
+
+    def get_fonts(self, page):
+        resources = page.get('Resources')
+        fonts = self.resolve(resources.get('Font')) if isinstance(resources, dict) else None
+        if not isinstance(fonts, dict):
+            return {}
+        page_fonts = {}
+        for name, font in fonts.items():
+            key = font if isinstance(font, Ref) else id(font)
+            if key not in self.fonts:
+                self.fonts[key] = self.load_cmap(self.resolve(font))
+            page_fonts[name] = self.fonts[key]
+        return page_fonts
+
+    def load_cmap(self, font):
+        to_unicode = self.resolve(font.get('ToUnicode')) if isinstance(font, dict) else None
+        if not isinstance(to_unicode, Stream):
+            return None
+        try:
+            return CMap(to_unicode.decode())
+        except PDFError:
+            return None
+
+    def get_page_text(self, page):
+        return extract_content_text(self.get_content(page), self.get_fonts(page))
+
+
+def decode_text(value, cmap):
+    if cmap is not None:
+        return cmap.decode(value)
+    return value.decode('cp1252', errors='replace')
+
+
+def extract_content_text(content, fonts):
+    """
+    Reads the text shown by a page content stream. Text drawn at a new vertical position starts a new line, text
+    moved along the same line is separated by a space
+    :param content: Decoded content stream
+    :param fonts: Dict of font resource names and their ToUnicode maps
+    :return: Text of the page
+    """
+    lexer = Lexer(content)
+    lines, line = [], []
+    operands = []
+    cmap = None
+    leading = y = line_y = 0
+    moved = False
+
+    def show(text):
+        nonlocal line_y, moved
+        if line and y != line_y:
+            lines.append(''.join(line))
+            line.clear()
+        if not line:
+            line_y = y
+        elif moved and not line[-1].endswith(' ') and not text.startswith(' '):
+            line.append(' ')
+        line.append(text)
+        moved = False
+
+    while True:
+        token = lexer.next_token()
+        if token is None:
+            break
+        if not isinstance(token, Keyword) or token in ('[', '<<', 'true', 'false', 'null'):
+            operands.append(lexer.read_object(token))
+            continue
+        numbers = [operand for operand in operands if isinstance(operand, (int, float))]
+        if token == 'Tf' and operands and isinstance(operands[0], Name):
+            cmap = fonts.get(operands[0])
+        elif token == 'TL' and numbers:
+            leading = numbers[-1]
+        elif token in ('Td', 'TD') and len(numbers) == 2:
+            y += numbers[1]
+            moved = True
+            if token == 'TD':
+                leading = -numbers[1]
+        elif token == 'Tm' and len(numbers) == 6:
+            y = numbers[5]
+            moved = True
+        elif token == 'T*':
+            y -= leading
+        elif token == 'BT':
+            y = 0
+        elif token == 'Tj' and operands and isinstance(operands[-1], bytes):
+            show(decode_text(operands[-1], cmap))
+        elif token in ("'", '"') and operands and isinstance(operands[-1], bytes):
+            y -= leading
+            show(decode_text(operands[-1], cmap))
+        elif token == 'TJ' and operands and isinstance(operands[-1], list):
+            parts = []
+            for part in operands[-1]:
+                if isinstance(part, bytes):
+                    parts.append(decode_text(part, cmap))
+                elif isinstance(part, (int, float)) and part < -TJ_SPACE_THRESHOLD and parts:
+                    parts.append(' ')
+            show(''.join(parts))
+        elif token == 'ID':
+            # Inline image data is binary, skip to the end of the image
+            match = INLINE_IMAGE_END_RE.search(content, lexer.position)
+            lexer.position = match.end() if match else len(content)
+        operands = []
+    if line:
+        lines.append(''.join(line))
+    return '\n'.join(lines)
+
+
+def extract_pages(data):
+    """
+    Extracts the text of a PDF
+    :param data: PDF file contents
+    :return: List with the text of each page
+    """
+    document = PDFDocument(data)
+    return [document.get_page_text(page) for page in document.get_pages()]
+
+
+def escape_text(text):
+    return text.encode('cp1252', errors='replace').replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+def build_pdf(pages, compress=True):
+    """
+    Writes a PDF showing lines of text in Helvetica, used to generate test and benchmark documents
+    :param pages: List of pages, each a list of text lines
+    :param compress: Whether to compress the page contents
+    :return: PDF file contents
+    """
+    objects = [b'<< /Type /Catalog /Pages 2 0 R >>', None,
+               b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>']
+    kids = []
+    for lines in pages:
+        content = b'BT /F1 10 Tf 14 TL 50 800 Td ' + b' T* '.join(b'(%s) Tj' % escape_text(line)
+                                                                 for line in lines) + b' ET'
+        if compress:
+            content = zlib.compress(content)
+            objects.append(b'<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream' % (len(content), content))
+        else:
+            objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(content), content))
+        objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> '
+                       b'/Contents %d 0 R >>' % len(objects))
+        kids.append(b'%d 0 R' % len(objects))
+    objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(kids), len(kids))
+
+    output = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b'%d 0 obj\n%s\nendobj\n' % (number, body)
+    xref_offset = len(output)
+    output += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    output += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    output += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref_offset)
+    return bytes(output)
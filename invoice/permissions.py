@@ -2,8 +2,11 @@ from rest_framework.permissions import BasePermission
 
 
 class InvoicePermission(BasePermission):
+    superuser_actions = ['digitize', 'digitize_batch', 'create', 'update', 'partial_update', 'update_item', 'export',
+                         'bulk_import', 'cache_stats']
+
     def has_permission(self, request, view):
-        if view.action in ['digitize', 'create', 'update', 'partial_update'] and not request.user.is_superuser:
+        if view.action in self.superuser_actions and not request.user.is_superuser:
             return False
         return True
 
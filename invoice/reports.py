@@ -0,0 +1,213 @@
+import pytz
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, Min, Sum
+from django.db.models.functions import TruncDate, TruncMonth, TruncYear
+from django.utils import timezone
+
+from invoice.models import Company, Invoice, InvoiceSummary
+
+# Aggregates totalling daily buckets, read from the summary table or computed from the invoices
+SUMMARY_AGGREGATES = {
+    'invoice_count': Sum('invoice_count'),
+    'total': Sum('total_amount'),
+    'min_total': Min('min_amount'),
+    'max_total': Max('max_amount'),
+}
+INVOICE_AGGREGATES = {
+    'invoice_count': Count('id'),
+    'total': Sum('total_amount'),
+    'min_total': Min('total_amount'),
+    'max_total': Max('total_amount'),
+}
+
+PERIODS = {
+    'day': F,
+    'month': TruncMonth,
+    'year': TruncYear,
+}
+
+# Triggers of migration 0010 keeping the summary table up to date
+SUMMARY_TRIGGERS = ('invoice_summaries_insert', 'invoice_summaries_update', 'invoice_summaries_delete')
+
+_summaries_available = {}
+
+
+def summaries_available():
+    """
+    Whether the database maintains the summary table with the triggers of migration 0010, checked once per database
+    :return: Boolean
+    """
+    key = connection.settings_dict['NAME']
+    if key not in _summaries_available:
+        available = False
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = %s",
+                               [SUMMARY_TRIGGERS[0]])
+                available = cursor.fetchone() is not None
+        _summaries_available[key] = available
+    return _summaries_available[key]
+
+
+def get_invoice_buckets(role, date_field):
+    """
+    Computes the daily buckets of the invoices with a company in the role from the invoices themselves
+    :param role: InvoiceSummary.VENDOR or InvoiceSummary.PURCHASER
+    :param date_field: InvoiceSummary.CREATED or InvoiceSummary.DUE
+    :return: Invoice queryset annotated with bucket_company and bucket_day
+    """
+    return Invoice.objects.filter(**{role + '__isnull': False, date_field + '__isnull': False}).annotate(
+        bucket_company=F(role), bucket_day=TruncDate(date_field))
+
+
+def get_buckets(role, date_field):
+    """
+    Reads the daily buckets from the summary table, or from the invoices on databases not maintaining it
+    :param role: InvoiceSummary.VENDOR or InvoiceSummary.PURCHASER
+    :param date_field: InvoiceSummary.CREATED or InvoiceSummary.DUE
+    :return: Queryset annotated with bucket_company and bucket_day, and the aggregates totalling its rows
+    """
+    if summaries_available():
+        summaries = InvoiceSummary.objects.filter(role=role, date_field=date_field)
+        return summaries.annotate(bucket_company=F('company'), bucket_day=F('day')), SUMMARY_AGGREGATES
+    return get_invoice_buckets(role, date_field), INVOICE_AGGREGATES
+
+
+def filter_buckets(buckets, company=None, digitized=None, day_from=None, day_to=None):
+    filters = {
+        'bucket_company': company,
+        'digitized': digitized,
+        'bucket_day__gte': day_from,
+        'bucket_day__lt': day_to,
+    }
+    return buckets.filter(**{lookup: value for lookup, value in filters.items() if value is not None})
+
+
+def render_rows(rows):
+    """
+    Evaluates report rows, days are UTC days
+    :param rows: Values queryset grouped by bucket_company
+    :return: List of row dicts with the company id and name
+    """
+    with timezone.override(pytz.UTC):
+        rows = list(rows)
+    names = dict(Company.objects.filter(pk__in={row['bucket_company'] for row in rows}).values_list('id', 'name'))
+    rendered = []
+    for row in rows:
+        company = row.pop('bucket_company')
+        rendered.append(dict(company=str(company), company_name=names.get(company), **row))
+    return rendered
+
+
+def spend_report(role=InvoiceSummary.VENDOR, period='month', company=None, digitized=None, created_after=None,
+                 created_before=None):
+    """
+    Invoice totals of each company per period of creation
+    :param role: Role of the companies
+    :param period: day, month or year
+    :param company: Only this company
+    :param digitized: Only digitized or non digitized invoices
+    :param created_after: Only invoices created on or after this day
+    :param created_before: Only invoices created before this day
+    :return: List of row dicts, by period and company
+    """
+    buckets, aggregates = get_buckets(role, InvoiceSummary.CREATED)
+    buckets = filter_buckets(buckets, company, digitized, created_after, created_before)
+    rows = buckets.annotate(period=PERIODS[period]('bucket_day')).values('bucket_company', 'period') \
+        .annotate(**aggregates).order_by('period', 'bucket_company')
+    return render_rows(rows)
+
+
+def outstanding_report(role=InvoiceSummary.PURCHASER, company=None):
+    """
+    Totals of the invoices not digitized yet of each company
+    :param role: Role of the companies
+    :param company: Only this company
+    :return: List of row dicts, largest total first
+    """
+    buckets, aggregates = get_buckets(role, InvoiceSummary.CREATED)
+    rows = filter_buckets(buckets, company, digitized=False).values('bucket_company').annotate(**aggregates) \
+        .order_by('-total', 'bucket_company')
+    return render_rows(rows)
+
+
+def overdue_report(role=InvoiceSummary.PURCHASER, company=None, as_of=None):
+    """
+    Invoices not digitized yet and due before a day, of each company
+    :param role: Role of the companies
+    :param company: Only this company
+    :param as_of: Day the invoices are overdue on, today by default
+    :return: List of row dicts, most overdue invoices first
+    """
+    as_of = as_of or timezone.now().date()
+    buckets, aggregates = get_buckets(role, InvoiceSummary.DUE)
+    rows = filter_buckets(buckets, company, digitized=False, day_to=as_of).values('bucket_company') \
+        .annotate(oldest_due_date=Min('bucket_day'), **aggregates).order_by('-invoice_count', 'bucket_company')
+    return render_rows(rows)
+
+
+def rebuild_summaries(batch_size=1000):
+    """
+    Replaces the summary table with buckets computed from the invoices in bulk, e.g. after loading invoices with the
+    triggers dropped
+    :param batch_size: Number of summaries inserted per statement
+    :return: Number of summaries
+    """
+    count = 0
+    with transaction.atomic(), timezone.override(pytz.UTC):
+        InvoiceSummary.objects.all().delete()
+        for role, _ in InvoiceSummary.ROLE_CHOICES:
+            for date_field, _ in InvoiceSummary.DATE_FIELD_CHOICES:
+                buckets = get_invoice_buckets(role, date_field).values('bucket_company', 'bucket_day', 'digitized') \
+                    .annotate(**INVOICE_AGGREGATES).order_by()
+                summaries = []
+                for bucket in buckets.iterator():
+                    summaries.append(InvoiceSummary(
+                        company_id=bucket['bucket_company'], role=role, date_field=date_field,
+                        day=bucket['bucket_day'], digitized=bucket['digitized'],
+                        invoice_count=bucket['invoice_count'], total_amount=bucket['total'],
+                        min_amount=bucket['min_total'], max_amount=bucket['max_total']))
+                    if len(summaries) == batch_size:
+                        count += len(InvoiceSummary.objects.bulk_create(summaries))
+                        summaries = []
+                count += len(InvoiceSummary.objects.bulk_create(summaries))
+    return count
+
+
+def amounts_differ(first, second):
+    if first is None or second is None:
+        return first is not second
+    return abs(first - second) > 1e-6
+
+
+def check_summaries():
+    """
+    Compares the summary table with the buckets computed from the invoices. SQLite drops the triggers of a table
+    when it rebuilds it, which it does for most schema changes of migrations, and the summaries then silently fall
+    behind
+    :return: List of the problems found, empty when the summaries are up to date
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name IN ({})".format(
+            ', '.join(['%s'] * len(SUMMARY_TRIGGERS))), list(SUMMARY_TRIGGERS))
+        triggers = {name for name, in cursor.fetchall()}
+    problems = ['Trigger %s is missing.' % name for name in SUMMARY_TRIGGERS if name not in triggers]
+    with timezone.override(pytz.UTC):
+        for role, _ in InvoiceSummary.ROLE_CHOICES:
+            for date_field, _ in InvoiceSummary.DATE_FIELD_CHOICES:
+                buckets = get_invoice_buckets(role, date_field) \
+                    .values_list('bucket_company', 'bucket_day', 'digitized') \
+                    .annotate(**INVOICE_AGGREGATES).order_by()
+                expected = {tuple(bucket[:3]): bucket[3:] for bucket in buckets.iterator()}
+                summaries = InvoiceSummary.objects.filter(role=role, date_field=date_field).values_list(
+                    'company', 'day', 'digitized', 'invoice_count', 'total_amount', 'min_amount', 'max_amount')
+                differing = 0
+                for summary in summaries.iterator():
+                    bucket = expected.pop(tuple(summary[:3]), None)
+                    if bucket is None or bucket[0] != summary[3] or \
+                            any(amounts_differ(first, second) for first, second in zip(bucket[1:], summary[4:])):
+                        differing += 1
+                differing += len(expected)
+                if differing:
+                    problems.append('%s %s summaries by %s differ from the invoices.' % (differing, role, date_field))
+    return problems
@@ -0,0 +1,175 @@
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+
+from invoice.models import Invoice, InvoiceItem
+from invoice.serializers import InvoiceSerializer
+from plate_iq.metrics import timed
+
+# Fields of InvoiceSerializer rendered by nested serializers, and the field computed from the invoice
+INVOICE_RELATIONS = ('purchaser', 'vendor', 'created_by', 'digitized_by')
+INVOICE_ITEMS = 'invoice_items'
+INVOICE_TOTAL = 'total'
+
+_datetime_field = serializers.DateTimeField()
+
+
+def render_datetime(value):
+    """
+    Renders an aware datetime like DateTimeField with the ISO 8601 format, without its per value checks
+    :param value: Aware datetime
+    :return: ISO 8601 string
+    """
+    value = value.astimezone(timezone.get_current_timezone()).isoformat()
+    return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+
+def get_converter(field):
+    """
+    Returns the function rendering values of a model field the way its serializer field does
+    :param field: Model field
+    :return: Function, or None when values are rendered as they are
+    """
+    if isinstance(field, (models.UUIDField, models.ForeignKey)):
+        return str
+    if isinstance(field, models.DateTimeField):
+        if settings.USE_TZ and api_settings.DATETIME_FORMAT.lower() == ISO_8601:
+            return render_datetime
+        return _datetime_field.to_representation
+    if isinstance(field, models.FileField):
+        return lambda name: field.storage.url(name) if name else None
+    return None
+
+
+def get_columns(serializer, prefix=''):
+    """
+    Maps the fields of a model serializer to the columns they are read from
+    :param serializer: Model serializer
+    :param prefix: Lookup prefix of the columns, for related models
+    :return: List of field name, column and converter tuples
+    """
+    columns = []
+    for name in serializer.fields:
+        field = serializer.Meta.model._meta.get_field(name)
+        columns.append((name, prefix + field.attname, get_converter(field)))
+    return columns
+
+
+@lru_cache(maxsize=None)
+def get_layout():
+    """
+    Reads the fields rendered by InvoiceSerializer, in its order
+    :return: Dict with the field names, the columns of the invoice, of every relation and of the invoice items
+    """
+    fields = InvoiceSerializer().fields
+    own_fields = [name for name in fields if name not in INVOICE_RELATIONS + (INVOICE_ITEMS, INVOICE_TOTAL)]
+    invoice_columns = []
+    for name in own_fields:
+        field = Invoice._meta.get_field(name)
+        invoice_columns.append((name, field.attname, get_converter(field)))
+    return {
+        'fields': list(fields),
+        'invoice': invoice_columns,
+        'relations': {name: get_columns(fields[name], name + '__') for name in INVOICE_RELATIONS},
+        'items': get_columns(fields[INVOICE_ITEMS].child),
+    }
+
+
+def render_row(row, columns):
+    rendered = {}
+    for name, column, converter in columns:
+        value = row[column]
+        rendered[name] = value if converter is None or value is None else converter(value)
+    return rendered
+
+
+def serialize_invoices(queryset, with_items=True):
+    """
+    Renders invoices exactly like InvoiceSerializer but from plain values() rows, one query for the invoices with
+    their companies and users and one for their items, without DRF's per field overhead. Read only
+    :param queryset: Invoice queryset
+    :param with_items: Whether to render the items, the invoice_items field is left out otherwise
+    :return: List of invoice dicts, in the order of the queryset
+    """
+    with timed('serialize'):
+        return render_invoices(queryset, with_items)
+
+
+def render_invoices(queryset, with_items):
+    layout = get_layout()
+    columns = [column for _, column, _ in layout['invoice']]
+    for relation_columns in layout['relations'].values():
+        columns += [column for _, column, _ in relation_columns]
+    rows = list(queryset.values(*columns))
+    if not rows:
+        return []
+
+    invoice_items = defaultdict(list)
+    if with_items:
+        item_columns = [column for _, column, _ in layout['items']]
+        for item in InvoiceItem.objects.filter(invoice__in=[row['id'] for row in rows]).values(*item_columns):
+            invoice_items[item['invoice_id']].append(render_row(item, layout['items']))
+    fields = layout['fields'] if with_items else [name for name in layout['fields'] if name != INVOICE_ITEMS]
+
+    invoices = []
+    for row in rows:
+        rendered = render_row(row, layout['invoice'])
+        for name, relation_columns in layout['relations'].items():
+            rendered[name] = None if row[name + '__id'] is None else render_row(row, relation_columns)
+        rendered[INVOICE_ITEMS] = invoice_items.get(row['id'], [])
+        rendered[INVOICE_TOTAL] = row['total_amount']
+        invoices.append({name: rendered[name] for name in fields})
+    return invoices
+
+
+def serialize_invoice(pk):
+    """
+    Renders a single invoice like InvoiceSerializer
+    :param pk: Invoice id
+    :return: Invoice dict, or None when the invoice does not exist
+    """
+    invoices = serialize_invoices(Invoice.objects.filter(pk=pk))
+    return invoices[0] if invoices else None
+
+
+class InvoicePayloadSerializer:
+    """
+    Drop-in for InvoiceSerializer on read only views: renders the invoices of a page with serialize_invoices, the
+    page itself only needs the invoice ids
+    """
+
+    def __init__(self, instance=None, many=False, **_):
+        self.instance = instance
+        self.many = many
+
+    @property
+    def data(self):
+        invoices = self.instance if self.many else [self.instance]
+        invoice_ids = [str(invoice.pk) for invoice in invoices]
+        payloads = serialize_invoices(Invoice.objects.filter(pk__in=invoice_ids))
+        payloads = {payload['id']: payload for payload in payloads}
+        # Invoices deleted since the page was read are left out
+        data = [payloads[invoice_id] for invoice_id in invoice_ids if invoice_id in payloads]
+        return data if self.many else data[0]
+
+
+def iter_serialized_chunks(queryset, chunk_size):
+    """
+    Renders the invoices of a queryset with serialize_invoices one chunk at a time, in primary key order. Each chunk
+    is fetched with a keyset query, so memory use only depends on the chunk size
+    :param queryset: Invoice queryset
+    :param chunk_size: Number of invoices per chunk
+    :return: Generator of invoice dict lists
+    """
+    queryset = queryset.order_by('pk')
+    chunk = serialize_invoices(queryset[:chunk_size])
+    while chunk:
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        chunk = serialize_invoices(queryset.filter(pk__gt=chunk[-1]['id'])[:chunk_size])
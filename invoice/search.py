@@ -0,0 +1,234 @@
+import re
+import uuid
+from functools import reduce
+from operator import and_, or_
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+
+from invoice.models import Invoice
+
+# FTS5 table of the invoices created by migration 0009 on SQLite, next to invoice_item_search. Both are kept up to
+# date by triggers on the invoices, invoice items and companies tables
+INVOICE_SEARCH_TABLE = 'invoice_search'
+
+TOKEN_RE = re.compile(r'\w+')
+
+# FTS5 tables searched, both have the id of the invoice a document belongs to in their invoice_id column
+SEARCH_TABLES = (INVOICE_SEARCH_TABLE, 'invoice_item_search')
+
+# Matches in rowid order, which only reads the doclists and scores nothing
+RECENT_SQL = 'SELECT rowid FROM {table} WHERE {table} MATCH %s ORDER BY rowid DESC'
+DOCUMENTS_SQL = 'SELECT rowid, invoice_id FROM {table} WHERE rowid IN ({rowids})'
+DOCUMENTS_BATCH_SIZE = 500
+# The ranked matches are few enough to be sorted together with the matches of the other tables
+RANKED_SQL = 'SELECT invoice_id, rank FROM {table} WHERE {table} MATCH %s'
+
+REBUILD_SQL = [
+    'DELETE FROM invoice_search',
+    'DELETE FROM invoice_item_search',
+    """
+    INSERT INTO invoice_search(rowid, invoice_id, invoice_number, terms, companies)
+    SELECT invoices.rowid, invoices.id, invoices.invoice_number, COALESCE(invoices.terms, ''),
+           COALESCE(purchaser.name, '') || ' ' || COALESCE(vendor.name, '')
+    FROM invoices
+    LEFT JOIN companies purchaser ON purchaser.id = invoices.purchaser_id
+    LEFT JOIN companies vendor ON vendor.id = invoices.vendor_id
+    """,
+    """
+    INSERT INTO invoice_item_search(rowid, invoice_id, name, description)
+    SELECT rowid, invoice_id, name, description FROM invoice_items WHERE invoice_id IS NOT NULL
+    """,
+    "INSERT INTO invoice_search(invoice_search) VALUES ('optimize')",
+    "INSERT INTO invoice_item_search(invoice_item_search) VALUES ('optimize')",
+]
+
+# Triggers of migration 0009 keeping the FTS5 tables up to date
+SEARCH_TRIGGERS = ('invoice_search_insert', 'invoice_search_update', 'invoice_search_delete',
+                   'invoice_item_search_insert', 'invoice_item_search_update', 'invoice_item_search_delete',
+                   'company_search_update')
+
+# Problems found by check_search_index and the queries counting them
+CHECK_SQL = [
+    ('invoices missing from the index or indexed with an outdated number', """
+    SELECT COUNT(*) FROM invoices WHERE NOT EXISTS (
+        SELECT 1 FROM invoice_search WHERE invoice_search.rowid = invoices.rowid
+        AND invoice_search.invoice_id = invoices.id AND invoice_search.invoice_number = invoices.invoice_number)
+    """),
+    ('indexed invoices that do not exist', """
+    SELECT COUNT(*) FROM invoice_search WHERE NOT EXISTS (
+        SELECT 1 FROM invoices WHERE invoices.rowid = invoice_search.rowid AND invoices.id = invoice_search.invoice_id)
+    """),
+    ('invoice items missing from the index or indexed with an outdated name', """
+    SELECT COUNT(*) FROM invoice_items WHERE invoice_items.invoice_id IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM invoice_item_search WHERE invoice_item_search.rowid = invoice_items.rowid
+        AND invoice_item_search.invoice_id = invoice_items.invoice_id AND invoice_item_search.name = invoice_items.name)
+    """),
+    ('indexed invoice items that do not exist', """
+    SELECT COUNT(*) FROM invoice_item_search WHERE NOT EXISTS (
+        SELECT 1 FROM invoice_items WHERE invoice_items.rowid = invoice_item_search.rowid
+        AND invoice_items.invoice_id = invoice_item_search.invoice_id)
+    """),
+]
+
+# Fields searched with LIKE queries on databases without the FTS5 tables
+FALLBACK_FIELDS = ('invoice_number', 'terms', 'vendor__name', 'purchaser__name', 'invoice_items__name',
+                   'invoice_items__description')
+
+_search_index_available = {}
+
+
+def get_search_config():
+    config = {'MAX_RESULTS': 1000, 'MAX_CANDIDATES': 2000}
+    config.update(getattr(settings, 'INVOICE_SEARCH', {}))
+    return config
+
+
+def search_index_available():
+    """
+    Whether the database has the FTS5 search tables, checked once per database
+    :return: Boolean
+    """
+    key = connection.settings_dict['NAME']
+    if key not in _search_index_available:
+        available = False
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+                               [INVOICE_SEARCH_TABLE])
+                available = cursor.fetchone() is not None
+        _search_index_available[key] = available
+    return _search_index_available[key]
+
+
+def get_tokens(text):
+    return TOKEN_RE.findall(text)
+
+
+def build_match_query(tokens):
+    """
+    Builds an FTS5 query matching the documents holding every token, the last one also as a prefix so results show
+    up while a word is being typed. Single characters are not used as prefixes, the index only covers prefixes of
+    two and three characters
+    :param tokens: List of words
+    :return: FTS5 MATCH expression
+    """
+    terms = ['"%s"' % token for token in tokens]
+    if len(tokens[-1]) > 1:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search_table(table, match_query, max_candidates, count):
+    """
+    Finds the best documents of one FTS5 table. Queries matching at most max_candidates documents are ranked with
+    BM25, which reads the whole doclist of every word to weigh it, others are read newest first and only as far as
+    needed
+    :param table: FTS5 table name
+    :param match_query: FTS5 MATCH expression
+    :param max_candidates: Largest number of documents ranked
+    :param count: Number of distinct invoices needed
+    :return: List of sort key and invoice id tuples, ranked matches sort before the newest ones
+    """
+    with connection.cursor() as recent_cursor, connection.cursor() as cursor:
+        recent_cursor.execute(RECENT_SQL.format(table=table), [match_query])
+        rowids = [rowid for rowid, in recent_cursor.fetchmany(max_candidates + 1)]
+        if len(rowids) <= max_candidates:
+            cursor.execute(RANKED_SQL.format(table=table), [match_query])
+            return [((0, score), invoice_id) for invoice_id, score in cursor.fetchall()]
+
+        matches = []
+        invoice_ids = set()
+        position = 0
+        while rowids:
+            batch, rowids = rowids[:DOCUMENTS_BATCH_SIZE], rowids[DOCUMENTS_BATCH_SIZE:]
+            cursor.execute(DOCUMENTS_SQL.format(table=table, rowids=', '.join(['%s'] * len(batch))), batch)
+            documents = dict(cursor.fetchall())
+            for rowid in batch:
+                invoice_id = documents.get(rowid)
+                position += 1
+                if invoice_id is not None and invoice_id not in invoice_ids:
+                    invoice_ids.add(invoice_id)
+                    matches.append(((1, position), invoice_id))
+                    if len(invoice_ids) >= count:
+                        return matches
+            if not rowids:
+                rowids = [rowid for rowid, in recent_cursor.fetchmany(max_candidates)]
+        return matches
+
+
+def search_invoice_ids(text, offset=0, limit=50):
+    """
+    Finds the invoices matching a full text query, best matches first. The invoice, its company names and each of
+    its items are separate documents, an invoice ranks by its best matching document. Documents are ranked with
+    BM25 unless more than MAX_CANDIDATES of them match, and only the MAX_RESULTS best invoices can be paged through
+    :param text: Search query
+    :param offset: Number of results to skip
+    :param limit: Maximum number of results
+    :return: List of invoice ids
+    """
+    config = get_search_config()
+    tokens = get_tokens(text)
+    limit = min(limit, config['MAX_RESULTS'] - offset)
+    if not tokens or limit <= 0:
+        return []
+    if not search_index_available():
+        return fallback_search_invoice_ids(tokens, offset, limit)
+
+    match_query = build_match_query(tokens)
+    matches = []
+    for table in SEARCH_TABLES:
+        matches += search_table(table, match_query, config['MAX_CANDIDATES'], offset + limit)
+    matches.sort()
+    invoice_ids = list(dict.fromkeys(invoice_id for _, invoice_id in matches))
+    return [uuid.UUID(invoice_id) for invoice_id in invoice_ids[offset:offset + limit]]
+
+
+def fallback_search_invoice_ids(tokens, offset, limit):
+    """
+    Searches with LIKE queries when the FTS5 index is missing, newest invoices first
+    :param tokens: List of words
+    :param offset: Number of results to skip
+    :param limit: Maximum number of results
+    :return: List of invoice ids
+    """
+    token_filters = []
+    for token in tokens:
+        token_filters.append(reduce(or_, (Q(**{'%s__icontains' % field: token}) for field in FALLBACK_FIELDS)))
+    invoices = Invoice.objects.filter(reduce(and_, token_filters)).order_by('-created_at', '-id')
+    return list(invoices.values_list('id', flat=True).distinct()[offset:offset + limit])
+
+
+def rebuild_search_index():
+    """
+    Rebuilds the FTS5 tables from the invoices, their items and companies. Needed after a VACUUM, which may change
+    the rowids the index refers to
+    :return: Whether the index exists and was rebuilt
+    """
+    if not search_index_available():
+        return False
+    with transaction.atomic(), connection.cursor() as cursor:
+        for sql in REBUILD_SQL:
+            cursor.execute(sql)
+    return True
+
+
+def check_search_index():
+    """
+    Compares the FTS5 tables with the invoices and items they index. SQLite drops the triggers of a table when it
+    rebuilds it, which it does for most schema changes of migrations, and the index then silently falls behind
+    :return: List of the problems found, empty when the index is up to date
+    """
+    problems = []
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name IN ({})".format(
+            ', '.join(['%s'] * len(SEARCH_TRIGGERS))), list(SEARCH_TRIGGERS))
+        triggers = {name for name, in cursor.fetchall()}
+        problems += ['Trigger %s is missing.' % name for name in SEARCH_TRIGGERS if name not in triggers]
+        for description, sql in CHECK_SQL:
+            cursor.execute(sql)
+            count = cursor.fetchone()[0]
+            if count:
+                problems.append('%s %s.' % (count, description))
+    return problems
@@ -1,29 +1,99 @@
+import re
+import uuid
 from datetime import datetime
 
 import pytz
+from django.conf import settings
+from django.contrib.auth import authenticate
 from django.db import transaction
 from rest_framework import serializers
+from rest_framework_jwt.serializers import RefreshJSONWebTokenSerializer
 from rest_framework_jwt.settings import api_settings
 
-from invoice.models import User, Invoice, Company, InvoiceItem
-from invoice.utils import generate_invoice_number
+from invoice.allocators import allocate_invoice_number
+from invoice.amounts import compute_item_amounts
+from invoice.models import User, Invoice, Company, InvoiceItem, UploadSession, InvoiceSummary
+from invoice.uploads import create_invoice_from_document, get_chunked_upload_config
 from invoice.validators import validate_invoice_file
 
 
+def issue_token(user):
+    """
+    Signs a new JWT for the user
+    :param user: User object
+    :return: Value of the Authorization header
+    """
+    jwt_payload_handler = api_settings.JWT_PAYLOAD_HANDLER
+    jwt_encode_handler = api_settings.JWT_ENCODE_HANDLER
+    payload = jwt_payload_handler(user)
+    token = jwt_encode_handler(payload)
+    return 'JWT ' + token
+
+
 class UserSerializer(serializers.ModelSerializer):
+    """
+    Serializes a user along with a newly signed token, only used where a token is issued: user sign up, login and
+    token refresh
+    """
     token = serializers.SerializerMethodField()
 
     class Meta:
         model = User
         fields = '__all__'
+        extra_kwargs = {'password': {'write_only': True}}
 
     @staticmethod
     def get_token(obj):
-        jwt_payload_handler = api_settings.JWT_PAYLOAD_HANDLER
-        jwt_encode_handler = api_settings.JWT_ENCODE_HANDLER
-        payload = jwt_payload_handler(obj)
-        token = jwt_encode_handler(payload)
-        return 'JWT ' + token
+        return issue_token(obj)
+
+    def create(self, validated_data):
+        password = validated_data.pop('password')
+        user = super().create(validated_data)
+        user.set_password(password)
+        user.save(update_fields=['password'])
+        return user
+
+    def update(self, instance, validated_data):
+        password = validated_data.pop('password', None)
+        if password is not None:
+            instance.set_password(password)
+        return super().update(instance, validated_data)
+
+
+class UserUpdateSerializer(UserSerializer):
+    """
+    Updates a user like UserSerializer but renders it without a token, tokens are only issued on sign up, login and
+    token refresh
+    """
+    token = None
+
+
+class UserListSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ('id', 'name', 'email', 'is_superuser', 'created_at', 'updated_at')
+
+
+class LoginSerializer(serializers.Serializer):
+    email = serializers.EmailField()
+    password = serializers.CharField(style={'input_type': 'password'})
+
+    def validate(self, attrs):
+        user = authenticate(self.context.get('request'), email=attrs['email'], password=attrs['password'])
+        if user is None:
+            raise serializers.ValidationError('Unable to log in with provided credentials.')
+        return {'user': user}
+
+
+class TokenRefreshSerializer(serializers.Serializer):
+    token = serializers.CharField()
+
+    def validate(self, attrs):
+        token = attrs['token']
+        if token.startswith('JWT '):
+            token = token[len('JWT '):]
+        refreshed = RefreshJSONWebTokenSerializer().validate({'token': token})
+        return {'token': 'JWT ' + refreshed['token'], 'user': refreshed['user']}
 
 
 class UserResponseSerializer(serializers.ModelSerializer):
@@ -39,12 +109,52 @@ class UploadInvoiceSerializer(serializers.Serializer):
         pass
 
     def create(self, validated_data):
-        pass
+        return create_invoice_from_document(validated_data['invoice'], validated_data.get('created_by'))
 
     class Meta:
         fields = ('invoice',)
 
 
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = ('id', 'file_name', 'size', 'received', 'invoice')
+
+
+class UploadStartSerializer(serializers.ModelSerializer):
+    size = serializers.IntegerField(min_value=1)
+
+    def validate_size(self, size):
+        max_size = get_chunked_upload_config()['MAX_SIZE']
+        if size > max_size:
+            raise serializers.ValidationError(
+                'Invoice size too large(must be less than %s MB).' % (max_size // 2 ** 20))
+        return size
+
+    class Meta:
+        model = UploadSession
+        fields = ('file_name', 'size')
+
+
+class UploadChunkSerializer(serializers.Serializer):
+    offset = serializers.IntegerField(min_value=0)
+    length = serializers.IntegerField(min_value=1, error_messages={
+        'required': 'Content-Length header is required.',
+        'null': 'Content-Length header is required.'
+    })
+
+    def validate_length(self, length):
+        if length > get_chunked_upload_config()['MAX_CHUNK_SIZE']:
+            raise serializers.ValidationError('Chunk too large.')
+        return length
+
+    def update(self, instance, validated_data):
+        pass
+
+    def create(self, validated_data):
+        pass
+
+
 class CompanySerializer(serializers.ModelSerializer):
     class Meta:
         model = Company
@@ -52,9 +162,13 @@ class CompanySerializer(serializers.ModelSerializer):
 
 
 class InvoiceItemSerializer(serializers.ModelSerializer):
+    id = serializers.UUIDField(required=False)
+
     class Meta:
         model = InvoiceItem
         fields = '__all__'
+        # Derived from the quantity and price when missing, see invoice.amounts
+        extra_kwargs = {'amount': {'required': False}}
 
 
 class InvoiceSerializer(serializers.ModelSerializer):
@@ -71,7 +185,9 @@ class InvoiceSerializer(serializers.ModelSerializer):
 
     @staticmethod
     def get_total(obj):
-        return obj.total
+        if obj._state.adding:
+            return obj.total
+        return obj.total_amount
 
 
 class InvoiceDigitizedSerializer(serializers.ModelSerializer):
@@ -82,10 +198,164 @@ class InvoiceDigitizedSerializer(serializers.ModelSerializer):
         fields = ('digitized', 'digitized_by', 'invoice_number')
 
 
+class DigitizedStatusQuerySerializer(serializers.Serializer):
+    wait = serializers.FloatField(min_value=0, default=0)
+    digitized = serializers.NullBooleanField(required=False)
+
+    def validate_wait(self, wait):
+        max_wait = getattr(settings, 'INVOICE_STATUS_EVENTS', {}).get('MAX_WAIT', 30)
+        if wait > max_wait:
+            raise serializers.ValidationError('Ensure this value is less than or equal to %s.' % max_wait)
+        return wait
+
+    def update(self, instance, validated_data):
+        pass
+
+    def create(self, validated_data):
+        pass
+
+
+class DigitizedStatusStreamSerializer(serializers.Serializer):
+    ids = serializers.CharField()
+
+    def validate_ids(self, ids):
+        try:
+            ids = list(dict.fromkeys(uuid.UUID(invoice_id.strip()) for invoice_id in ids.split(',')))
+        except ValueError:
+            raise serializers.ValidationError('Provide comma separated invoice ids.')
+        max_ids = getattr(settings, 'INVOICE_STATUS_EVENTS', {}).get('MAX_IDS', 100)
+        if len(ids) > max_ids:
+            raise serializers.ValidationError('At most %s invoices can be followed at once.' % max_ids)
+        return ids
+
+    def update(self, instance, validated_data):
+        pass
+
+    def create(self, validated_data):
+        pass
+
+
+class InvoiceDigitizeBatchSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.UUIDField(), min_length=1)
+
+    def validate_ids(self, ids):
+        ids = list(dict.fromkeys(ids))
+        max_ids = getattr(settings, 'INVOICE_DIGITIZE_BATCH_SIZE', 500)
+        if len(ids) > max_ids:
+            raise serializers.ValidationError('At most %s invoices can be digitized at once.' % max_ids)
+        return ids
+
+    def update(self, instance, validated_data):
+        pass
+
+    def create(self, validated_data):
+        pass
+
+
 class InvoiceItemsSerializer(serializers.ModelSerializer):
     class Meta:
         model = InvoiceItem
         fields = ('name', 'description', 'quantity', 'price', 'amount')
+        extra_kwargs = {'amount': {'required': False}}
+
+    def validate(self, attrs):
+        if self.instance is not None and not {'quantity', 'price', 'amount'} & set(attrs):
+            return attrs
+        item = dict(attrs)
+        if self.instance is not None:
+            item.setdefault('quantity', self.instance.quantity)
+            item.setdefault('price', self.instance.price)
+        errors = compute_item_amounts([item])
+        if errors:
+            raise serializers.ValidationError({'amount': [errors[0]]})
+        attrs['amount'] = item['amount']
+        return attrs
+
+
+class InvoiceFilterSerializer(serializers.Serializer):
+    created_after = serializers.DateTimeField(required=False, default_timezone=pytz.UTC)
+    created_before = serializers.DateTimeField(required=False, default_timezone=pytz.UTC)
+    vendor = serializers.UUIDField(required=False)
+    purchaser = serializers.UUIDField(required=False)
+    digitized = serializers.NullBooleanField(required=False)
+    due_after = serializers.DateTimeField(required=False, default_timezone=pytz.UTC)
+    due_before = serializers.DateTimeField(required=False, default_timezone=pytz.UTC)
+    total_min = serializers.FloatField(required=False)
+    total_max = serializers.FloatField(required=False)
+
+    def update(self, instance, validated_data):
+        pass
+
+    def create(self, validated_data):
+        pass
+
+
+class InvoiceExportSerializer(InvoiceFilterSerializer):
+    export_format = serializers.ChoiceField(choices=['ndjson', 'csv'], default='ndjson')
+
+
+class InvoiceListQuerySerializer(InvoiceFilterSerializer):
+    # Every ordering is backed by an index on the field and the id
+    ordering = serializers.ChoiceField(choices=['created_at', '-created_at', 'total_amount', '-total_amount'],
+                                       default='created_at')
+
+
+class InvoiceSearchSerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=255)
+    page = serializers.IntegerField(min_value=1, default=1)
+    page_size = serializers.IntegerField(min_value=1, required=False)
+
+    def validate_q(self, q):
+        if not re.search(r'\w', q):
+            raise serializers.ValidationError('Provide at least one word to search for.')
+        return q
+
+    def validate_page_size(self, page_size):
+        return min(page_size, getattr(settings, 'MAX_PAGE_SIZE', 500))
+
+    def update(self, instance, validated_data):
+        pass
+
+    def create(self, validated_data):
+        pass
+
+
+class ReportQuerySerializer(serializers.Serializer):
+    company = serializers.UUIDField(required=False)
+
+    def update(self, instance, validated_data):
+        pass
+
+    def create(self, validated_data):
+        pass
+
+
+class SpendReportSerializer(ReportQuerySerializer):
+    role = serializers.ChoiceField(choices=InvoiceSummary.ROLE_CHOICES, default=InvoiceSummary.VENDOR)
+    period = serializers.ChoiceField(choices=['day', 'month', 'year'], default='month')
+    digitized = serializers.NullBooleanField(required=False)
+    created_after = serializers.DateField(required=False)
+    created_before = serializers.DateField(required=False)
+
+
+class OutstandingReportSerializer(ReportQuerySerializer):
+    role = serializers.ChoiceField(choices=InvoiceSummary.ROLE_CHOICES, default=InvoiceSummary.PURCHASER)
+
+
+class OverdueReportSerializer(ReportQuerySerializer):
+    role = serializers.ChoiceField(choices=InvoiceSummary.ROLE_CHOICES, default=InvoiceSummary.PURCHASER)
+    as_of = serializers.DateField(required=False)
+
+
+class InvoiceImportFileSerializer(serializers.Serializer):
+    file = serializers.FileField(allow_empty_file=False)
+    import_format = serializers.ChoiceField(choices=['ndjson', 'csv'], default='ndjson')
+
+    def update(self, instance, validated_data):
+        pass
+
+    def create(self, validated_data):
+        pass
 
 
 class InvoiceCreateSerializer(serializers.ModelSerializer):
@@ -101,28 +371,80 @@ class InvoiceCreateSerializer(serializers.ModelSerializer):
     })
     invoice_items = serializers.ListField(child=InvoiceItemSerializer(), min_length=1)
     digitized = serializers.BooleanField(default=False)
-    invoice_number = serializers.CharField(default=generate_invoice_number)
+    invoice_number = serializers.CharField(required=False)
     deu_date = serializers.DateTimeField(input_formats=["%Y-%m-%d %H:%M:%S"], default_timezone=pytz.UTC)
+    # Whether the item amounts are computed per invoice, the importer computes them for a whole batch instead
+    compute_amounts = True
 
-    @transaction.atomic
     def create(self, validated_data):
+        if 'invoice_number' not in validated_data:
+            # Allocated before the transaction, so a rollback cannot undo the reservation of a block still in use
+            validated_data['invoice_number'] = allocate_invoice_number()
+        return self.create_invoice(validated_data)
+
+    @transaction.atomic
+    def create_invoice(self, validated_data):
         invoice_items = validated_data.pop('invoice_items', [])
+        validated_data['total_amount'], validated_data['item_count'] = InvoiceItem.objects.get_totals(invoice_items)
         invoice = self.Meta.model.objects.create(**validated_data)
-        for invoice_item in invoice_items:
-            invoice_item['invoice'] = invoice
-            InvoiceItem.objects.create(**invoice_item)
+        InvoiceItem.objects.bulk_create_items(invoice, invoice_items)
         return invoice
 
     @transaction.atomic
     def update(self, instance, validated_data):
         if validated_data.get('invoice_items'):
             invoice_items = validated_data.pop('invoice_items')
-            InvoiceItem.objects.create_items(instance, invoice_items)
+            InvoiceItem.objects.sync_items(instance, invoice_items)
         for (key, value) in validated_data.items():
             setattr(instance, key, value)
-        instance.save()
+        # Only the validated fields are written, totals are kept by update_totals and writes made since the instance
+        # was loaded, such as item updates and digitization, are not overwritten
+        instance.save(update_fields=list(validated_data) + ['updated_at'])
         return instance
 
+    def validate_invoice_items(self, invoice_items):
+        existing_items = self.validate_item_ids(invoice_items)
+        if self.compute_amounts:
+            self.validate_item_amounts(invoice_items, existing_items)
+        return invoice_items
+
+    def validate_item_ids(self, invoice_items):
+        """
+        :param invoice_items: List of invoice item dicts
+        :return: Dict of the quantity and price of the existing items referred to by id
+        """
+        item_ids = [item['id'] for item in invoice_items if 'id' in item]
+        if not item_ids:
+            return {}
+        if self.instance is None:
+            raise serializers.ValidationError('Invoice item ids can only be provided when updating an invoice.')
+        if len(item_ids) != len(set(item_ids)):
+            raise serializers.ValidationError('Invoice item ids must be unique.')
+        existing_items = {pk: {'quantity': quantity, 'price': price} for pk, quantity, price in
+                          self.instance.invoice_items.filter(pk__in=item_ids).values_list('pk', 'quantity', 'price')}
+        if set(existing_items) != set(item_ids):
+            raise serializers.ValidationError('Invalid invoice item ids provided.')
+        return existing_items
+
+    @staticmethod
+    def validate_item_amounts(invoice_items, existing_items):
+        """
+        Derives or checks the amounts of all the items at once, items partially updated keep their stored quantity
+        and price
+        :param invoice_items: List of invoice item dicts
+        :param existing_items: Dict of the quantity and price of the existing items referred to by id
+        :return:
+        """
+        items = [dict(existing_items.get(item.get('id'), {}), **item) for item in invoice_items]
+        errors = {index: {'price': ['This field is required.']} for index, item in enumerate(items)
+                  if 'price' not in item}
+        if not errors:
+            errors = {index: {'amount': [error]} for index, error in compute_item_amounts(items).items()}
+        if errors:
+            raise serializers.ValidationError(errors)
+        for invoice_item, item in zip(invoice_items, items):
+            invoice_item['amount'] = item['amount']
+
     def validate(self, attrs):
         if 'deu_date' in attrs and attrs.get('deu_date') < datetime.now(tz=pytz.UTC):
             raise serializers.ValidationError({'due_date': "Due date cannot be less than current date"})
@@ -131,3 +453,15 @@ class InvoiceCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Invoice
         fields = ('purchaser', 'vendor', 'invoice_items', 'invoice_number', 'terms', 'deu_date', 'digitized')
+
+
+class InvoiceImportSerializer(InvoiceCreateSerializer):
+    """
+    Validates one invoice of a bulk import without querying the database. Companies, invoice numbers and item
+    amounts are checked for a whole batch at once by the importer
+    """
+    purchaser = serializers.UUIDField(error_messages={'invalid': 'Provide data in correct format.'})
+    vendor = serializers.UUIDField(error_messages={'invalid': 'Provide data in correct format.'})
+    invoice_number = serializers.CharField(required=False, max_length=255)
+    deu_date = serializers.DateTimeField(input_formats=["%Y-%m-%d %H:%M:%S", 'iso-8601'], default_timezone=pytz.UTC)
+    compute_amounts = False
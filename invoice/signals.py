@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Sent with the ids of the invoices whose API representation changed: the invoice itself, its items or its
+# digitization status
+invoices_changed = Signal(providing_args=['invoice_ids'])
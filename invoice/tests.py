@@ -1,16 +1,46 @@
+import csv
+import hashlib
 import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
 import uuid
+from datetime import timedelta
+from io import StringIO
 
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
 from django.http import JsonResponse
+from django.test import override_settings, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.exceptions import ValidationError
 from rest_framework.reverse import reverse
-from rest_framework.test import APITestCase
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
 
-from invoice.models import User, Invoice, Company
-from invoice.serializers import UserSerializer, InvoiceSerializer, InvoiceDigitizedSerializer
+from invoice.allocators import BlockInvoiceNumberAllocator, allocate_invoice_number, \
+    get_invoice_number_allocator
+from invoice.amounts import compute_item_amounts, numpy
+from invoice.caches import LRUResponseCache, UserCache, get_response_cache
+from invoice.extraction import ExtractionPool, ExtractionError, ExtractionTimeout, extract_invoice
+from invoice.importers import InvoiceImporter
+from invoice.models import User, Invoice, Company, InvoiceItem, InvoiceNumberSequence, DigitizationJob, \
+    InvoiceSummary
+from invoice.pdf import PDFError, build_pdf, extract_pages
+from invoice.reports import check_summaries
+from invoice.representations import serialize_invoice, serialize_invoices
+from invoice.search import check_search_index, fallback_search_invoice_ids, get_tokens, search_invoice_ids
+from invoice.serializers import UserSerializer, InvoiceSerializer, InvoiceDigitizedSerializer, InvoiceCreateSerializer
+from invoice.workers import DigitizationWorker, save_draft
+from plate_iq.metrics import collect_metrics, registry
 
 
 class TestUploadInvoiceAPI(APITestCase):
@@ -27,14 +57,55 @@ class TestUploadInvoiceAPI(APITestCase):
         self.authentication_token = user_serializer['token']
         self.client.credentials(HTTP_AUTHORIZATION=self.authentication_token)
         self.url = reverse('invoices-upload')
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media_settings = self.settings(MEDIA_ROOT=media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
 
-    # API /invoice/upload - Test to successfully upload invoice and get mock invoice details
+    # API /invoice/upload - Test to successfully upload invoice and get the non digitized invoice created for it
     def test_upload_api(self):
-        invoice = SimpleUploadedFile("invoice.pdf", b"file_content", content_type="application/pdf")
+        invoice = SimpleUploadedFile("invoice.pdf", b"%PDF-1.4 file_content", content_type="application/pdf")
         data = {'invoice': invoice}
         response = self.client.post(path=self.url, data=data, format='multipart', HTTP_ACCEPT='application/json')
-        invoice_object = Invoice.objects.first()
+        invoice_object = Invoice.objects.get(pk=json.loads(response.content)['id'])
         self.assertEqual(response.content, JsonResponse(InvoiceSerializer(invoice_object).data).content)
+        self.assertFalse(invoice_object.digitized)
+        self.assertEqual(invoice_object.created_by, self.user)
+        with invoice_object.document.open('rb') as document:
+            self.assertEqual(document.read(), b"%PDF-1.4 file_content")
+        self.assertEqual(list(invoice_object.digitization_jobs.values_list('status', flat=True)),
+                         [DigitizationJob.PENDING])
+
+    # API /invoice/upload - Test a document uploaded again resolves to the existing invoice without being stored
+    def test_upload_duplicate_document(self):
+        invoice_ids = []
+        for name, content in [('invoice.pdf', b'%PDF-1.4 first'), ('copy.pdf', b'%PDF-1.4 first'),
+                              ('invoice.pdf', b'%PDF-1.4 second')]:
+            invoice = SimpleUploadedFile(name, content, content_type="application/pdf")
+            response = self.client.post(path=self.url, data={'invoice': invoice}, format='multipart')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            invoice_ids.append(json.loads(response.content)['id'])
+        self.assertEqual(invoice_ids[0], invoice_ids[1])
+        self.assertNotEqual(invoice_ids[0], invoice_ids[2])
+        self.assertEqual(Invoice.objects.get(pk=invoice_ids[0]).document_sha256,
+                         hashlib.sha256(b'%PDF-1.4 first').hexdigest())
+        self.assertEqual(DigitizationJob.objects.count(), 2)
+        self.assertEqual(sum(len(files) for _, _, files in os.walk(settings.MEDIA_ROOT)), 2)
+
+    # API /invoice/upload - Test queued uploads are processed by the digitization worker
+    def test_upload_processed_by_worker(self):
+        for content in [b"%PDF-1.4 file_content", b"not a pdf"]:
+            invoice = SimpleUploadedFile("invoice.pdf", content, content_type="application/pdf")
+            self.client.post(path=self.url, data={'invoice': invoice}, format='multipart')
+        output = StringIO()
+        digitization = {'MAX_ATTEMPTS': 1, 'PROCESSOR': 'invoice.workers.check_document'}
+        with override_settings(INVOICE_DIGITIZATION=digitization):
+            call_command('run_digitization_worker', '--once', stdout=output)
+        self.assertIn('Processed 2 digitization jobs.', output.getvalue())
+        jobs = {job.status: job for job in DigitizationJob.objects.all()}
+        self.assertEqual(set(jobs), {DigitizationJob.DONE, DigitizationJob.FAILED})
+        self.assertEqual(jobs[DigitizationJob.FAILED].error, 'Document is not a PDF file.')
 
     # API /invoice/upload - Test unsupported content type
     def test_upload_unsupported_content_type_api(self):
@@ -237,6 +308,52 @@ class TestDigitizeAPI(APITestCase):
         })
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
+    # API /invoices/pk/digitize - Test the invoice is digitized with a single conditional update
+    def test_digitize_single_update(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(path=self.url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        updates = [query['sql'] for query in context.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"invoices"."digitized"', updates[0].split(' WHERE ')[1])
+        response = self.client.post(path=self.url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Invoice.objects.get(pk=self.invoice.pk).digitized_by, self.user)
+
+    # API /invoices/digitize - Test to digitizing a batch of invoices
+    def test_digitize_batch(self):
+        digitized_invoice = Invoice.objects.exclude(pk=self.invoice.pk).first()
+        Invoice.objects.filter(pk=digitized_invoice.pk).update(digitized=True)
+        unknown_id = str(uuid.uuid4())
+        invoice_ids = [str(self.invoice.pk), str(digitized_invoice.pk), unknown_id, str(self.invoice.pk)]
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse('invoices-digitize-batch'), data={'ids': invoice_ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content), {'digitized': 1, 'results': [
+            {'id': str(self.invoice.pk), 'result': 'digitized'},
+            {'id': str(digitized_invoice.pk), 'result': 'already_digitized'},
+            {'id': unknown_id, 'result': 'not_found'}]})
+        statements = [query['sql'].split()[0] for query in context.captured_queries]
+        self.assertEqual(statements.count('UPDATE'), 1)
+        # The UPDATE and the SELECT of the results run in one transaction
+        update = statements.index('UPDATE')
+        self.assertEqual(statements[update - 1:update + 3], ['SAVEPOINT', 'UPDATE', 'SELECT', 'RELEASE'])
+        self.invoice.refresh_from_db()
+        self.assertEqual((self.invoice.digitized, self.invoice.digitized_by), (True, self.user))
+
+    # API /invoices/digitize - Test batch size limit and permissions of the batch digitize API
+    @override_settings(INVOICE_DIGITIZE_BATCH_SIZE=2)
+    def test_digitize_batch_invalid(self):
+        url = reverse('invoices-digitize-batch')
+        response = self.client.post(url, data={'ids': [str(uuid.uuid4()) for _ in range(3)]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(url, data={'ids': ['not an id']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.user.is_superuser = False
+        self.user.save()
+        response = self.client.post(url, data={'ids': [str(self.invoice.pk)]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
 
 class TestUpdateInvoiceAPI(APITestCase):
     base_dir = settings.BASE_DIR
@@ -310,6 +427,15 @@ class TestUpdateInvoiceAPI(APITestCase):
         self.assertEqual(api_response, error)
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    # API v1/invoice/pk Test update of invoice without invoice number keeps its number and allocates none
+    def test_update_without_invoice_number(self):
+        self.data.pop('invoice_number')
+        self.data['deu_date'] = (timezone.now() + timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S')
+        response = self.client.put(path=self.url, data=self.data, format='json', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content)['invoice_number'], 'INV56789')
+        self.assertFalse(InvoiceNumberSequence.objects.exists())
+
     # API v1/invoice/pk Test update of invoice with deu date less than current date
     def test_update_deu_date_less_than_current_date(self):
         self.data['deu_date'] = "2019-10-01 00:00:00"
@@ -499,6 +625,20 @@ class TestPartialUpdateInvoiceAPI(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(api_response['invoice_items']), 3)
 
+    # Test an update only writes its own fields over writes made after the invoice was loaded
+    def test_partial_update_interleaved_with_other_writes(self):
+        invoice = Invoice.objects.get(invoice_number='INV12345')
+        serializer = InvoiceCreateSerializer(invoice, data={'terms': 'New terms'}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        item = invoice.invoice_items.first()
+        InvoiceItem.objects.update_item(item, {'quantity': item.quantity + 1, 'amount': item.amount + item.price})
+        Invoice.objects.filter(pk=invoice.pk).digitize(self.user)
+        serializer.save()
+        invoice = Invoice.objects.with_totals().get(pk=invoice.pk)
+        self.assertEqual(invoice.terms, 'New terms')
+        self.assertEqual((invoice.digitized, invoice.digitized_by), (True, self.user))
+        self.assertEqual((invoice.total_amount, invoice.item_count), (invoice.items_total, invoice.items_count))
+
     # API v1/invoice/pk Test of partial update of invoice with unauthenticated user
     def test_partial_update_not_authenticated(self):
         self.client.credentials(HTTP_AUTHORIZATION="wrong auth")
@@ -519,3 +659,1861 @@ class TestPartialUpdateInvoiceAPI(APITestCase):
             "detail": "You do not have permission to perform this action."
         })
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class TestInvoiceListQueryCount(APITestCase):
+    base_dir = settings.BASE_DIR
+    fixtures = [base_dir + '/invoice/fixtures/users.json',
+                base_dir + '/invoice/fixtures/companies.json',
+                base_dir + '/invoice/fixtures/invoices.json',
+                base_dir + '/invoice/fixtures/invoice_items.json',
+                ]
+
+    def setUp(self):
+        self.user = User.objects.get(email='admin@plate.com')
+        user_serializer = UserSerializer(self.user).data
+        self.authentication_token = user_serializer['token']
+        self.client.credentials(HTTP_AUTHORIZATION=self.authentication_token)
+        self.url = reverse('invoices-list')
+
+    def add_invoices(self, count):
+        template = Invoice.objects.get(invoice_number='INV56789')
+        for index in range(count):
+            invoice = Invoice.objects.create(invoice_number='TestInvoice%s' % index, deu_date=template.deu_date,
+                                             purchaser=template.purchaser, vendor=template.vendor,
+                                             created_by=template.created_by, digitized_by=self.user, digitized=True)
+            InvoiceItem.objects.create(invoice=invoice, name='item', description='foo', quantity=1, price=10,
+                                       amount=10)
+
+    def count_list_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(path=self.url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(context.captured_queries), json.loads(response.content)
+
+    # API v1/invoices Test the number of queries does not grow with the number of invoices
+    def test_list_query_count_is_constant(self):
+        queries, api_response = self.count_list_queries()
+        self.assertEqual(len(api_response['results']), 2)
+        self.add_invoices(10)
+        self.assertEqual(self.count_list_queries()[0], queries)
+
+    # API v1/invoices Test the listed invoices match the invoice serializer
+    def test_list_matches_serializer(self):
+        self.add_invoices(3)
+        api_response = self.count_list_queries()[1]
+        invoices = {invoice.pk: invoice for invoice in Invoice.objects.all()}
+        for invoice_data in api_response['results']:
+            invoice = invoices[uuid.UUID(invoice_data['id'])]
+            expected_response = json.loads(JsonResponse(InvoiceSerializer(invoice).data).content)
+            self.assertEqual(invoice_data, expected_response)
+
+
+class TestInvoiceTotals(APITestCase):
+    base_dir = settings.BASE_DIR
+    fixtures = [base_dir + '/invoice/fixtures/users.json',
+                base_dir + '/invoice/fixtures/companies.json',
+                base_dir + '/invoice/fixtures/invoices.json',
+                base_dir + '/invoice/fixtures/invoice_items.json',
+                ]
+
+    # Test the database computed totals match the Python computed totals
+    def test_totals_match_property(self):
+        invoices = Invoice.objects.with_totals()
+        self.assertEqual(len(invoices), 2)
+        for invoice in invoices:
+            self.assertEqual(invoice.items_total, invoice.total)
+
+    # Test invoices without items have a zero total
+    def test_total_without_items(self):
+        invoice = Invoice.objects.get(invoice_number='INV12345')
+        invoice.invoice_items.all().delete()
+        self.assertEqual(Invoice.objects.with_totals().get(pk=invoice.pk).items_total, 0)
+
+    # Test totals can be filtered and ordered on in the database
+    def test_filter_and_order_by_total(self):
+        invoice = Invoice.objects.get(invoice_number='INV12345')
+        InvoiceItem.objects.create(invoice=invoice, name='item', description='foo', quantity=1, price=10, amount=10)
+        invoices = Invoice.objects.with_totals().order_by('-items_total')
+        self.assertEqual([invoice.items_total for invoice in invoices], [810, 800])
+        self.assertEqual(list(Invoice.objects.with_totals().filter(items_total__gt=800)), [invoice])
+
+    # Test the serializer reads the stored total without fetching the items
+    def test_serializer_uses_stored_total(self):
+        invoice = Invoice.objects.get(invoice_number='INV12345')
+        with self.assertNumQueries(0):
+            total = InvoiceSerializer.get_total(invoice)
+        self.assertEqual(total, invoice.total)
+
+    # Test replacing the items of an invoice keeps the stored totals in sync
+    def test_create_items_updates_stored_totals(self):
+        invoice = Invoice.objects.get(invoice_number='INV12345')
+        InvoiceItem.objects.create_items(invoice, [
+            {'name': 'item 1', 'description': 'foo', 'quantity': 10, 'price': 100, 'amount': 1000},
+            {'name': 'item 2', 'description': 'bar', 'quantity': 1, 'price': 50, 'amount': 50},
+            {'name': 'item 3', 'description': 'baz', 'quantity': 2, 'price': 5, 'amount': 10},
+        ])
+        invoice = Invoice.objects.with_totals().get(pk=invoice.pk)
+        self.assertEqual((invoice.total_amount, invoice.item_count), (1060, 3))
+        self.assertEqual((invoice.items_total, invoice.items_count), (1060, 3))
+        self.assertEqual(list(Invoice.objects.filter(total_amount__gt=1000)), [invoice])
+
+    # Test removing the items of an invoice resets the stored totals
+    def test_clean_items_resets_stored_totals(self):
+        invoice = Invoice.objects.get(invoice_number='INV12345')
+        InvoiceItem.objects.clean_items(invoice)
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.total_amount, invoice.item_count), (0, 0))
+
+    # Test the management command verifies and repairs stale stored totals
+    def test_recompute_invoice_totals_command(self):
+        Invoice.objects.filter(invoice_number='INV12345').update(total_amount=1, item_count=7)
+        with self.assertRaises(CommandError):
+            call_command('recompute_invoice_totals', '--check', stdout=StringIO())
+        output = StringIO()
+        call_command('recompute_invoice_totals', '--batch-size', '1', stdout=output)
+        self.assertIn('Checked 2 invoices, fixed 1 stale totals.', output.getvalue())
+        invoice = Invoice.objects.get(invoice_number='INV12345')
+        self.assertEqual((invoice.total_amount, invoice.item_count), (800, 2))
+        call_command('recompute_invoice_totals', '--check', stdout=StringIO())
+
+
+class TestInvoiceItemBulkInsert(APITestCase):
+    base_dir = settings.BASE_DIR
+    fixtures = [base_dir + '/invoice/fixtures/users.json',
+                base_dir + '/invoice/fixtures/companies.json',
+                base_dir + '/invoice/fixtures/invoices.json',
+                base_dir + '/invoice/fixtures/invoice_items.json',
+                ]
+
+    def setUp(self):
+        self.user = User.objects.get(email='admin@plate.com')
+        user_serializer = UserSerializer(self.user).data
+        self.authentication_token = user_serializer['token']
+        self.client.credentials(HTTP_AUTHORIZATION=self.authentication_token)
+        self.invoice = Invoice.objects.get(invoice_number='INV56789')
+        self.data = {
+            "purchaser": '56aae847-a6ca-4959-b42b-738ed6db4faf',
+            "vendor": '82aea13e-a789-428f-972d-06d07e0a565d',
+            "terms": "some terms",
+            "deu_date": "2099-10-01 00:00:00",
+            "invoice_items": [{"name": "item %s" % index, "description": "foo", "quantity": 2, "price": 5,
+                               "amount": 10} for index in range(300)],
+            "invoice_number": "TestInvoice123"
+        }
+
+    def count_item_inserts(self, method, url):
+        with CaptureQueriesContext(connection) as context:
+            response = method(path=url, data=self.data, format='json', HTTP_ACCEPT='application/json')
+        inserts = [query for query in context.captured_queries
+                   if query['sql'].startswith('INSERT INTO "invoice_items"')]
+        return response, len(inserts)
+
+    # API v1/invoices Test invoice items are created with batched inserts
+    @override_settings(INVOICE_ITEM_BATCH_SIZE=50)
+    def test_create_batches_item_inserts(self):
+        response, inserts = self.count_item_inserts(self.client.post, reverse('invoices-list'))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(inserts, 6)
+        api_response = json.loads(response.content)
+        self.assertEqual(len(api_response['invoice_items']), 300)
+        self.assertEqual((api_response['total'], api_response['item_count']), (3000, 300))
+        self.assertEqual(len({item['id'] for item in api_response['invoice_items']}), 300)
+
+    # API v1/invoices/pk Test invoice items are replaced with batched inserts
+    @override_settings(INVOICE_ITEM_BATCH_SIZE=100)
+    def test_update_batches_item_inserts(self):
+        url = reverse('invoices-detail', args=(self.invoice.pk,))
+        response, inserts = self.count_item_inserts(self.client.put, url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(inserts, 3)
+        self.assertEqual(self.invoice.invoice_items.count(), 300)
+        self.invoice.refresh_from_db()
+        self.assertEqual((self.invoice.total_amount, self.invoice.item_count), (3000, 300))
+
+
+class TestInvoiceItemDiffUpdate(APITestCase):
+    base_dir = settings.BASE_DIR
+    fixtures = [base_dir + '/invoice/fixtures/users.json',
+                base_dir + '/invoice/fixtures/companies.json',
+                base_dir + '/invoice/fixtures/invoices.json',
+                base_dir + '/invoice/fixtures/invoice_items.json',
+                ]
+
+    def setUp(self):
+        self.user = User.objects.get(email='admin@plate.com')
+        user_serializer = UserSerializer(self.user).data
+        self.authentication_token = user_serializer['token']
+        self.client.credentials(HTTP_AUTHORIZATION=self.authentication_token)
+        self.invoice = Invoice.objects.get(invoice_number='INV56789')
+        self.url = reverse('invoices-detail', args=(self.invoice.pk,))
+        self.items = list(self.invoice.invoice_items.order_by('amount'))
+
+    def item_data(self, item, **changes):
+        data = {'id': str(item.pk), 'name': item.name, 'description': item.description, 'quantity': item.quantity,
+                'price': item.price, 'amount': item.amount}
+        data.update(changes)
+        return data
+
+    # API v1/invoices/pk Test changing one item keeps the ids of every item
+    def test_partial_update_changes_item_in_place(self):
+        data = {'invoice_items': [self.item_data(self.items[0], quantity=20, amount=400),
+                                  self.item_data(self.items[1])]}
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.patch(path=self.url, data=data, format='json', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        writes = [query['sql'].split()[0] for query in context.captured_queries
+                  if query['sql'].split()[0] in ('INSERT', 'UPDATE', 'DELETE') and 'invoice_items' in query['sql']]
+        self.assertEqual(writes, ['UPDATE'])
+        api_response = json.loads(response.content)
+        self.assertEqual({item['id'] for item in api_response['invoice_items']},
+                         {str(item.pk) for item in self.items})
+        self.assertEqual((api_response['total'], api_response['item_count']), (1000, 2))
+        self.assertEqual(InvoiceItem.objects.get(pk=self.items[0].pk).quantity, 20)
+
+    # API v1/invoices/pk Test items are added and removed while the untouched item is kept
+    def test_partial_update_adds_and_removes_items(self):
+        data = {'invoice_items': [self.item_data(self.items[1]),
+                                  {'name': 'new item', 'description': 'foo', 'quantity': 1, 'price': 5, 'amount': 5}]}
+        response = self.client.patch(path=self.url, data=data, format='json', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        items = {item.name: item for item in self.invoice.invoice_items.all()}
+        self.assertEqual(set(items), {self.items[1].name, 'new item'})
+        self.assertEqual(items[self.items[1].name].pk, self.items[1].pk)
+        self.assertFalse(InvoiceItem.objects.filter(pk=self.items[0].pk).exists())
+        self.invoice.refresh_from_db()
+        self.assertEqual((self.invoice.total_amount, self.invoice.item_count), (605, 2))
+
+    # API v1/invoices/pk Test item ids of another invoice are rejected
+    def test_partial_update_unknown_item_id(self):
+        other_item = InvoiceItem.objects.exclude(invoice=self.invoice).first()
+        data = {'invoice_items': [self.item_data(other_item)]}
+        response = self.client.patch(path=self.url, data=data, format='json', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(json.loads(response.content), {'invoice_items': ['Invalid invoice item ids provided.']})
+
+    # API v1/invoices/pk/items/item_pk Test partial update of a single invoice item
+    def test_update_single_item(self):
+        url = reverse('invoices-item', args=(self.invoice.pk, self.items[0].pk))
+        response = self.client.patch(path=url, data={'quantity': 5, 'amount': 100}, format='json',
+                                     HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        api_response = json.loads(response.content)
+        self.assertEqual((api_response['id'], api_response['quantity']), (str(self.items[0].pk), 5))
+        self.invoice.refresh_from_db()
+        self.assertEqual((self.invoice.total_amount, self.invoice.item_count), (700, 2))
+
+    # API v1/invoices/pk/items/item_pk Test updating an item of another invoice
+    def test_update_single_item_of_other_invoice(self):
+        other_item = InvoiceItem.objects.exclude(invoice=self.invoice).first()
+        url = reverse('invoices-item', args=(self.invoice.pk, other_item.pk))
+        response = self.client.patch(path=url, data={'quantity': 5}, format='json', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    # API v1/invoices/pk/items/item_pk Test updating an item with unauthorised user
+    def test_update_single_item_not_authorised(self):
+        self.user.is_superuser = False
+        self.user.save()
+        url = reverse('invoices-item', args=(self.invoice.pk, self.items[0].pk))
+        response = self.client.patch(path=url, data={'quantity': 5}, format='json', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+
+class TestChunkedUploadAPI(APITestCase):
+    base_dir = settings.BASE_DIR
+    fixtures = [base_dir + '/invoice/fixtures/users.json',
+                base_dir + '/invoice/fixtures/companies.json',
+                base_dir + '/invoice/fixtures/invoices.json',
+                base_dir + '/invoice/fixtures/invoice_items.json',
+                ]
+
+    def setUp(self):
+        user = User.objects.get(email='jon.doe@plate.com')
+        self.client.credentials(HTTP_AUTHORIZATION=UserSerializer(user).data['token'])
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media_settings = self.settings(MEDIA_ROOT=media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.content = b'%PDF-1.4\n' + bytes(range(256)) * 10
+        response = self.client.post(reverse('invoices-upload-start'),
+                                    data={'file_name': 'scan.pdf', 'size': len(self.content)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.upload = json.loads(response.content)
+        self.url = reverse('invoices-upload-chunk', args=[self.upload['id']])
+
+    def put_chunk(self, offset, end):
+        return self.client.put('%s?offset=%s' % (self.url, offset), data=self.content[offset:end],
+                               content_type='application/octet-stream')
+
+    # API /invoices/uploads - Test uploading a file in chunks creates its invoice
+    def test_chunked_upload(self):
+        self.assertEqual(self.upload['received'], 0)
+        for offset in range(0, len(self.content), 1000):
+            response = self.put_chunk(offset, offset + 1000)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(self.url)
+        self.assertEqual(json.loads(response.content)['received'], len(self.content))
+
+        finish_url = reverse('invoices-upload-finish', args=[self.upload['id']])
+        response = self.client.post(finish_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        invoice = Invoice.objects.get(pk=json.loads(response.content)['id'])
+        with invoice.document.open('rb') as document:
+            self.assertEqual(document.read(), self.content)
+        self.assertEqual(invoice.document_sha256, hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(invoice.digitization_jobs.count(), 1)
+        self.assertEqual(os.listdir(os.path.join(settings.MEDIA_ROOT, 'partial')), [])
+        self.assertEqual(json.loads(self.client.post(finish_url).content)['id'], str(invoice.pk))
+
+    # API /invoices/uploads - Test an interrupted upload resumes from the received offset
+    def test_chunked_upload_resume(self):
+        self.put_chunk(0, 1000)
+        response = self.put_chunk(2000, 3000)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(json.loads(response.content)['received'], 1000)
+        response = self.put_chunk(500, 2000)
+        self.assertEqual(json.loads(response.content)['received'], 2000)
+        response = self.put_chunk(0, 1000)
+        self.assertEqual(json.loads(response.content)['received'], 2000)
+        response = self.client.post(reverse('invoices-upload-finish', args=[self.upload['id']]))
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.put_chunk(2000, len(self.content))
+        response = self.client.post(reverse('invoices-upload-finish', args=[self.upload['id']]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    # API /invoices/uploads - Test invalid uploads and chunks are rejected
+    @override_settings(INVOICE_CHUNKED_UPLOADS={'MAX_SIZE': 4096, 'MAX_CHUNK_SIZE': 2048})
+    def test_chunked_upload_validation(self):
+        response = self.client.post(reverse('invoices-upload-start'), data={'file_name': 'scan.pdf', 'size': 4097},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.put(self.url + '?offset=0', data=b'GIF89a' + self.content,
+                                   content_type='application/octet-stream')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.put(self.url + '?offset=0', data=b'GIF89a', content_type='application/octet-stream')
+        self.assertEqual(json.loads(response.content), {
+            'upload': 'File content type not supported. application/pdf recommended.', 'received': 0})
+        self.assertEqual(self.put_chunk(0, 2049).status_code, status.HTTP_400_BAD_REQUEST)
+        self.put_chunk(0, 2000)
+        response = self.client.put(self.url + '?offset=2000', data=b'x' * 1000,
+                                   content_type='application/octet-stream')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(json.loads(self.client.get(self.url).content)['received'], 2000)
+
+    # API /invoices/uploads - Test uploads of other users are not found
+    def test_chunked_upload_other_user(self):
+        user = User.objects.get(email='jan.doe@plate.com')
+        self.client.credentials(HTTP_AUTHORIZATION=UserSerializer(user).data['token'])
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.put_chunk(0, 1000).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class TestKeysetPagination(APITestCase):
+    base_dir = settings.BASE_DIR
+    fixtures = [base_dir + '/invoice/fixtures/users.json',
+                base_dir + '/invoice/fixtures/companies.json',
+                base_dir + '/invoice/fixtures/invoices.json',
+                base_dir + '/invoice/fixtures/invoice_items.json',
+                ]
+
+    def setUp(self):
+        self.user = User.objects.get(email='admin@plate.com')
+        user_serializer = UserSerializer(self.user).data
+        self.authentication_token = user_serializer['token']
+        self.client.credentials(HTTP_AUTHORIZATION=self.authentication_token)
+        self.url = reverse('companies-list')
+        for index in range(6):
+            Company.objects.create(name='Company %s' % index, address='Street %s' % index, email='c@plate.com')
+        # Give some companies the same creation time so the id has to break the tie
+        created_at = Company.objects.get(name='Company 0').created_at
+        Company.objects.filter(name__in=['Company 1', 'Company 2', 'Company 3']).update(created_at=created_at)
+        companies = Company.objects.order_by('created_at', 'id')
+        self.expected_ids = [str(pk) for pk in companies.values_list('pk', flat=True)]
+
+    def get_page(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(path=url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([query for query in context.captured_queries if 'COUNT(' in query['sql']])
+        return json.loads(response.content)
+
+    # API v1/companies Test walking the pages forwards and backwards returns every row once, in order
+    def test_walk_pages(self):
+        page = self.get_page(self.url + '?page_size=3')
+        self.assertIsNone(page['previous'])
+        pages = [page]
+        while pages[-1]['next']:
+            pages.append(self.get_page(pages[-1]['next']))
+        self.assertEqual([company['id'] for page in pages for company in page['results']], self.expected_ids)
+        self.assertEqual([len(page['results']) for page in pages], [3, 3, 3, 1])
+
+        previous_pages = [pages[-1]]
+        while previous_pages[-1]['previous']:
+            previous_pages.append(self.get_page(previous_pages[-1]['previous']))
+        self.assertEqual([company['id'] for page in reversed(previous_pages) for company in page['results']],
+                         self.expected_ids)
+
+    # API v1/companies Test the page size is capped
+    @override_settings(MAX_PAGE_SIZE=4)
+    def test_page_size_cap(self):
+        page = self.get_page(self.url + '?page_size=100')
+        self.assertEqual([company['id'] for company in page['results']], self.expected_ids[:4])
+
+    # API v1/companies Test an invalid cursor is rejected
+    def test_invalid_cursor(self):
+        response = self.client.get(path=self.url + '?cursor=invalid', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(json.loads(response.content), {'detail': 'Invalid cursor'})
+
+
+class TestInvoiceExportAPI(APITestCase):
+    base_dir = settings.BASE_DIR
+    fixtures = [base_dir + '/invoice/fixtures/users.json',
+                base_dir + '/invoice/fixtures/companies.json',
+                base_dir + '/invoice/fixtures/invoices.json',
+                base_dir + '/invoice/fixtures/invoice_items.json',
+                ]
+
+    def setUp(self):
+        self.user = User.objects.get(email='admin@plate.com')
+        user_serializer = UserSerializer(self.user).data
+        self.authentication_token = user_serializer['token']
+        self.client.credentials(HTTP_AUTHORIZATION=self.authentication_token)
+        self.url = reverse('invoices-export')
+
+    def export(self, query=''):
+        response = self.client.get(path=self.url + query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    # API v1/invoices/export Test NDJSON export matches the invoice serializer
+    def test_export_ndjson(self):
+        lines = self.export().splitlines()
+        exported = {invoice['id']: invoice for invoice in map(json.loads, lines)}
+        self.assertEqual(len(exported), 2)
+        for invoice in Invoice.objects.all():
+            expected_response = json.loads(JsonResponse(InvoiceSerializer(invoice).data).content)
+            self.assertEqual(exported[str(invoice.pk)], expected_response)
+
+    # API v1/invoices/export Test CSV export writes one row per invoice item
+    def test_export_csv(self):
+        rows = list(csv.DictReader(StringIO(self.export('?export_format=csv'))))
+        self.assertEqual(len(rows), InvoiceItem.objects.count())
+        item = InvoiceItem.objects.select_related('invoice__vendor').first()
+        row = next(row for row in rows if row['item_id'] == str(item.pk))
+        self.assertEqual(row['invoice_number'], item.invoice.invoice_number)
+        self.assertEqual(row['vendor_name'], item.invoice.vendor.name)
+        self.assertEqual(float(row['item_amount']), item.amount)
+
+    # API v1/invoices/export Test export filters
+    def test_export_filters(self):
+        invoice = Invoice.objects.get(invoice_number='INV56789')
+        lines = self.export('?digitized=true&vendor=%s' % invoice.vendor_id).splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [str(invoice.pk)])
+        self.assertEqual(self.export('?digitized=false&vendor=%s' % invoice.vendor_id), '')
+        self.assertEqual(self.export('?created_after=2099-01-01T00:00:00Z'), '')
+        self.assertEqual(len(self.export('?created_before=2099-01-01T00:00:00Z').splitlines()), 2)
+
+    # API v1/invoices/export Test invoices are read in chunks with a fixed number of queries per chunk
+    @override_settings(INVOICE_EXPORT_CHUNK_SIZE=1)
+    def test_export_in_chunks(self):
+        with CaptureQueriesContext(connection) as context:
+            lines = self.export().splitlines()
+        self.assertEqual(len(lines), 2)
+        invoice_queries = [query for query in context.captured_queries
+                           if query['sql'].startswith('SELECT') and 'FROM "invoices"' in query['sql']]
+        self.assertEqual(len(invoice_queries), 3)
+
+    # API v1/invoices/export Test invalid filters
+    def test_export_invalid_filters(self):
+        response = self.client.get(path=self.url + '?export_format=xml&vendor=abc')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(json.loads(response.content)), {'export_format', 'vendor'})
+
+    # API v1/invoices/export Test export with unauthorised user
+    def test_export_not_authorised(self):
+        self.user.is_superuser = False
+        self.user.save()
+        response = self.client.get(path=self.url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class TestInvoiceImportAPI(APITestCase):
+    base_dir = settings.BASE_DIR
+    fixtures = [base_dir + '/invoice/fixtures/users.json',
+                base_dir + '/invoice/fixtures/companies.json',
+                base_dir + '/invoice/fixtures/invoices.json',
+                base_dir + '/invoice/fixtures/invoice_items.json',
+                ]
+
+    def setUp(self):
+        self.user = User.objects.get(email='admin@plate.com')
+        user_serializer = UserSerializer(self.user).data
+        self.authentication_token = user_serializer['token']
+        self.client.credentials(HTTP_AUTHORIZATION=self.authentication_token)
+        self.url = reverse('invoices-import')
+
+    @staticmethod
+    def make_invoice(**changes):
+        invoice = {
+            "purchaser": '56aae847-a6ca-4959-b42b-738ed6db4faf',
+            "vendor": '82aea13e-a789-428f-972d-06d07e0a565d',
+            "terms": "some terms",
+            "deu_date": "2099-10-01 00:00:00",
+            "invoice_items": [{"name": "item 1", "description": "foo", "quantity": 2, "price": 5, "amount": 10},
+                              {"name": "item 2", "description": "bar", "quantity": 1, "price": 5, "amount": 5}],
+        }
+        invoice.update(changes)
+        return invoice
+
+    # API v1/invoices/import Test valid invoices are created and invalid ones reported per row
+    def test_import_json(self):
+        rows = [self.make_invoice() for _ in range(10)]
+        rows[2] = self.make_invoice(vendor=str(uuid.uuid4()))
+        rows[5] = self.make_invoice(deu_date='2019-10-01 00:00:00')
+        rows[7] = self.make_invoice(invoice_number='INV12345')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(path=self.url, data=rows, format='json', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        api_response = json.loads(response.content)
+        self.assertEqual((api_response['created'], api_response['failed']), (7, 3))
+        self.assertEqual(api_response['errors'], [
+            {'row': 3, 'errors': {'vendor': ['Invalid Vendor provided.']}},
+            {'row': 6, 'errors': {'due_date': ['Due date cannot be less than current date']}},
+            {'row': 8, 'errors': {'invoice_number': ['Invoice number already exists.']}},
+        ])
+        self.assertEqual(len([query for query in context.captured_queries if 'FROM "companies"' in query['sql']]), 1)
+        invoices = Invoice.objects.exclude(invoice_number__in=['INV12345', 'INV56789'])
+        self.assertEqual(invoices.count(), 7)
+        self.assertEqual(InvoiceItem.objects.filter(invoice__in=invoices).count(), 14)
+        self.assertEqual({(invoice.total_amount, invoice.item_count, invoice.created_by_id) for invoice in invoices},
+                         {(15, 2, self.user.pk)})
+
+    # API v1/invoices/import Test importing the CSV written by the export API
+    def test_import_exported_csv(self):
+        export_response = self.client.get(path=reverse('invoices-export') + '?export_format=csv')
+        lines = b''.join(export_response.streaming_content).decode('utf-8').splitlines()
+        exported_csv = '\n'.join(line.replace('INV', 'NEW') for line in lines).encode('utf-8')
+        exported_csv = exported_csv.replace(b'2020-10-28', b'2099-10-28').replace(b'2020-11-28', b'2099-11-28')
+        data = {'file': SimpleUploadedFile('invoices.csv', exported_csv, content_type='text/csv'),
+                'import_format': 'csv'}
+        response = self.client.post(path=self.url, data=data, format='multipart', HTTP_ACCEPT='application/json')
+        self.assertEqual(json.loads(response.content), {'created': 2, 'failed': 0, 'errors': []})
+        for invoice_number in ['INV12345', 'INV56789']:
+            original = Invoice.objects.get(invoice_number=invoice_number)
+            imported = Invoice.objects.get(invoice_number=invoice_number.replace('INV', 'NEW'))
+            self.assertEqual((imported.vendor_id, imported.total_amount, imported.item_count),
+                             (original.vendor_id, original.total_amount, original.item_count))
+
+    # API v1/invoices/import Test NDJSON file with an unparsable line
+    def test_import_ndjson_file(self):
+        lines = [json.dumps(self.make_invoice(invoice_number='NEW1')), '{broken', json.dumps(self.make_invoice())]
+        data = {'file': SimpleUploadedFile('invoices.ndjson', '\n'.join(lines).encode('utf-8'))}
+        response = self.client.post(path=self.url, data=data, format='multipart', HTTP_ACCEPT='application/json')
+        api_response = json.loads(response.content)
+        self.assertEqual(api_response['created'], 2)
+        self.assertEqual(api_response['errors'], [{'row': 2, 'errors': {'non_field_errors': ['Invalid JSON.']}}])
+        self.assertTrue(Invoice.objects.filter(invoice_number='NEW1').exists())
+
+    # Test only the rows whose invoice number was taken after it was checked are rejected
+    def test_import_invoice_number_taken_during_import(self):
+        taken_invoice = Invoice.objects.get(invoice_number='INV12345')
+
+        class ConcurrentImporter(InvoiceImporter):
+            def check_invoice_numbers(self, rows):
+                valid_rows = super().check_invoice_numbers(rows)
+                taken_invoice.pk, taken_invoice.invoice_number = uuid.uuid4(), 'NEW2'
+                taken_invoice.save(force_insert=True)
+                return valid_rows
+
+        rows = [self.make_invoice(invoice_number='NEW%s' % index) for index in range(1, 5)]
+        result = ConcurrentImporter(created_by=self.user).import_rows(rows)
+        self.assertEqual(result, {'created': 3, 'failed': 1, 'errors': [
+            {'row': 2, 'errors': {'invoice_number': ['Invoice number already exists.']}}]})
+        self.assertEqual(Invoice.objects.filter(invoice_number__in=['NEW1', 'NEW3', 'NEW4'], item_count=2).count(), 3)
+        self.assertEqual(InvoiceItem.objects.filter(invoice__invoice_number__in=['NEW1', 'NEW3', 'NEW4']).count(), 6)
+        self.assertEqual(Invoice.objects.get(invoice_number='NEW2').pk, taken_invoice.pk)
+
+    # Test the import management command
+    def test_import_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson') as import_file:
+            import_file.write('\n'.join(json.dumps(self.make_invoice()) for _ in range(5)))
+            import_file.flush()
+            output = StringIO()
+            call_command('import_invoices', import_file.name, '--chunk-size', '2', '--created-by', self.user.email,
+                         stdout=output, stderr=StringIO())
+        self.assertIn('Created 5 invoices, rejected 0.', output.getvalue())
+        self.assertEqual(Invoice.objects.filter(created_by=self.user).count(), 5)
+
+    # API v1/invoices/import Test import with unauthorised user
+    def test_import_not_authorised(self):
+        self.user.is_superuser = False
+        self.user.save()
+        response = self.client.post(path=self.url, data=[self.make_invoice()], format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class TestInvoiceNumberAllocator(TransactionTestCase):
+
+    @staticmethod
+    def allocate_in_threads(allocators, threads, allocations):
+        results = []
+
+        def allocate(allocator):
+            try:
+                for _ in range(allocations):
+                    results.append(allocator.allocate())
+                results.extend(allocator.allocate_many(5))
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=allocate, args=(allocators[index % len(allocators)],))
+                   for index in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return results
+
+    # Test many threads allocating from one allocator get unique, consecutive numbers
+    def test_concurrent_allocation(self):
+        allocator = BlockInvoiceNumberAllocator(block_size=7)
+        results = self.allocate_in_threads([allocator], threads=16, allocations=25)
+        self.assertEqual(len(results), 16 * 30)
+        self.assertEqual(sorted(results), ['INV%010d' % value for value in range(1, 16 * 30 + 1)])
+
+    # Test allocators of different processes never hand out the same number
+    def test_allocators_use_disjoint_blocks(self):
+        allocators = [BlockInvoiceNumberAllocator(block_size=10) for _ in range(3)]
+        results = [allocators[index % 3].allocate() for index in range(100)]
+        results += allocators[0].allocate_many(50)
+        self.assertEqual(len(set(results)), 150)
+        # 12 blocks of 10 for the single allocations, then the 6 values left in the first allocator's block and a
+        # block of the 44 values still missing
+        self.assertEqual(InvoiceNumberSequence.objects.get(name='invoice_number').next_value, 121 + 44)
+
+    # Test numbers allocated in a transaction that rolls back are not handed out twice
+    def test_allocation_in_rolled_back_transaction(self):
+        allocator = BlockInvoiceNumberAllocator(block_size=10)
+        with self.assertRaises(ValueError), transaction.atomic():
+            self.assertEqual(allocator.allocate_many(2), ['INV0000000001', 'INV0000000002'])
+            raise ValueError
+        self.assertFalse(InvoiceNumberSequence.objects.exists())
+        other_allocator = BlockInvoiceNumberAllocator(block_size=10)
+        results = allocator.allocate_many(3) + other_allocator.allocate_many(3) + allocator.allocate_many(2)
+        self.assertEqual(results[:3], ['INV0000000001', 'INV0000000002', 'INV0000000003'])
+        self.assertEqual(len(set(results)), 8)
+
+    # Test a transaction reserves only the numbers it allocates and keeps no block for later allocations
+    def test_allocation_in_transaction(self):
+        allocator = BlockInvoiceNumberAllocator(block_size=10)
+        with transaction.atomic():
+            self.assertEqual(allocator.allocate(), 'INV0000000001')
+        self.assertEqual(InvoiceNumberSequence.objects.get(name='invoice_number').next_value, 2)
+        self.assertEqual(allocator.allocate_many(2), ['INV0000000002', 'INV0000000003'])
+        self.assertEqual(InvoiceNumberSequence.objects.get(name='invoice_number').next_value, 12)
+
+    # Test the number format is configurable
+    def test_number_format(self):
+        allocator = BlockInvoiceNumberAllocator(sequence='test', number_format='PIQ-{:06d}', start=1000)
+        self.assertEqual(allocator.allocate_many(2), ['PIQ-001000', 'PIQ-001001'])
+
+    # Test the configured allocator is used for invoices created without invoice number
+    @override_settings(INVOICE_NUMBER_ALLOCATOR={'BACKEND': 'invoice.allocators.BlockInvoiceNumberAllocator',
+                                                 'OPTIONS': {'number_format': 'TEST{:03d}'}})
+    def test_configured_allocator(self):
+        self.assertEqual(allocate_invoice_number(), 'TEST001')
+        self.assertIsInstance(get_invoice_number_allocator(), BlockInvoiceNumberAllocator)
+
+
+class TestDigitizationQueue(APITestCase):
+    base_dir = settings.BASE_DIR
+    fixtures = [base_dir + '/invoice/fixtures/users.json',
+                base_dir + '/invoice/fixtures/companies.json',
+                base_dir + '/invoice/fixtures/invoices.json',
+                base_dir + '/invoice/fixtures/invoice_items.json',
+                ]
+
+    def setUp(self):
+        self.invoices = list(Invoice.objects.all())
+        self.jobs = [DigitizationJob.objects.enqueue(invoice) for invoice in self.invoices]
+
+    # Test jobs are only claimed once
+    def test_claim(self):
+        claimed = DigitizationJob.objects.claim(1)
+        self.assertEqual(len(claimed), 1)
+        self.assertEqual((claimed[0].status, claimed[0].attempts), (DigitizationJob.RUNNING, 1))
+        other_claimed = DigitizationJob.objects.claim(5)
+        self.assertEqual(len(other_claimed), 1)
+        self.assertNotEqual(claimed[0].pk, other_claimed[0].pk)
+        self.assertEqual(DigitizationJob.objects.claim(5), [])
+
+    # Test failed jobs are retried until they run out of attempts
+    def test_retry_failed_jobs(self):
+        def fail(invoice):
+            raise ValueError('Extraction failed')
+
+        worker = DigitizationWorker(concurrency=2, processor=fail)
+        self.assertEqual(worker.run(once=True), 2 * worker.max_attempts)
+        self.assertEqual(set(DigitizationJob.objects.values_list('status', 'attempts', 'error')),
+                         {(DigitizationJob.FAILED, worker.max_attempts, 'Extraction failed')})
+
+    # Test jobs of workers that stopped responding are requeued
+    def test_requeue_stale_jobs(self):
+        DigitizationJob.objects.claim(5)
+        DigitizationJob.objects.update(started_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(DigitizationJob.objects.requeue_stale(timeout=60, max_attempts=3), 2)
+        self.assertEqual(set(DigitizationJob.objects.values_list('status', flat=True)), {DigitizationJob.PENDING})
+
+
+class TestInvoiceExtraction(APITestCase):
+    base_dir = settings.BASE_DIR
+    fixtures = [base_dir + '/invoice/fixtures/users.json',
+                base_dir + '/invoice/fixtures/companies.json',
+                base_dir + '/invoice/fixtures/invoices.json',
+                base_dir + '/invoice/fixtures/invoice_items.json',
+                ]
+
+    def setUp(self):
+        self.lines = ['Invoice Number: PDF-0001', 'Purchaser: A star Hotels', 'Vendor: super chicken',
+                      'Terms: Net (30) days', 'Due Date: 01/10/2099',
+                      'Item | Description | Quantity | Price | Amount',
+                      'Chicken | Whole, fresh | 10 | 5.50 | 55.00',
+                      'Eggs | Dozen | 3 | $2.00 | $6.00']
+
+    # Test text of compressed and uncompressed PDFs is extracted page by page
+    def test_extract_pages(self):
+        for compress in (True, False):
+            pages = extract_pages(build_pdf([self.lines[:2], self.lines[2:]], compress=compress))
+            self.assertEqual(pages, ['\n'.join(self.lines[:2]), '\n'.join(self.lines[2:])])
+        for data in (b'not a pdf', b'%PDF-1.4 truncated'):
+            with self.assertRaises(PDFError):
+                extract_pages(data)
+
+    # Test invoice fields and items are found in the text of the PDF
+    def test_extract_invoice(self):
+        draft = extract_invoice(build_pdf([self.lines]))
+        self.assertEqual(draft['page_count'], 1)
+        self.assertEqual(draft['fields'], {'invoice_number': 'PDF-0001', 'purchaser': 'A star Hotels',
+                                           'vendor': 'super chicken', 'terms': 'Net (30) days',
+                                           'deu_date': '2099-10-01'})
+        self.assertEqual(draft['invoice_items'], [
+            {'name': 'Chicken', 'description': 'Whole, fresh', 'quantity': 10, 'price': 5.5, 'amount': 55.0},
+            {'name': 'Eggs', 'description': 'Dozen', 'quantity': 3, 'price': 2.0, 'amount': 6.0}])
+
+    # Test tasks that time out or crash their process fail without breaking the pool
+    def test_extraction_pool_isolation(self):
+        with ExtractionPool(processes=1, timeout=10) as pool:
+            with self.assertRaises(ExtractionTimeout):
+                pool.run(time.sleep, 10, timeout=0.5)
+            with self.assertRaises(ExtractionError):
+                pool.run(os._exit, 1)
+            with self.assertRaisesMessage(ExtractionError, 'Document is not a PDF file.'):
+                pool.run(extract_invoice, b'not a pdf')
+            self.assertEqual(pool.run(extract_invoice, build_pdf([self.lines]))['page_count'], 1)
+
+    # Test a task that cannot be sent to its process stops the process instead of leaking it
+    def test_extraction_pool_unpicklable_task(self):
+        with ExtractionPool(processes=1, timeout=10) as pool:
+            children = set(multiprocessing.active_children())
+            with self.assertRaises(Exception):
+                pool.run(lambda: None)
+            self.assertEqual(set(multiprocessing.active_children()) - children, set())
+            self.assertEqual(pool.idle, [])
+            self.assertEqual(pool.run(extract_invoice, build_pdf([self.lines]))['page_count'], 1)
+
+
+class TestInvoiceExtractionWorker(APITransactionTestCase):
+    base_dir = settings.BASE_DIR
+    fixtures = [base_dir + '/invoice/fixtures/users.json',
+                base_dir + '/invoice/fixtures/companies.json',
+                base_dir + '/invoice/fixtures/invoices.json',
+                base_dir + '/invoice/fixtures/invoice_items.json',
+                ]
+
+    def setUp(self):
+        user = User.objects.get(email='admin@plate.com')
+        self.client.credentials(HTTP_AUTHORIZATION=UserSerializer(user).data['token'])
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media_settings = self.settings(MEDIA_ROOT=media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    # Test the digitization worker fills in the uploaded invoice from its PDF
+    def test_worker_saves_draft(self):
+        lines = ['Invoice Number: PDF-0001', 'Purchaser: A star Hotels', 'Vendor: super chicken',
+                 'Terms: Net (30) days', 'Due Date: 2099-10-01', 'Chicken | Whole | 10 | 5.50 | 55.00',
+                 'Eggs | Dozen | 3 | 2.00 | 6.00']
+        document = SimpleUploadedFile("invoice.pdf", build_pdf([lines]), content_type="application/pdf")
+        response = self.client.post(path=reverse('invoices-upload'), data={'invoice': document}, format='multipart')
+        DigitizationWorker(concurrency=2).run(once=True)
+        invoice = Invoice.objects.get(pk=json.loads(response.content)['id'])
+        self.assertEqual(invoice.digitization_jobs.get().status, DigitizationJob.DONE)
+        self.assertEqual((invoice.invoice_number, invoice.terms), ('PDF-0001', 'Net (30) days'))
+        self.assertEqual((invoice.purchaser.name, invoice.vendor.name), ('A star Hotels', 'Super Chicken'))
+        self.assertEqual(invoice.deu_date.isoformat(), '2099-10-01T00:00:00+00:00')
+        self.assertEqual((invoice.total_amount, invoice.item_count), (61.0, 2))
+        self.assertFalse(invoice.digitized)
+
+    # Test a draft extracted while the invoice got digitized leaves the digitized invoice untouched
+    def test_draft_of_digitized_invoice(self):
+        invoice = Invoice.objects.get(invoice_number='INV12345')
+        user = User.objects.get(email='admin@plate.com')
+        Invoice.objects.filter(pk=invoice.pk).digitize(user)
+        draft = {'fields': {'terms': 'Draft terms'},
+                 'invoice_items': [{'name': 'Eggs', 'description': 'Dozen', 'quantity': 3, 'price': 2.0}]}
+        save_draft(invoice, draft)
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.digitized, invoice.digitized_by), (True, user))
+        self.assertNotEqual(invoice.terms, 'Draft terms')
+        self.assertFalse(invoice.invoice_items.filter(name='Eggs').exists())
+
+    # Test a draft only writes the extracted fields and derives the item amounts
+    def test_draft_saves_extracted_fields(self):
+        invoice = Invoice.objects.get(invoice_number='INV12345')
+        Invoice.objects.filter(pk=invoice.pk).update(invoice_number='INV-CHANGED')
+        draft = {'fields': {'terms': 'Draft terms'},
+                 'invoice_items': [{'name': 'Eggs', 'description': 'Dozen', 'quantity': 3, 'price': 2.015}]}
+        save_draft(invoice, draft)
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.invoice_number, invoice.terms), ('INV-CHANGED', 'Draft terms'))
+        self.assertEqual(invoice.invoice_items.get().amount, 6.05)
+        self.assertEqual((invoice.total_amount, invoice.item_count), (6.05, 1))
+        draft['invoice_items'][0]['amount'] = 6.0
+        with self.assertRaisesMessage(ValueError, 'Invoice item 1: Amount must be quantity times price, 6.05.'):
+            save_draft(invoice, draft)
+
+
+class TestDigitizedStatusEvents(APITransactionTestCase):
+    base_dir = settings.BASE_DIR
+    fixtures = [base_dir + '/invoice/fixtures/users.json',
+                base_dir + '/invoice/fixtures/companies.json',
+                base_dir + '/invoice/fixtures/invoices.json',
+                base_dir + '/invoice/fixtures/invoice_items.json',
+                ]
+
+    def setUp(self):
+        self.user = User.objects.get(email='admin@plate.com')
+        self.authentication_token = UserSerializer(self.user).data['token']
+        self.client.credentials(HTTP_AUTHORIZATION=self.authentication_token)
+        self.invoice = Invoice.objects.get(invoice_number='INV12345')
+        self.url = reverse('invoices-digitized_status', args=(self.invoice.pk,))
+
+    def digitize_later(self, delay, invoice):
+        def digitize():
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=self.authentication_token)
+            try:
+                client.post(reverse('invoices-digitize', args=(invoice.pk,)))
+            finally:
+                connection.close()
+
+        timer = threading.Timer(delay, digitize)
+        timer.start()
+        self.addCleanup(timer.join)
+
+    # API /invoices/pk/digitized-status - Test a long poll returns as soon as the invoice is digitized
+    def test_long_poll_digitized(self):
+        self.digitize_later(0.2, self.invoice)
+        start = time.monotonic()
+        response = self.client.get(self.url, {'wait': 10})
+        self.assertLess(time.monotonic() - start, 5)
+        api_response = json.loads(response.content)
+        self.assertEqual(api_response['digitized'], True)
+        self.assertEqual(api_response['digitized_by']['email'], self.user.email)
+
+    def digitize_in_other_process_later(self, delay, invoice):
+        # Updates the row without the invoices_changed signal, as another process would from this one's view
+        def digitize():
+            try:
+                Invoice.objects.filter(pk=invoice.pk).update(digitized=True, digitized_by=self.user)
+            finally:
+                connection.close()
+
+        timer = threading.Timer(delay, digitize)
+        timer.start()
+        self.addCleanup(timer.join)
+
+    # API /invoices/pk/digitized-status - Test a long poll sees a digitization no notification was sent for
+    @override_settings(INVOICE_STATUS_EVENTS={'POLL_INTERVAL': 0.1})
+    def test_long_poll_digitized_in_other_process(self):
+        self.digitize_in_other_process_later(0.2, self.invoice)
+        start = time.monotonic()
+        response = self.client.get(self.url, {'wait': 10})
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(json.loads(response.content)['digitized'], True)
+
+    # API /invoices/digitized-status/stream - Test the stream sees a digitization no notification was sent for
+    @override_settings(INVOICE_STATUS_EVENTS={'POLL_INTERVAL': 0.1})
+    def test_status_stream_digitized_in_other_process(self):
+        response = self.client.get(reverse('invoices-digitized_status_stream'), {'ids': str(self.invoice.pk)})
+        events = iter(response.streaming_content)
+        self.assertIn('"digitized": false', next(events).decode())
+        self.digitize_in_other_process_later(0.2, self.invoice)
+        event = next(events).decode()
+        self.assertTrue(event.startswith('event: status\n'))
+        self.assertEqual(json.loads(event.split('data: ')[1])['digitized'], True)
+        self.assertTrue(next(events).decode().startswith('event: end\n'))
+
+    # API /invoices/pk/digitized-status - Test a long poll without change returns the status once the wait is over
+    def test_long_poll_timeout(self):
+        start = time.monotonic()
+        response = self.client.get(self.url, {'wait': 0.3})
+        self.assertGreaterEqual(time.monotonic() - start, 0.3)
+        self.assertEqual(json.loads(response.content)['digitized'], False)
+        start = time.monotonic()
+        response = self.client.get(self.url, {'wait': 10, 'digitized': 'true'})
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(json.loads(response.content)['digitized'], False)
+        response = self.client.get(self.url, {'wait': 31})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    # API /invoices/digitized-status/stream - Test status changes are pushed as server-sent events
+    def test_status_stream(self):
+        digitized_invoice = Invoice.objects.exclude(pk=self.invoice.pk).first()
+        Invoice.objects.filter(pk=digitized_invoice.pk).update(digitized=True)
+        response = self.client.get(reverse('invoices-digitized_status_stream'),
+                                   {'ids': '%s,%s' % (self.invoice.pk, digitized_invoice.pk)})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = iter(response.streaming_content)
+        initial_events = [next(events).decode(), next(events).decode()]
+        self.assertTrue(all(event.startswith('event: status\n') for event in initial_events))
+        self.digitize_later(0.2, self.invoice)
+        event = next(events).decode()
+        self.assertTrue(event.startswith('event: status\n'))
+        data = json.loads(event.split('data: ')[1])
+        self.assertEqual((data['id'], data['digitized']), (str(self.invoice.pk), True))
+        self.assertTrue(next(events).decode().startswith('event: end\n'))
+        response = self.client.get(reverse('invoices-digitized_status_stream'), {'ids': 'not an id'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestInvoiceResponseCache(APITestCase):
+    base_dir = settings.BASE_DIR
+    fixtures = [base_dir + '/invoice/fixtures/users.json',
+                base_dir + '/invoice/fixtures/companies.json',
+                base_dir + '/invoice/fixtures/invoices.json',
+                base_dir + '/invoice/fixtures/invoice_items.json',
+                ]
+
+    def setUp(self):
+        self.user = User.objects.get(email='admin@plate.com')
+        user_serializer = UserSerializer(self.user).data
+        self.authentication_token = user_serializer['token']
+        self.client.credentials(HTTP_AUTHORIZATION=self.authentication_token)
+        self.invoice = Invoice.objects.get(invoice_number='INV12345')
+        self.url = reverse('invoices-detail', args=(self.invoice.pk,))
+        # A fresh cache for every test
+        settings_override = self.settings(INVOICE_RESPONSE_CACHE={'BACKEND': 'invoice.caches.LRUResponseCache'})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def retrieve(self):
+        response = self.client.get(path=self.url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return json.loads(response.content)
+
+    # API /invoices/pk - Test a cached response is served with fewer queries
+    def test_retrieve_cached(self):
+        with CaptureQueriesContext(connection) as uncached_queries:
+            first_response = self.retrieve()
+        with CaptureQueriesContext(connection) as cached_queries:
+            second_response = self.retrieve()
+        self.assertEqual(first_response, second_response)
+        self.assertEqual(first_response, json.loads(JsonResponse(InvoiceSerializer(self.invoice).data).content))
+        self.assertLess(len(cached_queries), len(uncached_queries))
+        stats = get_response_cache().get_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['hit_rate'], stats['entries']), (1, 1, 0.5, 1))
+
+    # API /invoices/pk - Test the cached response is invalidated by the write APIs
+    def test_cache_invalidated_on_write(self):
+        self.retrieve()
+        self.client.post(path=reverse('invoices-digitize', args=(self.invoice.pk,)))
+        self.assertEqual(self.retrieve()['digitized'], True)
+
+        item = self.invoice.invoice_items.get(name='Chicken Legs')
+        self.client.patch(path=reverse('invoices-item', args=(self.invoice.pk, item.pk)), data={'quantity': 7},
+                          format='json')
+        items = {item['name']: item for item in self.retrieve()['invoice_items']}
+        self.assertEqual(items['Chicken Legs']['quantity'], 7)
+
+        self.client.patch(path=self.url, data={'terms': 'Net 45'}, format='json')
+        self.assertEqual(self.retrieve()['terms'], 'Net 45')
+        self.assertEqual(get_response_cache().get_stats()['hits'], 0)
+
+    # API /invoices/pk - Test a change made without the API is never served from the cache
+    def test_cache_version_changes(self):
+        self.retrieve()
+        Company.objects.filter(pk=self.invoice.vendor_id).update(name='Renamed vendor', updated_at=timezone.now())
+        self.assertEqual(self.retrieve()['vendor']['name'], 'Renamed vendor')
+        InvoiceItem.objects.filter(invoice=self.invoice, name='Chicken Legs').delete()
+        Invoice.objects.filter(pk=self.invoice.pk).update(item_count=1)
+        self.assertEqual(len(self.retrieve()['invoice_items']), 1)
+        self.assertEqual(get_response_cache().get_stats()['hits'], 0)
+
+    # API /invoices/pk - Test caching through the Django cache framework
+    def test_django_cache_backend(self):
+        with self.settings(INVOICE_RESPONSE_CACHE={'BACKEND': 'invoice.caches.DjangoResponseCache',
+                                                   'OPTIONS': {'key_prefix': 'test-invoice-response'}}):
+            self.addCleanup(get_response_cache().clear)
+            self.assertEqual(self.retrieve(), self.retrieve())
+            stats = get_response_cache().get_stats()
+        self.assertEqual((stats['backend'], stats['hits'], stats['misses']),
+                         ('invoice.caches.DjangoResponseCache', 1, 1))
+
+    # API /invoices/pk - Test the least recently used responses are evicted
+    def test_lru_bounds(self):
+        response_cache = LRUResponseCache(max_entries=2)
+        response_cache.set('a', '1', b'a')
+        response_cache.set('b', '1', b'b')
+        self.assertEqual(response_cache.get('a', '1'), b'a')
+        response_cache.set('c', '1', b'c')
+        self.assertEqual((response_cache.get('a', '1'), response_cache.get('b', '1')), (b'a', None))
+        self.assertIsNone(response_cache.get('a', '2'))
+
+        response_cache = LRUResponseCache(max_bytes=10)
+        response_cache.set('a', '1', b'123456')
+        response_cache.set('b', '1', b'123456')
+        self.assertEqual((response_cache.count(), response_cache.get('b', '1')), (1, b'123456'))
+
+    # API /invoices/cache-stats - Test cache statistics are only available to superusers
+    def test_cache_stats(self):
+        response = self.client.get(path=reverse('invoices-cache_stats'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content)['responses']['backend'], 'invoice.caches.LRUResponseCache')
+        self.user.is_superuser = False
+        self.user.save()
+        response = self.client.get(path=reverse('invoices-cache_stats'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class TestConditionalRequests(APITestCase):
+    base_dir = settings.BASE_DIR
+    fixtures = [base_dir + '/invoice/fixtures/users.json',
+                base_dir + '/invoice/fixtures/companies.json',
+                base_dir + '/invoice/fixtures/invoices.json',
+                base_dir + '/invoice/fixtures/invoice_items.json',
+                ]
+
+    def setUp(self):
+        self.user = User.objects.get(email='admin@plate.com')
+        user_serializer = UserSerializer(self.user).data
+        self.authentication_token = user_serializer['token']
+        self.client.credentials(HTTP_AUTHORIZATION=self.authentication_token)
+        self.invoice = Invoice.objects.get(invoice_number='INV12345')
+        self.url = reverse('invoices-detail', args=(self.invoice.pk,))
+        self.company = Company.objects.get(pk=self.invoice.vendor_id)
+        self.company_url = reverse('companies-detail', args=(self.company.pk,))
+
+    # API /invoices/pk - Test the ETag changes when the stored total of the invoice is repaired
+    def test_invoice_version_after_total_repair(self):
+        Invoice.objects.filter(pk=self.invoice.pk).update(total_amount=1)
+        response = self.client.get(path=self.url)
+        self.assertEqual(json.loads(response.content)['total'], 1)
+        call_command('recompute_invoice_totals', stdout=StringIO())
+        repaired = self.client.get(path=self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(repaired.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(repaired['ETag'], response['ETag'])
+        self.assertEqual(json.loads(repaired.content)['total'], 800)
+
+    # API /invoices/pk - Test If-None-Match with the current ETag gets a 304 without serializing the invoice
+    def test_invoice_not_modified(self):
+        etag = self.client.get(path=self.url)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path=self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response['ETag'], response.content), (304, etag, b''))
+        self.assertEqual(len([query for query in queries if 'invoice_items' in query['sql']]), 1)
+        response = self.client.get(path=self.url, HTTP_IF_NONE_MATCH='"other", W/%s' % etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        item = self.invoice.invoice_items.first()
+        self.client.patch(path=reverse('invoices-item', args=(self.invoice.pk, item.pk)), data={'quantity': 9},
+                          format='json')
+        response = self.client.get(path=self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    # API /invoices/pk - Test an update with a stale If-Match is rejected
+    def test_invoice_if_match(self):
+        etag = self.client.get(path=self.url)['ETag']
+        response = self.client.patch(path=self.url, data={'terms': 'Net 15'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        new_etag = response['ETag']
+        self.assertNotEqual(new_etag, etag)
+        self.assertEqual(self.client.get(path=self.url)['ETag'], new_etag)
+
+        response = self.client.patch(path=self.url, data={'terms': 'Net 30'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(json.loads(response.content),
+                         {'invoice': 'The invoice was modified since it was fetched.'})
+        self.assertEqual(response['ETag'], new_etag)
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.terms, 'Net 15')
+
+    # API /invoices/pk - Test updates are validated before a transaction is opened for the If-Match check
+    def test_invalid_update_outside_transaction(self):
+        etag = self.client.get(path=self.url)['ETag']
+        for headers in ({}, {'HTTP_IF_MATCH': etag}):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.patch(path=self.url, data={'deu_date': '2019-10-01 00:00:00'}, format='json',
+                                             **headers)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertFalse([query for query in queries if 'SAVEPOINT' in query['sql']], headers)
+
+    # API /invoices - Test list pages get a 304 until one of their invoices changes
+    def test_invoice_list_not_modified(self):
+        url = reverse('invoices-list')
+        etag = self.client.get(path=url)['ETag']
+        response = self.client.get(path=url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertNotEqual(self.client.get(path=url, data={'page_size': 1})['ETag'], etag)
+
+        self.company.save()
+        response = self.client.get(path=url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(json.loads(response.content)['results']), 2)
+
+    # API /companies/pk - Test conditional retrieve and update of a company
+    def test_company_conditional_requests(self):
+        etag = self.client.get(path=self.company_url)['ETag']
+        response = self.client.get(path=self.company_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        list_etag = self.client.get(path=reverse('companies-list'))['ETag']
+
+        response = self.client.patch(path=self.company_url, data={'address': 'Pier 9'}, format='json',
+                                     HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.put(path=self.company_url, data={'name': 'Other', 'address': 'Pier 1',
+                                                                'email': 'other@plate.com'},
+                                   format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.company.refresh_from_db()
+        self.assertEqual(self.company.address, 'Pier 9')
+        response = self.client.get(path=reverse('companies-list'), HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(path=reverse('companies-detail', args=(uuid.uuid4(),)))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class TestUserCache(APITransactionTestCase):
+    base_dir = settings.BASE_DIR
+    fixtures = [base_dir + '/invoice/fixtures/users.json',
+                base_dir + '/invoice/fixtures/companies.json',
+                base_dir + '/invoice/fixtures/invoices.json',
+                base_dir + '/invoice/fixtures/invoice_items.json',
+                ]
+
+    def setUp(self):
+        self.user = User.objects.get(email='admin@plate.com')
+        user_serializer = UserSerializer(self.user).data
+        self.authentication_token = user_serializer['token']
+        self.client.credentials(HTTP_AUTHORIZATION=self.authentication_token)
+        # A fresh cache for every test
+        settings_override = self.settings(INVOICE_USER_CACHE={'MAX_ENTRIES': 100, 'TTL': 60})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def count_user_queries(self, path):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path=path)
+        return response, len([query for query in queries if 'FROM "users"' in query['sql']])
+
+    # API /companies - Test the user of a token is only loaded once
+    def test_authentication_cached(self):
+        self.assertEqual(self.count_user_queries(reverse('companies-list'))[1], 1)
+        response, user_queries = self.count_user_queries(reverse('companies-list'))
+        self.assertEqual((response.status_code, user_queries), (status.HTTP_200_OK, 0))
+        stats = json.loads(self.client.get(path=reverse('invoices-cache_stats')).content)['users']
+        self.assertEqual((stats['saved_queries'], stats['misses'], stats['entries']), (2, 1, 1))
+
+    # API /invoices/cache-stats - Test saving or deleting a user drops it from the cache
+    def test_cache_invalidated_on_save(self):
+        self.assertEqual(self.client.get(path=reverse('invoices-cache_stats')).status_code, status.HTTP_200_OK)
+        self.user.is_superuser = False
+        self.user.save()
+        response, user_queries = self.count_user_queries(reverse('invoices-cache_stats'))
+        self.assertEqual((response.status_code, user_queries), (status.HTTP_403_FORBIDDEN, 1))
+        self.user.delete()
+        response = self.client.get(path=reverse('companies-list'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    # Test cached users expire, are bounded and are not read from uncommitted transactions
+    def test_cache_bounds(self):
+        user_cache = UserCache(max_entries=1, ttl=0.2)
+        other_user = User.objects.get(email='jon.doe@plate.com')
+        user_cache.set(self.user)
+        cached_user = user_cache.get(self.user.email)
+        self.assertEqual((cached_user.pk, cached_user.is_superuser), (self.user.pk, True))
+        self.assertIsNot(cached_user, user_cache.get(self.user.email))
+        user_cache.set(other_user)
+        self.assertEqual((user_cache.get(self.user.email), user_cache.get(other_user.email)), (None, other_user))
+        time.sleep(0.3)
+        self.assertIsNone(user_cache.get(other_user.email))
+        with transaction.atomic():
+            user_cache.set(self.user)
+        self.assertEqual(user_cache.get_stats()['entries'], 0)
+
+
+class TestUserTokenAPI(APITestCase):
+    base_dir = settings.BASE_DIR
+    fixtures = [base_dir + '/invoice/fixtures/users.json',
+                base_dir + '/invoice/fixtures/companies.json',
+                base_dir + '/invoice/fixtures/invoices.json',
+                base_dir + '/invoice/fixtures/invoice_items.json',
+                ]
+
+    def setUp(self):
+        self.user = User.objects.get(email='jon.doe@plate.com')
+        self.user.set_password('secret password')
+        self.user.save()
+
+    # API /users - Test listing users neither signs tokens nor returns passwords
+    def test_list_users(self):
+        response = self.client.get(path=reverse('users-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = json.loads(response.content)['results']
+        self.assertEqual(len(results), User.objects.count())
+        self.assertEqual(set(results[0]), {'id', 'name', 'email', 'is_superuser', 'created_at', 'updated_at'})
+        response = self.client.get(path=reverse('users-detail', args=(self.user.pk,)))
+        self.assertNotIn('token', json.loads(response.content))
+
+    # API /users/login - Test logging in issues a token the APIs accept
+    def test_login(self):
+        response = self.client.post(path=reverse('users-login'),
+                                    data={'email': self.user.email, 'password': 'secret password'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        api_response = json.loads(response.content)
+        self.assertEqual(api_response['user']['email'], self.user.email)
+        self.client.credentials(HTTP_AUTHORIZATION=api_response['token'])
+        response = self.client.get(path=reverse('invoices-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.post(path=reverse('users-login'),
+                                    data={'email': self.user.email, 'password': 'wrong password'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(json.loads(response.content),
+                         {'non_field_errors': ['Unable to log in with provided credentials.']})
+
+    # API /users/refresh - Test exchanging a token for a new one
+    def test_refresh(self):
+        token = UserSerializer(self.user).data['token']
+        response = self.client.post(path=reverse('users-refresh'), data={'token': token}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        api_response = json.loads(response.content)
+        self.assertTrue(api_response['token'].startswith('JWT '))
+        self.assertEqual(api_response['user']['id'], str(self.user.pk))
+        response = self.client.post(path=reverse('users-refresh'), data={'token': 'JWT invalid'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    # API /users/pk - Test updating a user never returns a token
+    def test_update_user(self):
+        url = reverse('users-detail', args=(self.user.pk,))
+        response = self.client.patch(path=url, data={}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('token', json.loads(response.content))
+        response = self.client.put(path=url, format='json', data={
+            'email': self.user.email, 'name': 'Jon Smith', 'password': 'new password'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        api_response = json.loads(response.content)
+        self.assertNotIn('token', api_response)
+        self.assertNotIn('password', api_response)
+        self.assertEqual(api_response['name'], 'Jon Smith')
+        self.assertTrue(User.objects.get(pk=self.user.pk).check_password('new password'))
+
+    # API /users - Test signing up stores a password hash and returns a token
+    def test_create_user(self):
+        response = self.client.post(path=reverse('users-list'), format='json', data={
+            'email': 'new.user@plate.com', 'name': 'New User', 'password': 'new password'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        api_response = json.loads(response.content)
+        self.assertNotIn('password', api_response)
+        self.assertTrue(api_response['token'].startswith('JWT '))
+        self.assertTrue(User.objects.get(email='new.user@plate.com').check_password('new password'))
+
+
+class TestInvoicePayloads(APITestCase):
+    base_dir = settings.BASE_DIR
+    fixtures = [base_dir + '/invoice/fixtures/users.json',
+                base_dir + '/invoice/fixtures/companies.json',
+                base_dir + '/invoice/fixtures/invoices.json',
+                base_dir + '/invoice/fixtures/invoice_items.json',
+                ]
+
+    def setUp(self):
+        self.user = User.objects.get(email='admin@plate.com')
+        user_serializer = UserSerializer(self.user).data
+        self.authentication_token = user_serializer['token']
+        self.client.credentials(HTTP_AUTHORIZATION=self.authentication_token)
+        invoice = Invoice.objects.create(invoice_number='INV-PAYLOAD', document='invoices/2020/01/payload.pdf',
+                                         digitized_by=self.user)
+        InvoiceItem.objects.create_items(invoice, [{'name': 'item %s' % index, 'description': 'payload item',
+                                                    'quantity': index, 'price': 1.5, 'amount': index * 1.5}
+                                                   for index in range(1, 30)])
+
+    @staticmethod
+    def render(data):
+        return json.loads(JsonResponse(data, safe=False).content)
+
+    # Test the read path renders every invoice exactly like InvoiceSerializer
+    def test_payloads_match_serializer(self):
+        invoices = Invoice.objects.with_related().order_by('pk')
+        expected = self.render(InvoiceSerializer(invoices, many=True).data)
+        payloads = self.render(serialize_invoices(Invoice.objects.order_by('pk')))
+        self.assertEqual(payloads, expected)
+        self.assertEqual([list(payload) for payload in payloads], [list(invoice) for invoice in expected])
+        self.assertEqual(serialize_invoice(uuid.uuid4()), None)
+
+    # API /invoices - Test list pages are rendered by the read path in page order
+    def test_list_payloads(self):
+        response = self.client.get(path=reverse('invoices-list'))
+        invoices = Invoice.objects.with_related().order_by('created_at', 'id')
+        self.assertEqual(json.loads(response.content)['results'],
+                         self.render(InvoiceSerializer(invoices, many=True).data))
+
+
+class TestInvoiceListFilters(APITestCase):
+    base_dir = settings.BASE_DIR
+    fixtures = [base_dir + '/invoice/fixtures/users.json',
+                base_dir + '/invoice/fixtures/companies.json',
+                base_dir + '/invoice/fixtures/invoices.json',
+                base_dir + '/invoice/fixtures/invoice_items.json',
+                ]
+
+    def setUp(self):
+        self.user = User.objects.get(email='admin@plate.com')
+        user_serializer = UserSerializer(self.user).data
+        self.authentication_token = user_serializer['token']
+        self.client.credentials(HTTP_AUTHORIZATION=self.authentication_token)
+        self.url = reverse('invoices-list')
+        self.invoice = Invoice.objects.get(invoice_number='INV12345')
+        Invoice.objects.filter(pk=self.invoice.pk).update(total_amount=120)
+
+    def list_invoice_numbers(self, params):
+        response = self.client.get(path=self.url, data=params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [invoice['invoice_number'] for invoice in json.loads(response.content)['results']]
+
+    # API /invoices - Test filtering the invoice list
+    def test_filters(self):
+        cases = [
+            ({'vendor': self.invoice.vendor_id, 'digitized': 'false'}, ['INV12345']),
+            ({'vendor': self.invoice.vendor_id, 'digitized': 'true'}, []),
+            ({'purchaser': self.invoice.purchaser_id, 'due_after': '2020-10-01T00:00:00Z',
+              'due_before': '2020-11-01T00:00:00Z'}, ['INV12345']),
+            ({'due_after': '2020-11-01T00:00:00Z'}, ['INV56789']),
+            ({'created_after': '2099-01-01T00:00:00Z'}, []),
+            ({'total_min': 500}, ['INV56789']),
+            ({'total_min': 100, 'total_max': 200}, ['INV12345']),
+            ({'digitized': 'true'}, ['INV56789']),
+        ]
+        for params, invoice_numbers in cases:
+            self.assertEqual(self.list_invoice_numbers(params), invoice_numbers, params)
+        response = self.client.get(path=self.url, data={'vendor': 'abc', 'total_min': 'many', 'ordering': 'terms'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(json.loads(response.content)), {'vendor', 'total_min', 'ordering'})
+
+    # API /invoices - Test ordering the invoice list, paginated by the ordering key
+    def test_ordering(self):
+        self.assertEqual(self.list_invoice_numbers({'ordering': 'total_amount'}), ['INV12345', 'INV56789'])
+        response = self.client.get(path=self.url, data={'ordering': '-total_amount', 'page_size': 1})
+        api_response = json.loads(response.content)
+        self.assertEqual([invoice['invoice_number'] for invoice in api_response['results']], ['INV56789'])
+        response = self.client.get(path=api_response['next'])
+        self.assertEqual([invoice['invoice_number'] for invoice in json.loads(response.content)['results']],
+                         ['INV12345'])
+        # A cursor is only valid for the ordering it was issued for
+        cursor = api_response['next'].split('cursor=')[1].split('&')[0]
+        response = self.client.get(path=self.url, data={'ordering': 'created_at', 'cursor': cursor})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    # API /invoices - Test every supported filter and ordering reads the invoices through an index
+    @unittest.skipUnless(connection.vendor == 'sqlite', 'Query plans are read with SQLite EXPLAIN QUERY PLAN')
+    def test_filters_use_indexes(self):
+        cases = [
+            {'vendor': self.invoice.vendor_id, 'digitized': 'false'},
+            {'vendor': self.invoice.vendor_id},
+            {'purchaser': self.invoice.purchaser_id, 'due_after': '2020-10-01T00:00:00Z',
+             'due_before': '2020-11-01T00:00:00Z'},
+            {'purchaser': self.invoice.purchaser_id},
+            {'digitized': 'true'},
+            {'due_after': '2020-10-01T00:00:00Z', 'due_before': '2020-11-01T00:00:00Z'},
+            {'created_after': '2020-01-01T00:00:00Z', 'created_before': '2021-01-01T00:00:00Z'},
+            {'total_min': 100, 'total_max': 200},
+            {'ordering': '-created_at'},
+            {'ordering': 'total_amount'},
+        ]
+        for params in cases:
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(path=self.url, data=params)
+            list_queries = [query['sql'] for query in queries
+                            if query['sql'].startswith('SELECT') and 'FROM "invoices"' in query['sql']
+                            and 'ORDER BY' in query['sql']]
+            self.assertEqual(len(list_queries), 2, params)
+            for sql in list_queries:
+                with connection.cursor() as cursor:
+                    cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                    plan = [row[-1] for row in cursor.fetchall() if ' invoices ' in row[-1] + ' ']
+                self.assertEqual(len(plan), 1, params)
+                self.assertRegex(plan[0], r'^(SEARCH invoices USING|SCAN invoices USING (COVERING )?INDEX)', params)
+                if 'ordering' not in params:
+                    self.assertTrue(plan[0].startswith('SEARCH'), (params, plan))
+
+
+class TestInvoiceSearch(APITestCase):
+    base_dir = settings.BASE_DIR
+    fixtures = [base_dir + '/invoice/fixtures/users.json',
+                base_dir + '/invoice/fixtures/companies.json',
+                base_dir + '/invoice/fixtures/invoices.json',
+                base_dir + '/invoice/fixtures/invoice_items.json',
+                ]
+
+    def setUp(self):
+        self.user = User.objects.get(email='admin@plate.com')
+        user_serializer = UserSerializer(self.user).data
+        self.authentication_token = user_serializer['token']
+        self.client.credentials(HTTP_AUTHORIZATION=self.authentication_token)
+        self.url = reverse('invoices-search')
+        self.invoice = Invoice.objects.get(invoice_number='INV12345')
+
+    def search(self, params):
+        response = self.client.get(path=self.url, data=params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return json.loads(response.content)
+
+    @staticmethod
+    def get_invoice_numbers(page):
+        return [invoice['invoice_number'] for invoice in page['results']]
+
+    def search_invoice_numbers(self, q):
+        return self.get_invoice_numbers(self.search({'q': q}))
+
+    # API /invoices/search - Test searching by company names, item names and descriptions, terms and prefixes
+    def test_search(self):
+        cases = [
+            ('fishing', ['INV56789']),
+            ('Boneless', ['INV12345']),
+            ('without bones', ['INV12345']),
+            ('super chick', ['INV12345']),
+            ('river', ['INV56789']),
+            ('INV12345', ['INV12345']),
+            ('bones river', []),
+            ('nothing', []),
+        ]
+        for q, invoice_numbers in cases:
+            self.assertEqual(self.search_invoice_numbers(q), invoice_numbers, q)
+        self.assertEqual(sorted(self.search_invoice_numbers('legal terms')), ['INV12345', 'INV56789'])
+        result = self.search({'q': 'boneless'})['results'][0]
+        expected = json.loads(JsonResponse(InvoiceSerializer(self.invoice).data).content)
+        del expected['invoice_items']
+        self.assertEqual(result, expected)
+
+    # API /invoices/search - Test the search index follows invoice, item and company writes
+    def test_index_updates(self):
+        item = self.invoice.invoice_items.get(name='Boneless Chicken')
+        response = self.client.patch(path=reverse('invoices-item', args=[self.invoice.pk, item.pk]),
+                                     data={'name': 'Smoked Salmon'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.search_invoice_numbers('salmon'), ['INV12345'])
+        self.assertEqual(self.search_invoice_numbers('boneless'), [])
+
+        Company.objects.filter(pk=self.invoice.vendor_id).update(name='Poultry Partners')
+        self.assertEqual(self.search_invoice_numbers('poultry'), ['INV12345'])
+        self.assertEqual(self.search_invoice_numbers('super'), [])
+
+        Invoice.objects.filter(pk=self.invoice.pk).update(terms='Net thirty days')
+        self.assertEqual(self.search_invoice_numbers('thirty'), ['INV12345'])
+        self.assertEqual(self.search_invoice_numbers('legal'), ['INV56789'])
+
+        self.invoice.delete()
+        self.assertEqual(self.search_invoice_numbers('salmon'), [])
+        invoice = Invoice.objects.create(invoice_number='INV-SEARCH', terms='Cash on delivery')
+        InvoiceItem.objects.create_items(invoice, [{'name': 'Lobster', 'description': 'Live lobster', 'quantity': 1,
+                                                    'price': 20, 'amount': 20}])
+        self.assertEqual(self.search_invoice_numbers('lobster delivery'), [])
+        self.assertEqual(self.search_invoice_numbers('lobster'), ['INV-SEARCH'])
+        self.assertEqual(self.search_invoice_numbers('delivery'), ['INV-SEARCH'])
+
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.search_invoice_numbers('lobster'), ['INV-SEARCH'])
+        self.assertEqual(self.search_invoice_numbers('poultry'), [])
+
+    # Test the search triggers exist after the migrations and the index matches the invoices
+    def test_search_index_check(self):
+        output = StringIO()
+        call_command('rebuild_search_index', '--check', stdout=output)
+        self.assertIn('The invoice search index is up to date.', output.getvalue())
+
+        # What a table rebuild by a migration leaves behind
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER invoice_search_insert')
+            cursor.execute('DROP TRIGGER invoice_item_search_update')
+        invoice = Invoice.objects.create(invoice_number='INV-UNINDEXED')
+        InvoiceItem.objects.filter(invoice=self.invoice).update(name='Renamed')
+        self.assertEqual(check_search_index(), [
+            'Trigger invoice_search_insert is missing.', 'Trigger invoice_item_search_update is missing.',
+            '1 invoices missing from the index or indexed with an outdated number.',
+            '2 invoice items missing from the index or indexed with an outdated name.'])
+        with self.assertRaisesMessage(CommandError, 'Trigger invoice_search_insert is missing.'):
+            call_command('rebuild_search_index', '--check', stdout=StringIO())
+
+        errors = StringIO()
+        call_command('rebuild_search_index', stdout=StringIO(), stderr=errors)
+        self.assertEqual(errors.getvalue().splitlines(), ['Trigger invoice_search_insert is missing.',
+                                                          'Trigger invoice_item_search_update is missing.'])
+        self.assertEqual(search_invoice_ids(invoice.invoice_number), [invoice.pk])
+
+    # API /invoices/search - Test results are ranked and paginated
+    def test_pagination(self):
+        for index in range(5):
+            invoice = Invoice.objects.create(invoice_number='INV-PAGE-%s' % index)
+            InvoiceItem.objects.create_items(invoice, [{'name': 'Sheets', 'description': 'paper ' * (5 - index),
+                                                        'quantity': 1, 'price': 1, 'amount': 1}])
+        first_page = self.search({'q': 'paper', 'page_size': 2})
+        self.assertEqual(self.get_invoice_numbers(first_page), ['INV-PAGE-0', 'INV-PAGE-1'])
+        self.assertIsNone(first_page['previous'])
+        second_page = self.client.get(first_page['next']).json()
+        self.assertEqual(self.get_invoice_numbers(second_page), ['INV-PAGE-2', 'INV-PAGE-3'])
+        self.assertNotIn('page=', second_page['previous'])
+        last_page = self.client.get(second_page['next']).json()
+        self.assertEqual(self.get_invoice_numbers(last_page), ['INV-PAGE-4'])
+        self.assertIsNone(last_page['next'])
+        self.assertIn('page=2', last_page['previous'])
+        with self.settings(INVOICE_SEARCH={'MAX_RESULTS': 3}):
+            self.assertEqual(len(self.search({'q': 'paper', 'page_size': 2, 'page': 2})['results']), 1)
+        # Too many matches to rank are listed newest first
+        with self.settings(INVOICE_SEARCH={'MAX_CANDIDATES': 4}):
+            self.assertEqual(self.search_invoice_numbers('paper'), ['INV-PAGE-%s' % index for index in (4, 3, 2, 1, 0)])
+        with self.settings(INVOICE_SEARCH={'MAX_CANDIDATES': 5}):
+            self.assertEqual(self.search_invoice_numbers('paper'), ['INV-PAGE-%s' % index for index in range(5)])
+
+    # API /invoices/search - Test invalid searches are rejected
+    def test_invalid_search(self):
+        for params in [{}, {'q': '!!'}, {'q': 'fish', 'page': 0}, {'q': 'fish', 'page_size': 'all'}]:
+            response = self.client.get(path=self.url, data=params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+        self.client.credentials()
+        response = self.client.get(path=self.url, data={'q': 'fish'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    # Test the LIKE search used without the FTS5 index finds the same invoices
+    def test_fallback_search(self):
+        for q in ('fishing', 'without bones', 'super chick', 'legal', 'bones river'):
+            fts_ids = search_invoice_ids(q)
+            self.assertEqual(sorted(fallback_search_invoice_ids(get_tokens(q), 0, 50)), sorted(fts_ids), q)
+
+
+class TestInvoiceReports(APITestCase):
+    base_dir = settings.BASE_DIR
+    fixtures = [base_dir + '/invoice/fixtures/users.json',
+                base_dir + '/invoice/fixtures/companies.json',
+                base_dir + '/invoice/fixtures/invoices.json',
+                base_dir + '/invoice/fixtures/invoice_items.json',
+                ]
+
+    def setUp(self):
+        self.user = User.objects.get(email='admin@plate.com')
+        user_serializer = UserSerializer(self.user).data
+        self.authentication_token = user_serializer['token']
+        self.client.credentials(HTTP_AUTHORIZATION=self.authentication_token)
+        self.invoice = Invoice.objects.get(invoice_number='INV12345')
+        self.star_hotels = {'company': '56aae847-a6ca-4959-b42b-738ed6db4faf', 'company_name': 'A star Hotels'}
+        self.super_chicken = {'company': '82aea13e-a789-428f-972d-06d07e0a565d', 'company_name': 'Super Chicken'}
+        self.fishing_company = {'company': '16437284-3d59-4deb-9094-d78452aa8c7e',
+                                'company_name': 'The Fishing Company'}
+
+    def get_report(self, name, params=None):
+        response = self.client.get(path=reverse('reports-%s' % name), data=params or {})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return json.loads(response.content)['results']
+
+    @staticmethod
+    def get_summaries():
+        return list(InvoiceSummary.objects.order_by('company', 'role', 'date_field', 'day', 'digitized').values_list(
+            'company', 'role', 'date_field', 'day', 'digitized', 'invoice_count', 'total_amount', 'min_amount',
+            'max_amount'))
+
+    def assertSummariesRebuilt(self):
+        self.assertEqual(check_summaries(), [])
+        summaries = self.get_summaries()
+        call_command('rebuild_invoice_summaries', stdout=StringIO())
+        self.assertEqual(summaries, self.get_summaries())
+
+    # API /reports - Test the spend, outstanding and overdue reports of the invoices
+    def test_reports(self):
+        totals = {'invoice_count': 1, 'total': 800, 'min_total': 800, 'max_total': 800}
+        self.assertEqual(self.get_report('spend'), [
+            dict(self.fishing_company, period='2020-08-01', **totals),
+            dict(self.super_chicken, period='2020-08-01', **totals),
+        ])
+        self.assertEqual(self.get_report('spend', {'digitized': 'true', 'period': 'day'}), [
+            dict(self.fishing_company, period='2020-08-28', **totals),
+        ])
+        self.assertEqual(self.get_report('spend', {'role': 'purchaser', 'period': 'year',
+                                                   'company': self.star_hotels['company']}), [
+            dict(self.star_hotels, period='2020-01-01', **totals),
+        ])
+        self.assertEqual(self.get_report('spend', {'created_after': '2020-08-29'}), [])
+        self.assertEqual(len(self.get_report('spend', {'created_after': '2020-08-28', 'created_before': '2020-08-29'})),
+                         2)
+        self.assertEqual(self.get_report('outstanding'), [dict(self.star_hotels, **totals)])
+        self.assertEqual(self.get_report('outstanding', {'role': 'vendor'}), [dict(self.super_chicken, **totals)])
+        self.assertEqual(self.get_report('overdue'), [dict(self.star_hotels, oldest_due_date='2020-10-28', **totals)])
+        self.assertEqual(self.get_report('overdue', {'as_of': '2020-10-28'}), [])
+
+    # Test the summary triggers exist after the migrations and the summaries match the invoices
+    def test_summaries_check(self):
+        output = StringIO()
+        call_command('rebuild_invoice_summaries', '--check', stdout=output)
+        self.assertIn('The invoice summaries are up to date.', output.getvalue())
+
+        # What a table rebuild by a migration leaves behind
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER invoice_summaries_update')
+        Invoice.objects.filter(pk=self.invoice.pk).update(total_amount=900)
+        self.assertEqual(check_summaries(), [
+            'Trigger invoice_summaries_update is missing.',
+            '1 vendor summaries by created_at differ from the invoices.',
+            '1 vendor summaries by deu_date differ from the invoices.',
+            '1 purchaser summaries by created_at differ from the invoices.',
+            '1 purchaser summaries by deu_date differ from the invoices.'])
+        with self.assertRaisesMessage(CommandError, 'Trigger invoice_summaries_update is missing.'):
+            call_command('rebuild_invoice_summaries', '--check', stdout=StringIO())
+
+        errors = StringIO()
+        call_command('rebuild_invoice_summaries', stdout=StringIO(), stderr=errors)
+        self.assertEqual(errors.getvalue().splitlines(), ['Trigger invoice_summaries_update is missing.'])
+        self.assertEqual(self.get_report('outstanding')[0]['total'], 900)
+
+    # Test the summaries follow invoice and item writes, and match the summaries rebuilt from the invoices
+    def test_summaries_follow_writes(self):
+        self.assertSummariesRebuilt()
+        invoice = Invoice.objects.create(invoice_number='INV-REPORT', purchaser_id=self.star_hotels['company'],
+                                         vendor_id=self.super_chicken['company'])
+        InvoiceItem.objects.create_items(invoice, [
+            {'name': 'Wings', 'description': 'Chicken wings', 'quantity': 10, 'price': 5, 'amount': 50},
+            {'name': 'Eggs', 'description': 'Dozen eggs', 'quantity': 10, 'price': 10, 'amount': 100},
+        ])
+        self.assertSummariesRebuilt()
+        outstanding = self.get_report('outstanding')
+        self.assertEqual(outstanding, [dict(self.star_hotels, invoice_count=2, total=950, min_total=150,
+                                            max_total=800)])
+
+        item = self.invoice.invoice_items.get(name='Chicken Legs')
+        response = self.client.patch(path=reverse('invoices-item', args=[self.invoice.pk, item.pk]),
+                                     data={'quantity': 2, 'price': 50}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertSummariesRebuilt()
+        self.assertEqual(self.get_report('outstanding')[0]['max_total'], 300)
+
+        response = self.client.post(path=reverse('invoices-digitize', args=[self.invoice.pk]),
+                                    HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertSummariesRebuilt()
+        self.assertEqual(self.get_report('outstanding'), [dict(self.star_hotels, invoice_count=1, total=150,
+                                                               min_total=150, max_total=150)])
+
+        Invoice.objects.filter(pk=invoice.pk).update(vendor_id=self.fishing_company['company'])
+        self.assertSummariesRebuilt()
+        self.assertEqual(self.get_report('outstanding', {'role': 'vendor'}), [dict(self.fishing_company,
+                                                                                   invoice_count=1, total=150,
+                                                                                   min_total=150, max_total=150)])
+
+        invoice.delete()
+        self.assertSummariesRebuilt()
+        self.assertEqual(self.get_report('outstanding'), [])
+        Company.objects.filter(pk=self.fishing_company['company']).delete()
+        self.assertSummariesRebuilt()
+        self.assertEqual(self.get_report('spend'), [dict(self.super_chicken, period='2020-08-01', invoice_count=1,
+                                                         total=300, min_total=300, max_total=300)])
+
+    # API /reports - Test reports are restricted to superusers and invalid parameters are rejected
+    def test_invalid_reports(self):
+        for name, params in [('spend', {'role': 'buyer'}), ('spend', {'period': 'week'}),
+                             ('spend', {'created_after': 'yesterday'}), ('outstanding', {'company': 'star'}),
+                             ('overdue', {'as_of': '28-10-2020'})]:
+            response = self.client.get(path=reverse('reports-%s' % name), data=params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+        self.user.is_superuser = False
+        self.user.save()
+        response = self.client.get(path=reverse('reports-spend'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.client.credentials()
+        response = self.client.get(path=reverse('reports-spend'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class TestInvoiceItemAmounts(APITestCase):
+    base_dir = settings.BASE_DIR
+    fixtures = [base_dir + '/invoice/fixtures/users.json',
+                base_dir + '/invoice/fixtures/companies.json',
+                base_dir + '/invoice/fixtures/invoices.json',
+                base_dir + '/invoice/fixtures/invoice_items.json',
+                ]
+
+    def setUp(self):
+        self.user = User.objects.get(email='admin@plate.com')
+        user_serializer = UserSerializer(self.user).data
+        self.authentication_token = user_serializer['token']
+        self.client.credentials(HTTP_AUTHORIZATION=self.authentication_token)
+        self.invoice = Invoice.objects.get(invoice_number='INV12345')
+
+    @staticmethod
+    def make_invoice(invoice_items, **changes):
+        invoice = {
+            "purchaser": '56aae847-a6ca-4959-b42b-738ed6db4faf',
+            "vendor": '82aea13e-a789-428f-972d-06d07e0a565d',
+            "deu_date": "2099-10-01 00:00:00",
+            "invoice_items": [dict(item, name='item %s' % index, description='foo')
+                              for index, item in enumerate(invoice_items)],
+        }
+        invoice.update(changes)
+        return invoice
+
+    # API v1/invoices Test amounts are derived from quantity and price and totalled without rounding drift
+    def test_create_derives_amounts(self):
+        data = self.make_invoice([{'quantity': 3, 'price': 0.1}, {'quantity': 1, 'price': 0.2, 'amount': 0.2}] +
+                                 [{'quantity': 1, 'price': 0.1}] * 10, invoice_number='INV-AMOUNTS')
+        response = self.client.post(path=reverse('invoices-list'), data=data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        invoice = Invoice.objects.get(invoice_number='INV-AMOUNTS')
+        self.assertEqual([item['amount'] for item in response.json()['invoice_items']][:3], [0.3, 0.2, 0.1])
+        self.assertEqual((invoice.total_amount, invoice.total, response.json()['total']), (1.5, 1.5, 1.5))
+
+    # API v1/invoices Test amounts that are not quantity times price are rejected
+    def test_create_rejects_wrong_amounts(self):
+        data = self.make_invoice([{'quantity': 3, 'price': 0.1, 'amount': 0.3},
+                                  {'quantity': 3, 'price': 0.105, 'amount': 0.31}, {'quantity': 2, 'price': 1.005}])
+        response = self.client.post(path=reverse('invoices-list'), data=data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {'invoice_items': {'1': {'amount': [
+            'Amount must be quantity times price, 0.32.']}}})
+
+    # API v1/invoices/pk/items/item_pk Test updating the quantity or price of an item updates its amount
+    def test_update_item_derives_amount(self):
+        item = self.invoice.invoice_items.get(name='Chicken Legs')
+        url = reverse('invoices-item', args=[self.invoice.pk, item.pk])
+        for _ in range(3):
+            response = self.client.patch(path=url, data={'price': 30.1}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json()['amount'], 602)
+            response = self.client.patch(path=url, data={'quantity': 3}, format='json')
+            self.assertEqual(response.json()['amount'], 90.3)
+            response = self.client.patch(path=url, data={'quantity': 20}, format='json')
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.total_amount, 802)
+        response = self.client.patch(path=url, data={'amount': 600}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {'amount': ['Amount must be quantity times price, 602.00.']})
+        response = self.client.patch(path=url, data={'name': 'Legs'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    # API v1/invoices/import Test item amounts of imported invoices are checked for the whole batch
+    def test_import_checks_amounts(self):
+        rows = [self.make_invoice([{'quantity': 2, 'price': 2.5}, {'quantity': 1, 'price': 0.7}]) for _ in range(4)]
+        rows[1] = self.make_invoice([{'quantity': 2, 'price': 2.5}, {'quantity': 1, 'price': 0.7, 'amount': 7}])
+        for numpy_min_items in (1, 1000):
+            with override_settings(INVOICE_AMOUNTS={'NUMPY_MIN_ITEMS': numpy_min_items}):
+                response = self.client.post(path=reverse('invoices-import'), data=rows, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            error = {'amount': ['Amount must be quantity times price, 0.70.']}
+            self.assertEqual(response.json()['errors'], [{'row': 2, 'errors': {'invoice_items': {'1': error}}}])
+        invoices = Invoice.objects.exclude(invoice_number__in=['INV12345', 'INV56789'])
+        self.assertEqual({(invoice.total_amount, invoice.item_count) for invoice in invoices}, {(5.7, 2)})
+        self.assertEqual(invoices.count(), 6)
+
+    # Test the NumPy path computes the same amounts and errors as the Decimal path
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_numpy_matches_decimal(self):
+        rng = numpy.random.RandomState(0)
+        items = []
+        for index in range(2000):
+            quantity = int(rng.randint(-5, 1000))
+            price = round(float(rng.uniform(-100, 1000)), int(rng.choice([0, 2, 3, 4, 7])))
+            item = {'quantity': quantity, 'price': price}
+            if index % 3 == 0:
+                item['amount'] = round(quantity * price, int(rng.choice([2, 3, 8])))
+            items.append(item)
+        items += [{'quantity': 1, 'price': float('nan')}, {'quantity': 3, 'price': 1e12, 'amount': 3e12},
+                  {'quantity': 1, 'price': 1.005}, {'quantity': -1, 'price': 1.005},
+                  {'quantity': 1, 'price': 0.1 + 0.2}]
+        decimal_items = [dict(item) for item in items]
+        with override_settings(INVOICE_AMOUNTS={'NUMPY_MIN_ITEMS': len(items) + 1}):
+            decimal_errors = compute_item_amounts(decimal_items)
+        with override_settings(INVOICE_AMOUNTS={'NUMPY_MIN_ITEMS': 1}):
+            numpy_errors = compute_item_amounts(items)
+        self.assertEqual(numpy_errors, decimal_errors)
+        self.assertEqual(items, decimal_items)
+        self.assertTrue(decimal_errors)
+        self.assertEqual([item['amount'] for item in items[-3:]], [1.01, -1.01, 0.3])
+
+
+@override_settings(REQUEST_METRICS={'ENABLED': True, 'SERVER_TIMING': True})
+class TestRequestMetrics(APITestCase):
+    base_dir = settings.BASE_DIR
+    fixtures = [base_dir + '/invoice/fixtures/users.json',
+                base_dir + '/invoice/fixtures/companies.json',
+                base_dir + '/invoice/fixtures/invoices.json',
+                base_dir + '/invoice/fixtures/invoice_items.json',
+                ]
+
+    def setUp(self):
+        self.user = User.objects.get(email='admin@plate.com')
+        user_serializer = UserSerializer(self.user).data
+        self.authentication_token = user_serializer['token']
+        self.client.credentials(HTTP_AUTHORIZATION=self.authentication_token)
+        self.invoice = Invoice.objects.get(invoice_number='INV12345')
+        get_response_cache().clear()
+        registry.reset()
+
+    def get_metrics(self):
+        response = self.client.get(path=reverse('request-metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    # API /internal/metrics - Test requests are recorded per view and timed in the Server-Timing header
+    def test_metrics(self):
+        url = reverse('invoices-detail', args=(self.invoice.pk,))
+        responses = [self.client.get(path=url, HTTP_ACCEPT='application/json') for _ in range(2)]
+        self.assertEqual([response.status_code for response in responses], [status.HTTP_200_OK] * 2)
+        self.assertRegex(responses[0]['Server-Timing'],
+                         r'^db;dur=[0-9.]+;desc="\d+ queries, 0 duplicates", serialize;dur=[0-9.]+, total;dur=[0-9.]+$')
+        # The second response comes from the response cache and is not serialized again
+        self.assertNotIn('serialize', responses[1]['Server-Timing'])
+        self.client.get(path=reverse('companies-list'), HTTP_ACCEPT='application/json')
+
+        metrics = self.get_metrics()
+        self.assertTrue(metrics['enabled'])
+        self.assertEqual(set(metrics['views']), {'GET invoices-detail', 'GET companies-list'})
+        detail = metrics['views']['GET invoices-detail']
+        self.assertEqual(detail['duration_ms']['count'], 2)
+        self.assertEqual(detail['serialize_ms']['count'], 1)
+        self.assertEqual(detail['response_bytes']['sum'], sum(len(response.content) for response in responses))
+        self.assertEqual(sum(detail['queries']['buckets'].values()), 2)
+        self.assertGreater(detail['queries']['sum'], 0)
+        # DRF responses are rendered after the view, the rendering is timed as serialization
+        self.assertEqual(metrics['views']['GET companies-list']['serialize_ms']['count'], 1)
+        self.assertEqual(metrics['views']['GET companies-list']['duplicate_queries']['max'], 0)
+
+    # Test the same statement run for every row is counted as duplicate queries
+    def test_duplicate_queries(self):
+        with collect_metrics() as metrics:
+            totals = [invoice.total for invoice in Invoice.objects.all()]
+        self.assertEqual(totals, [800, 800])
+        self.assertEqual((metrics.query_count, metrics.duplicate_queries), (3, 1))
+        sql, count = metrics.get_most_repeated()
+        self.assertIn('invoice_items', sql)
+        self.assertEqual(count, 2)
+
+    # API /internal/metrics - Test nothing is recorded when disabled and the metrics are restricted to superusers
+    def test_disabled(self):
+        with self.settings(REQUEST_METRICS={'ENABLED': False}):
+            response = self.client.get(path=reverse('invoices-detail', args=(self.invoice.pk,)))
+            self.assertNotIn('Server-Timing', response)
+            self.assertEqual(self.get_metrics(), {'enabled': False, 'views': {}})
+        self.user.is_superuser = False
+        self.user.save()
+        response = self.client.get(path=reverse('request-metrics'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
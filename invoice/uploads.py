@@ -0,0 +1,194 @@
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db import transaction, IntegrityError
+
+from invoice.allocators import allocate_invoice_number
+from invoice.models import Invoice, DigitizationJob, UploadSession
+
+PDF_MAGIC = b'%PDF-'
+# Size of the blocks chunks are copied to disk in
+COPY_BUFFER_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    status_code = 400
+
+
+class UploadConflict(UploadError):
+    status_code = 409
+
+
+class HashingTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """
+    Spools uploaded files to disk and computes their SHA-256 while they are received, the digest is set as the
+    `sha256` attribute of the uploaded file
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.sha256 = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded_file = super().file_complete(file_size)
+        uploaded_file.sha256 = self.sha256.hexdigest()
+        return uploaded_file
+
+
+def use_disk_upload_handlers(request):
+    """
+    Makes the request spool uploaded files to a temporary file on disk as they are received instead of buffering
+    them in memory, hashing them on the way. Must be called before the request body is read
+    :param request: API request
+    :return:
+    """
+    request._request.upload_handlers = [HashingTemporaryFileUploadHandler(request._request)]
+
+
+def get_sha256(document):
+    """
+    Returns the SHA-256 of an uploaded file, computed while it was received when possible
+    :param document: Uploaded file
+    :return: Hex digest
+    """
+    if getattr(document, 'sha256', None):
+        return document.sha256
+    sha256 = hashlib.sha256()
+    for chunk in document.chunks():
+        sha256.update(chunk)
+    document.seek(0)
+    return sha256.hexdigest()
+
+
+def create_invoice_from_document(document, created_by=None):
+    """
+    Stores an uploaded invoice document, creates a non digitized invoice for it and queues its digitization. A
+    document that was uploaded before is neither stored nor queued again, the existing invoice is returned
+    :param document: Uploaded file
+    :param created_by: User who uploaded the document
+    :return: Invoice object
+    """
+    sha256 = get_sha256(document)
+    existing_invoice = Invoice.objects.filter(document_sha256=sha256).first()
+    if existing_invoice is not None:
+        return existing_invoice
+
+    invoice = Invoice(invoice_number=allocate_invoice_number(), created_by=created_by, document_sha256=sha256)
+    invoice.document.save(document.name, document, save=False)
+    try:
+        with transaction.atomic():
+            invoice.save()
+            DigitizationJob.objects.enqueue(invoice)
+    except IntegrityError:
+        invoice.document.delete(save=False)
+        # The same document was uploaded concurrently
+        existing_invoice = Invoice.objects.filter(document_sha256=sha256).first()
+        if existing_invoice is None:
+            raise
+        return existing_invoice
+    except Exception:
+        invoice.document.delete(save=False)
+        raise
+    return invoice
+
+
+def get_chunked_upload_config():
+    config = dict(getattr(settings, 'INVOICE_CHUNKED_UPLOADS', {}))
+    config.setdefault('MAX_SIZE', 25 * 1024 * 1024)
+    config.setdefault('MAX_CHUNK_SIZE', 5 * 1024 * 1024)
+    config.setdefault('EXPIRY', 24 * 60 * 60)
+    config['DIRECTORY'] = config.get('DIRECTORY') or os.path.join(settings.MEDIA_ROOT, 'partial')
+    return config
+
+
+def get_upload_path(session):
+    return os.path.join(get_chunked_upload_config()['DIRECTORY'], '%s.part' % session.pk)
+
+
+def delete_upload_file(session):
+    try:
+        os.remove(get_upload_path(session))
+    except FileNotFoundError:
+        pass
+
+
+def delete_expired_uploads():
+    expired_sessions = UploadSession.objects.expired(get_chunked_upload_config()['EXPIRY'])
+    for session in expired_sessions.only('pk'):
+        delete_upload_file(session)
+    expired_sessions.delete()
+
+
+def start_upload(created_by, file_name, size):
+    """
+    Starts a resumable upload with an empty file of its own on disk
+    :param created_by: User uploading the file
+    :param file_name: Name of the uploaded file
+    :param size: Size of the file in bytes
+    :return: UploadSession object
+    """
+    delete_expired_uploads()
+    session = UploadSession.objects.create(created_by=created_by, file_name=file_name, size=size)
+    os.makedirs(get_chunked_upload_config()['DIRECTORY'], exist_ok=True)
+    open(get_upload_path(session), 'wb').close()
+    return session
+
+
+def write_chunk(session, offset, stream, length):
+    """
+    Copies a chunk from the request body into the upload file at its offset, a block at a time. A chunk may start
+    anywhere up to the received offset, so chunks can be sent again after a failure. The first chunk must start
+    with the PDF header
+    :param session: UploadSession object
+    :param offset: Offset of the chunk in the file
+    :param stream: Readable stream of the chunk
+    :param length: Size of the chunk in bytes
+    :return: Received offset after the chunk
+    """
+    if session.invoice_id is not None:
+        raise UploadConflict('Upload is already finished.')
+    if offset > session.received:
+        raise UploadConflict('Chunk must start at or before the received offset.')
+    if offset + length > session.size:
+        raise UploadError('Chunk exceeds the size of the file.')
+    if offset == 0 and length < len(PDF_MAGIC):
+        raise UploadError('First chunk must contain the file header.')
+
+    remaining = length
+    with open(get_upload_path(session), 'r+b') as upload_file:
+        upload_file.seek(offset)
+        while remaining:
+            data = stream.read(min(remaining, COPY_BUFFER_SIZE))
+            if not data:
+                raise UploadError('Chunk is shorter than its Content-Length.')
+            if remaining == length and offset == 0 and not data.startswith(PDF_MAGIC):
+                raise UploadError('File content type not supported. application/pdf recommended.')
+            upload_file.write(data)
+            remaining -= len(data)
+    return UploadSession.objects.record_chunk(session, offset, offset + length)
+
+
+def finish_upload(session):
+    """
+    Creates the invoice of a completely received upload and removes the upload file. Finishing an upload again
+    returns the same invoice
+    :param session: UploadSession object
+    :return: Invoice object
+    """
+    if session.invoice is not None:
+        return session.invoice
+    if session.received != session.size:
+        raise UploadConflict('Upload is incomplete.')
+    with open(get_upload_path(session), 'rb') as upload_file:
+        invoice = create_invoice_from_document(File(upload_file, name=session.file_name), session.created_by)
+    UploadSession.objects.filter(pk=session.pk).update(invoice=invoice)
+    session.invoice = invoice
+    delete_upload_file(session)
+    return invoice
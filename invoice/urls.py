@@ -1,10 +1,11 @@
 from rest_framework.routers import DefaultRouter
 
-from invoice.views import UserViewSet, InvoiceViewSet, CompanyViewSet
+from invoice.views import UserViewSet, InvoiceViewSet, CompanyViewSet, ReportViewSet
 
 router = DefaultRouter(trailing_slash=False)
 
 router.register('users', UserViewSet, basename='users')
 router.register('invoices', InvoiceViewSet, basename='invoices')
 router.register('companies', CompanyViewSet, basename='companies')
+router.register('reports', ReportViewSet, basename='reports')
 urlpatterns = router.urls
@@ -1,12 +1,35 @@
-from django.http import JsonResponse
+import codecs
+import time
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.generics import get_object_or_404
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
-from invoice.models import User, Invoice, Company
+from invoice.caches import get_response_cache, get_user_cache
+from invoice.conditional import ConditionalMixin, get_etag, if_none_match, not_modified
+from invoice.exports import iter_csv, iter_ndjson
+from invoice.importers import InvoiceImporter, read_csv, read_ndjson
+from invoice.models import User, Invoice, Company, InvoiceItem, UploadSession
+from invoice.notifications import get_status_events_config, status_notifier, iter_status_events
 from invoice.permissions import InvoicePermission
+from invoice.reports import outstanding_report, overdue_report, spend_report
+from invoice.representations import InvoicePayloadSerializer, iter_serialized_chunks, serialize_invoice, \
+    serialize_invoices
+from invoice.search import search_invoice_ids
+from invoice.signals import invoices_changed
 from invoice.serializers import UserSerializer, InvoiceSerializer, CompanySerializer, UploadInvoiceSerializer, \
-    InvoiceDigitizedSerializer, InvoiceCreateSerializer
+    InvoiceDigitizedSerializer, InvoiceCreateSerializer, InvoiceItemSerializer, InvoiceItemsSerializer, \
+    InvoiceExportSerializer, InvoiceImportFileSerializer, UploadSessionSerializer, UploadStartSerializer, \
+    UploadChunkSerializer, InvoiceDigitizeBatchSerializer, DigitizedStatusQuerySerializer, \
+    DigitizedStatusStreamSerializer, UserListSerializer, LoginSerializer, TokenRefreshSerializer, issue_token, \
+    InvoiceListQuerySerializer, InvoiceSearchSerializer, SpendReportSerializer, OutstandingReportSerializer, \
+    OverdueReportSerializer, UserUpdateSerializer
+from invoice.uploads import use_disk_upload_handlers, start_upload, write_chunk, finish_upload, UploadError
 
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -16,47 +39,323 @@ class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
+    def get_serializer_class(self):
+        # Tokens are only issued on sign up, login and refresh, listing users never signs any
+        if self.action in ('list', 'retrieve'):
+            return UserListSerializer
+        if self.action in ('update', 'partial_update'):
+            return UserUpdateSerializer
+        return super().get_serializer_class()
+
+    @action(methods=['post'], detail=False, url_name='login', url_path='login', authentication_classes=[])
+    def login(self, request):
+        """
+        Login API
+        :param request: email and password
+        :return: Token and user details
+        """
+        login_serializer = LoginSerializer(data=request.data, context={'request': request})
+        login_serializer.is_valid(raise_exception=True)
+        user = login_serializer.validated_data['user']
+        return JsonResponse({'token': issue_token(user), 'user': UserListSerializer(user).data})
 
-class InvoiceViewSet(viewsets.ModelViewSet):
+    @action(methods=['post'], detail=False, url_name='refresh', url_path='refresh', authentication_classes=[])
+    def refresh(self, request):
+        """
+        Token refresh API, exchanges a token for a new one with a later expiry, for up to JWT_REFRESH_EXPIRATION_DELTA
+        after the login
+        :param request: token
+        :return: Token and user details
+        """
+        refresh_serializer = TokenRefreshSerializer(data=request.data)
+        refresh_serializer.is_valid(raise_exception=True)
+        return JsonResponse({'token': refresh_serializer.validated_data['token'],
+                             'user': UserListSerializer(refresh_serializer.validated_data['user']).data})
+
+
+class InvoiceViewSet(ConditionalMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows invoices to be viewed or edited.
     """
-    queryset = Invoice.objects.all()
+    queryset = Invoice.objects.with_related()
     serializer_class = InvoiceSerializer
     permission_classes = [IsAuthenticated, ]
+    precondition_failed_key = 'invoice'
+
+    def get_queryset(self):
+        if self.action == 'digitized_status':
+            return Invoice.objects.with_digitizer()
+        if self.action == 'digitize':
+            return Invoice.objects.only('id', 'invoice_number')
+        if self.action == 'update_item':
+            return Invoice.objects.all()
+        if self.action == 'list':
+            # The page only needs the keys, InvoicePayloadSerializer reads the invoices it renders
+            return Invoice.objects.only('id', 'created_at')
+        return super().get_queryset()
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return InvoicePayloadSerializer
+        return super().get_serializer_class()
+
+    def filter_queryset(self, queryset):
+        """
+        Applies the filters and the ordering of the list query parameters, the ordering is also the keyset the list
+        is paginated by
+        :param queryset: Invoice queryset
+        :return: Filtered invoice queryset
+        """
+        if self.action != 'list':
+            return queryset
+        query_serializer = InvoiceListQuerySerializer(data=self.request.query_params)
+        query_serializer.is_valid(raise_exception=True)
+        filters = dict(query_serializer.validated_data)
+        ordering = filters.pop('ordering')
+        self.keyset_ordering = (ordering, '-id' if ordering.startswith('-') else 'id')
+        return queryset.apply_filters(**filters)
+
+    def get_version_queryset(self):
+        return Invoice.objects.versions()
+
+    def get_row_version(self, row):
+        return Invoice.objects.get_version(row)
+
+    def get_serialized_invoice(self, invoice):
+        """
+        Serializes a freshly written invoice, reloading it with all its relations in a fixed number of queries
+        :param invoice: Invoice object
+        :return: Serialized invoice data
+        """
+        return serialize_invoice(invoice.pk)
 
     @action(methods=['post'], detail=False, url_name='upload', url_path='upload')
     def upload(self, request):
         """
-        Upload invoice API takes pdf file as an input and returns non digitized invoice
+        Upload invoice API takes pdf file as an input, stores it and returns the non digitized invoice created for
+        it. The digitization is queued and done by the digitization workers
         :param request:
         :return: Invoice Object
         """
+        use_disk_upload_handlers(request)
         upload_serializer = UploadInvoiceSerializer(data=request.data)
         upload_serializer.is_valid(raise_exception=True)
-        return JsonResponse(self.serializer_class(self.queryset.first()).data)
+        invoice = upload_serializer.save(created_by=request.user)
+        return JsonResponse(self.get_serialized_invoice(invoice))
+
+    def get_upload_session(self, upload_id):
+        sessions = UploadSession.objects.select_related('invoice').filter(created_by=self.request.user)
+        return get_object_or_404(sessions, pk=upload_id)
+
+    @action(methods=['post'], detail=False, url_name='upload-start', url_path='uploads')
+    def upload_start(self, request):
+        """
+        Starts a resumable upload, for invoice pdfs too large to be sent in a single request. The file is then sent
+        in chunks and the upload finished once every byte was received
+        :param request: file_name and size of the file in bytes
+        :return: Upload session
+        """
+        start_serializer = UploadStartSerializer(data=request.data)
+        start_serializer.is_valid(raise_exception=True)
+        session = start_upload(request.user, **start_serializer.validated_data)
+        return JsonResponse(UploadSessionSerializer(session).data, status=status.HTTP_201_CREATED)
+
+    @action(methods=['put'], detail=False, url_name='upload-chunk', url_path=r'uploads/(?P<upload_id>[^/.]+)')
+    def upload_chunk(self, request, upload_id):
+        """
+        Writes a chunk of a resumable upload. The request body is the raw chunk and the offset query parameter its
+        position in the file. After a failure the upload resumes from the received offset of the upload
+        :param request: offset query parameter and chunk body
+        :param upload_id: Id of the upload session
+        :return: Upload session
+        """
+        session = self.get_upload_session(upload_id)
+        chunk_serializer = UploadChunkSerializer(data={'offset': request.query_params.get('offset'),
+                                                       'length': request.META.get('CONTENT_LENGTH') or None})
+        chunk_serializer.is_valid(raise_exception=True)
+        try:
+            write_chunk(session, stream=request._request, **chunk_serializer.validated_data)
+        except UploadError as error:
+            return JsonResponse({'upload': str(error), 'received': session.received}, status=error.status_code)
+        return JsonResponse(UploadSessionSerializer(session).data)
+
+    @upload_chunk.mapping.get
+    def upload_status(self, request, upload_id):
+        """
+        Resumable upload status API
+        :param request:
+        :param upload_id: Id of the upload session
+        :return: Upload session with the offset to resume from
+        """
+        return JsonResponse(UploadSessionSerializer(self.get_upload_session(upload_id)).data)
+
+    @action(methods=['post'], detail=False, url_name='upload-finish',
+            url_path=r'uploads/(?P<upload_id>[^/.]+)/finish')
+    def upload_finish(self, request, upload_id):
+        """
+        Finishes a resumable upload like the upload API: the invoice pdf is stored and a non digitized invoice is
+        created for it
+        :param request:
+        :param upload_id: Id of the upload session
+        :return: Invoice Object
+        """
+        session = self.get_upload_session(upload_id)
+        try:
+            invoice = finish_upload(session)
+        except UploadError as error:
+            return JsonResponse({'upload': str(error), 'received': session.received}, status=error.status_code)
+        return JsonResponse(self.get_serialized_invoice(invoice))
+
+    @action(methods=['get'], detail=False, url_name='search', url_path='search')
+    def search(self, request):
+        """
+        Full text search API over the invoice numbers, terms, company names and item names and descriptions, best
+        matches first. Every word has to match, the last one also as a prefix. The invoices are rendered without
+        their items, the retrieve API has them
+        :param request: q, page and page_size query parameters
+        :return: Next and previous page links and the matching invoices
+        """
+        search_serializer = InvoiceSearchSerializer(data=request.query_params)
+        search_serializer.is_valid(raise_exception=True)
+        page = search_serializer.validated_data['page']
+        page_size = search_serializer.validated_data.get('page_size') or self.paginator.page_size
+        offset = (page - 1) * page_size
+        # One result more than the page tells whether another page follows
+        invoice_ids = search_invoice_ids(search_serializer.validated_data['q'], offset, page_size + 1)
+        payloads = {payload['id']: payload for payload in serialize_invoices(
+            Invoice.objects.filter(pk__in=invoice_ids[:page_size]), with_items=False)}
+        url = request.build_absolute_uri()
+        next_url = previous_url = None
+        if len(invoice_ids) > page_size:
+            next_url = replace_query_param(url, 'page', page + 1)
+        if page > 2:
+            previous_url = replace_query_param(url, 'page', page - 1)
+        elif page == 2:
+            previous_url = remove_query_param(url, 'page')
+        return JsonResponse({
+            'next': next_url,
+            'previous': previous_url,
+            'results': [payloads[str(invoice_id)] for invoice_id in invoice_ids[:page_size]
+                        if str(invoice_id) in payloads],
+        })
+
+    @action(methods=['get'], detail=False, url_name='export', url_path='export')
+    def export(self, request):
+        """
+        Export API streams every invoice matching the filters as NDJSON or CSV. Invoices are read and rendered in
+        chunks so memory use does not depend on the number of invoices
+        :param request: export_format, created_after, created_before, vendor and digitized query parameters
+        :return: Streaming response
+        """
+        export_serializer = InvoiceExportSerializer(data=request.query_params)
+        export_serializer.is_valid(raise_exception=True)
+        filters = dict(export_serializer.validated_data)
+        export_format = filters.pop('export_format')
+        chunk_size = getattr(settings, 'INVOICE_EXPORT_CHUNK_SIZE', 500)
+        invoice_chunks = iter_serialized_chunks(Invoice.objects.apply_filters(**filters), chunk_size)
+        if export_format == 'csv':
+            response = StreamingHttpResponse(iter_csv(invoice_chunks), content_type='text/csv')
+        else:
+            response = StreamingHttpResponse(iter_ndjson(invoice_chunks), content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="invoices.%s"' % export_format
+        return response
+
+    @action(methods=['post'], detail=False, url_name='import', url_path='import')
+    def bulk_import(self, request):
+        """
+        Bulk import API takes a JSON list of invoices, or an NDJSON or CSV file, and creates the valid ones
+        :param request: list of invoices, or file and import_format
+        :return: Number of created invoices and the errors of the rejected rows
+        """
+        if isinstance(request.data, list):
+            rows = request.data
+        else:
+            import_serializer = InvoiceImportFileSerializer(data=request.data)
+            import_serializer.is_valid(raise_exception=True)
+            lines = codecs.iterdecode(import_serializer.validated_data['file'], 'utf-8', errors='replace')
+            if import_serializer.validated_data['import_format'] == 'csv':
+                rows = read_csv(lines)
+            else:
+                rows = read_ndjson(lines)
+        return JsonResponse(InvoiceImporter(created_by=request.user).import_rows(rows))
 
     @action(methods=['get'], detail=True, url_name='digitized_status', url_path='digitized-status')
     def digitized_status(self, request, *_, **__):
         """
-        Invoice digitization status API
-        :param request:
+        Invoice digitization status API. With the wait query parameter the response is held for up to that many
+        seconds until the status differs from the digitized query parameter, or from the status at the time of the
+        request when it is not provided
+        :param request: wait and digitized query parameters
         :return: Digitization status and other details
         """
+        query_serializer = DigitizedStatusQuerySerializer(data=request.query_params)
+        query_serializer.is_valid(raise_exception=True)
+        # Read before the invoice so no change notified in between is missed
+        sequence = status_notifier.sequence
         invoice = self.get_object()
+        known_status = query_serializer.validated_data.get('digitized')
+        if known_status is None:
+            known_status = invoice.digitized
+        deadline = time.monotonic() + query_serializer.validated_data['wait']
+        poll_interval = get_status_events_config()['POLL_INTERVAL']
+        while invoice.digitized == known_status and time.monotonic() < deadline:
+            sequence, _ = status_notifier.wait([invoice.pk], sequence, min(poll_interval, deadline - time.monotonic()))
+            # Read after every wait, changes made by other processes are not notified here
+            invoice = get_object_or_404(self.get_queryset(), pk=invoice.pk)
         return JsonResponse(InvoiceDigitizedSerializer(invoice).data)
 
+    @action(methods=['get'], detail=False, url_name='digitized_status_stream', url_path='digitized-status/stream')
+    def digitized_status_stream(self, request):
+        """
+        Streams the digitization status of a set of invoices as server-sent events, pushed as soon as it changes
+        :param request: ids query parameter, comma separated invoice ids
+        :return: Streaming response
+        """
+        query_serializer = DigitizedStatusStreamSerializer(data=request.query_params)
+        query_serializer.is_valid(raise_exception=True)
+        response = StreamingHttpResponse(iter_status_events(query_serializer.validated_data['ids']),
+                                         content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
     def retrieve(self, request, *_, **__):
         """
-        Retrieve the details for the invoice if the invoice is digitized or if the user is a superuser
+        Retrieve the details for the invoice if the invoice is digitized or if the user is a superuser. The rendered
+        response is cached for the current version of the invoice, so repeated reads cost a single small query, and
+        a request whose If-None-Match holds the current ETag gets a 304
         :param request:
         :return: Invoice object
         """
-        invoice = self.get_object()
-        if request.user.is_superuser or invoice.digitized:
-            return JsonResponse(self.serializer_class(invoice).data)
-        else:
+        row = self.get_version_row()
+        if not (request.user.is_superuser or row['digitized']):
             return JsonResponse({'invoice': "The invoice is not digitized yet!"}, status=status.HTTP_400_BAD_REQUEST)
+        version = self.get_row_version(row)
+        etag = get_etag(version)
+        if if_none_match(request, etag):
+            return not_modified(etag)
+        response_cache = get_response_cache()
+        content = response_cache.get(row['pk'], version)
+        if content is None:
+            # The invoice is read after its version, a change in between is at worst cached under the older version
+            # and never served
+            payload = serialize_invoice(row['pk'])
+            if payload is None:
+                raise Http404
+            content = JsonResponse(payload).content
+            response_cache.set(row['pk'], version, content)
+        response = HttpResponse(content, content_type='application/json')
+        response['ETag'] = etag
+        return response
+
+    @action(methods=['get'], detail=False, url_name='cache_stats', url_path='cache-stats')
+    def cache_stats(self, request):
+        """
+        Statistics of the response and user caches of the current process
+        :param request:
+        :return: Hits, misses, hit rate and number of entries of each cache
+        """
+        return JsonResponse({'responses': get_response_cache().get_stats(), 'users': get_user_cache().get_stats()})
 
     @action(methods=['post'], detail=True, url_name='digitize', url_path='digitize')
     def digitize(self, request, *_, **__):
@@ -66,14 +365,30 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         :return: Invoice details if invoice is successfully digitized
         """
         invoice = self.get_object()
-        if not invoice.digitized:
+        if Invoice.objects.filter(pk=invoice.pk).digitize(request.user):
             invoice.digitized = True
             invoice.digitized_by = request.user
-            invoice.save()
-            invoice.refresh_from_db()
+            invoices_changed.send(sender=Invoice, invoice_ids=[invoice.pk])
             return JsonResponse(InvoiceDigitizedSerializer(invoice).data)
         return JsonResponse({'invoice': "The invoice is already digitized!"}, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(methods=['post'], detail=False, url_name='digitize-batch', url_path='digitize')
+    def digitize_batch(self, request):
+        """
+        Digitize invoices API, digitizes a batch of invoices at once
+        :param request: ids of the invoices
+        :return: Result for every invoice id, digitized, already_digitized or not_found
+        """
+        digitize_serializer = InvoiceDigitizeBatchSerializer(data=request.data)
+        digitize_serializer.is_valid(raise_exception=True)
+        results = Invoice.objects.digitize_many(digitize_serializer.validated_data['ids'], request.user)
+        invoices_changed.send(sender=Invoice, invoice_ids=[invoice_id for invoice_id, result in results
+                                                           if result == 'digitized'])
+        return JsonResponse({
+            'digitized': sum(1 for _, result in results if result == 'digitized'),
+            'results': [{'id': invoice_id, 'result': result} for invoice_id, result in results]
+        })
+
     def create(self, request, *args, **kwargs):
         """
         API to create an invoice with superuser
@@ -85,35 +400,54 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         invoice_serializer = InvoiceCreateSerializer(data=request.data)
         invoice_serializer.is_valid(raise_exception=True)
         invoice = invoice_serializer.save(created_by=request.user)
-        return JsonResponse(self.serializer_class(invoice).data, status=status.HTTP_201_CREATED)
+        return JsonResponse(self.get_serialized_invoice(invoice), status=status.HTTP_201_CREATED)
 
     def update(self, request, *args, **kwargs):
         """
-        Update invoice API
+        Update invoice API, with an If-Match header the invoice is only updated if it is unchanged since it was fetched
         :param request: data to update the invoice
         :param args:
         :param kwargs:
         :return:
         """
-        invoice = self.get_object()
-        invoice_serializer = InvoiceCreateSerializer(invoice, data=request.data)
-        invoice_serializer.is_valid(raise_exception=True)
-        invoice = invoice_serializer.save()
-        return JsonResponse(self.serializer_class(invoice).data)
+        return self.conditional_update(request, self.get_update_serializer(request), self.save_invoice)
 
     def partial_update(self, request, *args, **kwargs):
         """
-        Partially update invoice
+        Partially update invoice, with an If-Match header the invoice is only updated if it is unchanged since it was
+        fetched
         :param request: partial data
         :param args:
         :param kwargs:
         :return:
         """
-        invoice = self.get_object()
-        invoice_serializer = InvoiceCreateSerializer(invoice, data=request.data, partial=True)
+        return self.conditional_update(request, self.get_update_serializer(request, partial=True), self.save_invoice)
+
+    def get_update_serializer(self, request, partial=False):
+        invoice_serializer = InvoiceCreateSerializer(self.get_object(), data=request.data, partial=partial)
         invoice_serializer.is_valid(raise_exception=True)
+        return invoice_serializer
+
+    def save_invoice(self, invoice_serializer):
         invoice = invoice_serializer.save()
-        return JsonResponse(self.serializer_class(invoice).data)
+        invoices_changed.send(sender=Invoice, invoice_ids=[invoice.pk])
+        return JsonResponse(self.get_serialized_invoice(invoice))
+
+    @action(methods=['patch'], detail=True, url_name='item', url_path=r'items/(?P<item_id>[^/.]+)')
+    def update_item(self, request, item_id, *_, **__):
+        """
+        Partially update a single invoice item
+        :param request: partial item data
+        :param item_id: Id of the invoice item
+        :return: Updated invoice item
+        """
+        invoice = self.get_object()
+        item = get_object_or_404(InvoiceItem.objects.filter(invoice=invoice), pk=item_id)
+        item_serializer = InvoiceItemsSerializer(item, data=request.data, partial=True)
+        item_serializer.is_valid(raise_exception=True)
+        item = InvoiceItem.objects.update_item(item, item_serializer.validated_data)
+        invoices_changed.send(sender=Invoice, invoice_ids=[invoice.pk])
+        return JsonResponse(InvoiceItemSerializer(item).data)
 
     def get_permissions(self):
         permissions = super().get_permissions()
@@ -121,9 +455,72 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         return permissions
 
 
-class CompanyViewSet(viewsets.ModelViewSet):
+class CompanyViewSet(ConditionalMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows invoices to be viewed or edited.
     """
     queryset = Company.objects.all()
     serializer_class = CompanySerializer
+    precondition_failed_key = 'company'
+
+    def get_version_queryset(self):
+        return Company.objects.values('pk', 'updated_at')
+
+    def retrieve(self, request, *args, **kwargs):
+        etag = self.get_object_etag()
+        if if_none_match(request, etag):
+            return not_modified(etag)
+        response = super().retrieve(request, *args, **kwargs)
+        response['ETag'] = etag
+        return response
+
+    def update(self, request, *args, **kwargs):
+        company_serializer = self.get_serializer(self.get_object(), data=request.data,
+                                                 partial=kwargs.pop('partial', False))
+        company_serializer.is_valid(raise_exception=True)
+        return self.conditional_update(request, company_serializer, self.save_company)
+
+    def save_company(self, company_serializer):
+        self.perform_update(company_serializer)
+        return Response(company_serializer.data)
+
+
+class ReportViewSet(viewsets.ViewSet):
+    """
+    API endpoint with the spend reports, read from the daily invoice summaries.
+    """
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    @action(methods=['get'], detail=False, url_name='spend', url_path='spend')
+    def spend(self, request):
+        """
+        Spend report API, invoice totals of each vendor or purchaser per day, month or year of creation
+        :param request: role, period, company, digitized, created_after and created_before query parameters
+        :return: Invoice count and sum, smallest and largest total per company and period
+        """
+        report_serializer = SpendReportSerializer(data=request.query_params)
+        report_serializer.is_valid(raise_exception=True)
+        return JsonResponse({'results': spend_report(**report_serializer.validated_data)})
+
+    @action(methods=['get'], detail=False, url_name='outstanding', url_path='outstanding')
+    def outstanding(self, request):
+        """
+        Outstanding report API, totals of the invoices not digitized yet of each purchaser or vendor
+        :param request: role and company query parameters
+        :return: Invoice count and sum, smallest and largest total per company
+        """
+        report_serializer = OutstandingReportSerializer(data=request.query_params)
+        report_serializer.is_valid(raise_exception=True)
+        return JsonResponse({'results': outstanding_report(**report_serializer.validated_data)})
+
+    @action(methods=['get'], detail=False, url_name='overdue', url_path='overdue')
+    def overdue(self, request):
+        """
+        Overdue report API, invoices not digitized yet and due before as_of (today by default) of each purchaser or
+        vendor
+        :param request: role, company and as_of query parameters
+        :return: Invoice count and sum, smallest and largest total and oldest due date per company
+        """
+        report_serializer = OverdueReportSerializer(data=request.query_params)
+        report_serializer.is_valid(raise_exception=True)
+        return JsonResponse({'results': overdue_report(**report_serializer.validated_data)})
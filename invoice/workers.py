@@ -0,0 +1,155 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytz
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.module_loading import import_string
+
+from invoice.amounts import compute_item_amounts
+from invoice.extraction import get_extraction_pool, close_extraction_pool, extract_invoice
+from invoice.models import Company, DigitizationJob, Invoice, InvoiceItem
+from invoice.signals import invoices_changed
+
+logger = logging.getLogger(__name__)
+
+
+def check_document(invoice):
+    """
+    Digitization processor making sure the stored document is a readable PDF
+    :param invoice: Invoice object
+    :return:
+    """
+    with invoice.document.open('rb') as document:
+        if document.read(5) != b'%PDF-':
+            raise ValueError('Document is not a PDF file.')
+
+
+def extract_document(invoice):
+    """
+    Digitization processor filling in a draft of the invoice from the text of its PDF document. The PDF is parsed in
+    the extraction process pool, the draft is saved by the calling thread
+    :param invoice: Invoice object
+    :return:
+    """
+    with invoice.document.open('rb') as document:
+        data = document.read()
+    save_draft(invoice, get_extraction_pool().run(extract_invoice, data))
+
+
+@transaction.atomic
+def save_draft(invoice, draft):
+    """
+    Saves the extracted details on a non digitized invoice. The invoice is read again under a row lock and left
+    alone when it was digitized in the meantime, only the extracted fields are written. Companies are matched by
+    name, the extracted invoice number is only used when no other invoice has it and item amounts must be quantity
+    times price
+    :param invoice: Invoice object
+    :param draft: Draft returned by extract_invoice
+    :return:
+    """
+    fields, invoice_items = draft['fields'], draft['invoice_items']
+    if not fields and not invoice_items:
+        raise ValueError('No invoice details found in document.')
+    invoice = Invoice.objects.select_for_update().get(pk=invoice.pk)
+    if invoice.digitized:
+        logger.info('Invoice %s was digitized before its draft was saved', invoice.pk)
+        return
+    errors = compute_item_amounts(invoice_items)
+    if errors:
+        index = min(errors)
+        raise ValueError('Invoice item %s: %s' % (index + 1, errors[index]))
+
+    update_fields = []
+    for field in ('purchaser', 'vendor'):
+        company = Company.objects.filter(name__iexact=fields.get(field)).first() if field in fields else None
+        if company is not None:
+            setattr(invoice, field, company)
+            update_fields.append(field)
+    invoice_number = fields.get('invoice_number')
+    if invoice_number and not Invoice.objects.filter(invoice_number=invoice_number).exclude(pk=invoice.pk).exists():
+        invoice.invoice_number = invoice_number
+        update_fields.append('invoice_number')
+    if 'terms' in fields:
+        invoice.terms = fields['terms']
+        update_fields.append('terms')
+    if 'deu_date' in fields:
+        invoice.deu_date = datetime.combine(parse_date(fields['deu_date']), datetime.min.time(), tzinfo=pytz.UTC)
+        update_fields.append('deu_date')
+    if update_fields:
+        invoice.save(update_fields=update_fields + ['updated_at'])
+    if invoice_items:
+        InvoiceItem.objects.create_items(invoice, invoice_items)
+    invoices_changed.send(sender=Invoice, invoice_ids=[invoice.pk])
+
+
+class DigitizationWorker:
+    """
+    Claims queued digitization jobs and runs the configured processor on their invoices in a pool of threads. Any
+    number of workers can run side by side, the queue makes sure every job is claimed by a single worker
+    """
+
+    def __init__(self, concurrency=None, processor=None):
+        config = getattr(settings, 'INVOICE_DIGITIZATION', {})
+        self.concurrency = concurrency or config.get('CONCURRENCY', 4)
+        self.processor = processor or import_string(config.get('PROCESSOR', 'invoice.workers.extract_document'))
+        self.poll_interval = config.get('POLL_INTERVAL', 1)
+        self.max_attempts = config.get('MAX_ATTEMPTS', 3)
+        self.job_timeout = config.get('JOB_TIMEOUT', 300)
+
+    def run(self, once=False):
+        """
+        Processes jobs until stopped
+        :param once: Stop as soon as the queue is empty
+        :return: Number of processed jobs
+        """
+        processed = 0
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                while True:
+                    batch = self.run_batch(pool)
+                    processed += batch
+                    if not batch:
+                        if once:
+                            return processed
+                        time.sleep(self.poll_interval)
+        finally:
+            close_extraction_pool()
+
+    def run_batch(self, pool):
+        DigitizationJob.objects.requeue_stale(self.job_timeout, self.max_attempts)
+        jobs = DigitizationJob.objects.claim(self.concurrency)
+        results = list(pool.map(self.process, jobs))
+        for job, error in zip(jobs, results):
+            self.finish(job, error)
+        return len(jobs)
+
+    def process(self, job):
+        """
+        Runs the processor on the invoice of a job
+        :param job: DigitizationJob object
+        :return: Error message, or None when the job succeeded
+        """
+        try:
+            self.processor(job.invoice)
+        except Exception as error:
+            logger.exception('Digitization job %s failed', job.pk)
+            return str(error) or error.__class__.__name__
+        finally:
+            close_old_connections()
+        return None
+
+    def finish(self, job, error):
+        if error is None:
+            status = DigitizationJob.DONE
+        elif job.attempts < self.max_attempts:
+            status = DigitizationJob.PENDING
+        else:
+            status = DigitizationJob.FAILED
+        # Only the worker holding the claim may finish the job, it could have been requeued in the meantime
+        DigitizationJob.objects.filter(pk=job.pk, claimed_by=job.claimed_by).update(
+            status=status, error=error or '', updated_at=timezone.now())
@@ -0,0 +1,251 @@
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import JsonResponse
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+
+# Upper bounds of the histogram buckets, the last bucket counts everything above
+MILLISECOND_BOUNDS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+COUNT_BOUNDS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+BYTE_BOUNDS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+HISTOGRAMS = {
+    'duration_ms': MILLISECOND_BOUNDS,
+    'db_ms': MILLISECOND_BOUNDS,
+    'serialize_ms': MILLISECOND_BOUNDS,
+    'queries': COUNT_BOUNDS,
+    'duplicate_queries': COUNT_BOUNDS,
+    'response_bytes': BYTE_BOUNDS,
+}
+
+_state = threading.local()
+
+
+def get_metrics_config():
+    config = {'ENABLED': False, 'SERVER_TIMING': True}
+    config.update(getattr(settings, 'REQUEST_METRICS', {}))
+    return config
+
+
+class RequestMetrics:
+    """
+    Queries and timings of one request. Queries are told apart by their SQL without the parameters, so the same
+    statement run once per row, as by Invoice.total or nested serializers, shows up as duplicates
+    """
+
+    def __init__(self):
+        self.statements = Counter()
+        self.query_count = 0
+        self.db_time = 0.0
+        self.timings = Counter()
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.query_count += 1
+            self.statements[sql] += 1
+
+    def add_time(self, name, seconds):
+        self.timings[name] += seconds
+
+    @property
+    def duplicate_queries(self):
+        return self.query_count - len(self.statements)
+
+    def get_most_repeated(self):
+        """
+        :return: Tuple of the SQL run the most times and its count, None when no statement ran twice
+        """
+        if not self.statements:
+            return None
+        sql, count = self.statements.most_common(1)[0]
+        return (sql, count) if count > 1 else None
+
+
+@contextmanager
+def collect_metrics():
+    """
+    Records the queries run on every database connection of the current thread and the time spent in timed()
+    blocks while the block runs
+    :return: RequestMetrics object
+    """
+    metrics = RequestMetrics()
+    previous = getattr(_state, 'metrics', None)
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(metrics.record_query))
+        _state.metrics = metrics
+        try:
+            yield metrics
+        finally:
+            _state.metrics = previous
+
+
+@contextmanager
+def timed(name):
+    """
+    Adds the time spent in the block to the metrics of the current request, does nothing when no metrics are being
+    collected
+    :param name: Timing name, e.g. serialize
+    :return:
+    """
+    metrics = getattr(_state, 'metrics', None)
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_time(name, time.perf_counter() - start)
+
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.bounds) and value > self.bounds[index]:
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def to_dict(self):
+        labels = ['le_%s' % bound for bound in self.bounds] + ['inf']
+        return {'count': self.count, 'sum': round(self.sum, 3), 'max': round(self.max, 3),
+                'mean': round(self.sum / self.count, 3) if self.count else None,
+                'buckets': dict(zip(labels, self.buckets))}
+
+
+class MetricsRegistry:
+    """
+    Histograms of the request metrics per view, kept per process
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def record(self, view, values, most_repeated=None):
+        """
+        :param view: View name
+        :param values: Dict of the values observed, keyed by histogram name
+        :param most_repeated: Tuple of the SQL run the most times by the request and its count
+        :return:
+        """
+        with self.lock:
+            entry = self.views.get(view)
+            if entry is None:
+                entry = self.views[view] = {'histograms': {name: Histogram(bounds) for name, bounds in
+                                                           HISTOGRAMS.items()}, 'most_repeated': None}
+            for name, value in values.items():
+                if value is not None:
+                    entry['histograms'][name].observe(value)
+            if most_repeated and (entry['most_repeated'] is None or most_repeated[1] > entry['most_repeated'][1]):
+                entry['most_repeated'] = most_repeated
+
+    def snapshot(self):
+        with self.lock:
+            return {view: dict({name: histogram.to_dict() for name, histogram in entry['histograms'].items()},
+                               most_repeated_query=None if entry['most_repeated'] is None else
+                               {'sql': entry['most_repeated'][0], 'count': entry['most_repeated'][1]})
+                    for view, entry in sorted(self.views.items())}
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+
+
+registry = MetricsRegistry()
+
+
+def get_view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return '%s %s' % (request.method, match.view_name if match is not None else '<unresolved>')
+
+
+def get_response_size(response):
+    if response.streaming:
+        return None
+    return len(response.content)
+
+
+def format_server_timing(metrics, duration):
+    """
+    :param metrics: RequestMetrics object
+    :param duration: Request duration in seconds
+    :return: Server-Timing header value, durations in milliseconds
+    """
+    entries = ['db;dur=%.1f;desc="%s queries, %s duplicates"' % (metrics.db_time * 1000, metrics.query_count,
+                                                                 metrics.duplicate_queries)]
+    entries += ['%s;dur=%.1f' % (name, seconds * 1000) for name, seconds in sorted(metrics.timings.items())]
+    entries.append('total;dur=%.1f' % (duration * 1000))
+    return ', '.join(entries)
+
+
+class RequestMetricsMiddleware:
+    """
+    Records the duration, number and time of SQL queries, duplicate queries, serialization time and response size
+    of every request as histograms per view, served by metrics_view, and sends them in a Server-Timing header.
+    Opt-in with REQUEST_METRICS['ENABLED'], when disabled Django leaves the middleware out at startup. Queries run
+    while a streaming response is consumed are not counted
+    """
+
+    def __init__(self, get_response):
+        config = get_metrics_config()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.server_timing = config['SERVER_TIMING']
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        with collect_metrics() as metrics:
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+        registry.record(get_view_name(request), {
+            'duration_ms': duration * 1000,
+            'db_ms': metrics.db_time * 1000,
+            'serialize_ms': metrics.timings['serialize'] * 1000 if 'serialize' in metrics.timings else None,
+            'queries': metrics.query_count,
+            'duplicate_queries': metrics.duplicate_queries,
+            'response_bytes': get_response_size(response),
+        }, metrics.get_most_repeated())
+        if self.server_timing:
+            response['Server-Timing'] = format_server_timing(metrics, duration)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after this hook, the rendering counts as serialization
+        metrics = getattr(_state, 'metrics', None)
+        if metrics is not None:
+            start = time.perf_counter()
+            response.add_post_render_callback(lambda _: metrics.add_time('serialize', time.perf_counter() - start))
+        return response
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsAdminUser])
+def metrics_view(request):
+    """
+    Request metrics histograms of the current process per view
+    :param request:
+    :return: Whether metrics are collected and the histograms of every view
+    """
+    return JsonResponse({'enabled': get_metrics_config()['ENABLED'], 'views': registry.snapshot()})
@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'plate_iq.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -120,20 +121,127 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Uploaded invoice documents, stored through DEFAULT_FILE_STORAGE
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+MEDIA_URL = '/media/'
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny'
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_jwt.authentication.JSONWebTokenAuthentication',
+        'invoice.authentication.CachedJSONWebTokenAuthentication',
     ),
     'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.coreapi.AutoSchema',
+    'DEFAULT_PAGINATION_CLASS': 'invoice.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
 }
 
+# Largest page size clients can request through the `page_size` query parameter
+MAX_PAGE_SIZE = 500
+
 JWT_AUTH = {
     'JWT_EXPIRATION_DELTA': datetime.timedelta(days=180),
     'JWT_ALLOW_REFRESH': True,
     'JWT_REFRESH_EXPIRATION_DELTA': datetime.timedelta(days=7),
 }
 
+# Users authenticated by their JWT are cached per process for TTL seconds, saving the user query of every request.
+# Saving or deleting a user drops its entry at once, changes made in other processes show up after the TTL
+INVOICE_USER_CACHE = {
+    'MAX_ENTRIES': 10000,
+    'TTL': 60,
+}
+
 CORS_EXPOSE_HEADERS = ['Authorization']
+
+# Allocator handing out the numbers of invoices created without one. The block allocator reserves `block_size`
+# numbers of a database sequence per process at a time
+INVOICE_NUMBER_ALLOCATOR = {
+    'BACKEND': 'invoice.allocators.BlockInvoiceNumberAllocator',
+    'OPTIONS': {
+        'block_size': 100,
+        'number_format': 'INV{:010d}',
+    },
+}
+
+# Digitization job queue, processed by `manage.py run_digitization_worker`. PDFs are parsed in a pool of PROCESSES
+# worker processes (one per core by default), CONCURRENCY should be at least as large to keep them busy
+INVOICE_DIGITIZATION = {
+    'PROCESSOR': 'invoice.workers.extract_document',
+    'CONCURRENCY': 4,
+    'POLL_INTERVAL': 1,
+    'MAX_ATTEMPTS': 3,
+    'JOB_TIMEOUT': 300,
+    'PROCESSES': None,
+    'EXTRACTION_TIMEOUT': 60,
+    'MAX_TASKS_PER_PROCESS': 100,
+    'START_METHOD': 'spawn',
+}
+
+# Resumable chunked uploads. Chunks are written to DIRECTORY, `MEDIA_ROOT/partial` by default, until the upload is
+# finished; unfinished uploads are deleted after EXPIRY seconds
+INVOICE_CHUNKED_UPLOADS = {
+    'DIRECTORY': None,
+    'MAX_SIZE': 25 * 1024 * 1024,
+    'MAX_CHUNK_SIZE': 5 * 1024 * 1024,
+    'EXPIRY': 24 * 60 * 60,
+}
+
+# Long polling and server-sent events of the digitization status. MAX_WAIT is the longest long poll and MAX_IDS the
+# number of invoices one stream can follow, streams send a comment every HEARTBEAT seconds and end after
+# STREAM_TIMEOUT seconds. Waiters read the invoices again at least every POLL_INTERVAL seconds, which picks up the
+# changes made by other processes
+INVOICE_STATUS_EVENTS = {
+    'MAX_WAIT': 30,
+    'MAX_IDS': 100,
+    'HEARTBEAT': 15,
+    'POLL_INTERVAL': 5,
+    'STREAM_TIMEOUT': 300,
+}
+
+# Cache of the rendered invoice detail responses, entries are only served for the invoice version they were rendered
+# from. The default keeps the responses in process, invoice.caches.DjangoResponseCache stores them in one of the
+# CACHES instead, e.g. a file based cache shared by the processes of a host:
+#   {'BACKEND': 'invoice.caches.DjangoResponseCache', 'OPTIONS': {'cache_alias': 'default', 'timeout': 300}}
+INVOICE_RESPONSE_CACHE = {
+    'BACKEND': 'invoice.caches.LRUResponseCache',
+    'OPTIONS': {
+        'max_entries': 1000,
+        'max_bytes': 32 * 1024 * 1024,
+    },
+}
+
+# Full text search of the invoices, backed by FTS5 tables on SQLite and by LIKE queries on other databases. Only the
+# MAX_RESULTS best matches can be paged through. Searches matching more than MAX_CANDIDATES invoices or items are
+# not ranked, those matches are listed newest first
+INVOICE_SEARCH = {
+    'MAX_RESULTS': 1000,
+    'MAX_CANDIDATES': 2000,
+}
+
+# Per request SQL query, duplicate query, serialization and response size metrics, aggregated per view and served
+# by GET /internal/metrics, with a Server-Timing header on every response. Off by default, the middleware is then
+# left out of the request handling entirely
+REQUEST_METRICS = {
+    'ENABLED': False,
+    'SERVER_TIMING': True,
+}
+
+# Item amounts are quantity times price rounded to cents. Batches of at least NUMPY_MIN_ITEMS items, like the items
+# of an import chunk, are computed with NumPy when it is installed
+INVOICE_AMOUNTS = {
+    'NUMPY_MIN_ITEMS': 1000,
+}
+
+# Maximum number of invoices digitized by one request of the batch digitize API
+INVOICE_DIGITIZE_BATCH_SIZE = 500
+
+# Number of invoice items written per INSERT statement
+INVOICE_ITEM_BATCH_SIZE = 500
+
+# Number of invoices read from the database at once by the export API
+INVOICE_EXPORT_CHUNK_SIZE = 500
+
+# Number of invoices validated and written per transaction by bulk imports
+INVOICE_IMPORT_CHUNK_SIZE = 1000
@@ -18,10 +18,13 @@ from django.urls import path, include
 from django.conf.urls import url
 from rest_framework_swagger.views import get_swagger_view
 
+from plate_iq.metrics import metrics_view
+
 schema_view = get_swagger_view(title='Invoice API')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('v1/', include('invoice.urls')),
+    path('internal/metrics', metrics_view, name='request-metrics'),
     url(r'^$', schema_view)
 ]